@@ -2,3 +2,8 @@
 from ._version import get_versions
 __version__ = get_versions()['version']
 del get_versions
+
+
+def _jupyter_server_extension_points():
+    """Declares the jupyter_server extension in kernda.serverext."""
+    return [{'module': 'kernda.serverext'}]
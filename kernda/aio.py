@@ -0,0 +1,194 @@
+"""asyncio versions of the kernda API for use inside event loops.
+
+The blocking parts of `kernda.api.build_spec` are running ``conda info``,
+running the activation to capture a snapshot and file I/O. Here the
+subprocesses run with `asyncio.create_subprocess_exec`, so they do not
+block the loop and are killed when the awaiting task is cancelled or
+times out. The remaining file system work runs in a bounded thread pool.
+
+Example::
+
+    from kernda import aio
+
+    async def refresh(path):
+        spec = await aio.read_spec(path)
+        result = await aio.build_spec(spec, mode='snapshot', timeout=30)
+        await aio.write_spec(path, result.spec)
+
+Requires Python 3.5+.
+"""
+import asyncio
+import functools
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from subprocess import CalledProcessError
+
+from . import api, backends
+from .environ import diff_env
+from .modules import load_command
+from .snapshot import load_snapshot, take_snapshot
+
+# Maximum number of concurrent file system jobs
+MAX_WORKERS = 4
+
+_executor = None
+
+
+def get_executor():
+    """Gets the bounded executor used for file I/O."""
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+    return _executor
+
+
+def set_executor(executor):
+    """Replaces the executor used for file I/O, e.g. to share a pool."""
+    global _executor
+    _executor = executor
+
+
+async def run_in_executor(func, *args, **kwargs):
+    """Runs a blocking function in the bounded executor."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        get_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def check_output(cmd, timeout=None, env=None):
+    """Runs a command and returns its stdout without blocking the loop.
+
+    The process is killed when the timeout expires or the calling task
+    is cancelled.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If the command exits with a non-zero status
+    asyncio.TimeoutError
+        If the command does not finish within timeout seconds
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.DEVNULL, env=env)
+    try:
+        stdout, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except BaseException:
+        if proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+        raise
+    if proc.returncode:
+        raise CalledProcessError(proc.returncode, cmd, stdout)
+    return stdout
+
+
+async def resolve_conda_prefix(env_dir, timeout=None):
+    """Runs ``conda info`` if resolving env_dir's activate script needs it.
+
+    The result lands in the same in-process cache `kernda.api` uses.
+    """
+    if backends.needs_conda_info(env_dir):
+        output = await check_output(backends.CONDA_INFO_CMD, timeout)
+        backends.set_conda_info_prefix(backends.parse_conda_info(output))
+
+
+async def run_shell_env(script, timeout=None, environ=None):
+    """Async version of `kernda.backends.run_shell_env`."""
+    env = dict(os.environ if environ is None else environ)
+    output = await check_output(backends.shell_env_command(script), timeout, env)
+    return json.loads(output.decode('utf8'))
+
+
+async def capture(backend, env_dir, modules=(), timeout=None, environ=None):
+    """Async version of `kernda.backends.Backend.capture`."""
+    prelude = load_command(modules)
+    if backend.name == 'conda':
+        await resolve_conda_prefix(env_dir, timeout)
+    script = await run_in_executor(backend.capture_script, env_dir, prelude)
+    if script is None:
+        return backend.capture(env_dir, environ, prelude)
+    tasks = [asyncio.ensure_future(run_shell_env('true', timeout, environ)),
+             asyncio.ensure_future(run_shell_env(script, timeout, environ))]
+    try:
+        before, after = await asyncio.gather(*tasks)
+    except BaseException:
+        # Do not leave the other shell running when one fails
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    return diff_env(before, after)
+
+
+async def get_snapshot(backend, env_dir, modules=(), refresh=False, timeout=None):
+    """Async version of `kernda.snapshot.get_snapshot`.
+
+    Returns
+    -------
+    tuple
+        (entry, hit) where hit is True when the cached entry was fresh
+    """
+    if not refresh:
+        entry = await run_in_executor(load_snapshot, backend, env_dir, modules=modules)
+        if entry is not None:
+            return entry, True
+    diff = await capture(backend, env_dir, modules, timeout)
+    entry = await run_in_executor(take_snapshot, backend, env_dir, modules, diff=diff)
+    return entry, False
+
+
+async def build_spec(spec, timeout=None, **options):
+    """Async version of `kernda.api.build_spec`.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec
+    timeout : float, optional
+        Seconds to allow for each subprocess (default: no limit)
+    options
+        Keyword arguments of `kernda.api.build_spec`
+
+    Returns
+    -------
+    kernda.api.BuildResult
+
+    Raises
+    ------
+    kernda.api.KerndaError
+        Like `kernda.api.build_spec`, also when activation times out
+    """
+    spec_env_dir, bin_dir = api.resolve_env_dir(spec, options.get('env_dir'))
+    name = options.get('backend')
+    if name:
+        try:
+            backend = backends.get_backend(name)
+        except KeyError:
+            raise api.KerndaError("unknown activation backend {}".format(name))
+    else:
+        backend = await run_in_executor(backends.detect_backend, spec_env_dir)
+
+    modules = options.get('modules') or ()
+    mode = options.get('mode') or ('snapshot' if modules else backend.default_mode)
+    try:
+        if backend.name == 'conda':
+            await resolve_conda_prefix(spec_env_dir, timeout)
+        if mode == 'snapshot' and mode in backend.launch_modes:
+            # Warm the cache so the build below does not capture synchronously
+            await get_snapshot(backend, spec_env_dir, modules,
+                               refresh=options.pop('refresh', False), timeout=timeout)
+    except (CalledProcessError, ValueError, OSError, asyncio.TimeoutError):
+        raise api.activation_error(backend.name, bin_dir)
+    return await run_in_executor(api.build_spec, spec, **options)
+
+
+async def read_spec(path):
+    """Async version of `kernda.api.read_spec`."""
+    return await run_in_executor(api.read_spec, path)
+
+
+async def write_spec(path, spec):
+    """Async version of `kernda.api.write_spec`."""
+    return await run_in_executor(api.write_spec, path, spec)
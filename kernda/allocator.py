@@ -0,0 +1,201 @@
+"""Memory allocator profiles of kernels, behind ``--allocator``.
+
+glibc's malloc gives every thread that contends for memory its own arena,
+and memory freed in an arena is rarely returned to the system. So
+multithreaded kernels hold far more resident memory than they use. A
+profile changes the allocator of the kernel through its environment:
+
+* ``compact`` caps glibc at two arenas ($MALLOC_ARENA_MAX) and returns
+  freed memory to the system sooner ($MALLOC_TRIM_THRESHOLD_)
+* ``jemalloc`` and ``tcmalloc`` preload that allocator from the
+  environment's ``lib`` directory with $LD_PRELOAD
+
+Variables already set are left alone; preloads are put in front of an
+existing $LD_PRELOAD. `measure` compares the steady-state resident memory
+of a workload under each profile, see ``kernda allocators``.
+"""
+import json
+import os
+import subprocess
+from os.path import join as pjoin
+
+from .api import KerndaError
+from .util import percentile
+
+PROFILES = {
+    'default': {'env': {}, 'preload': ()},
+    'compact': {'env': {'MALLOC_ARENA_MAX': '2', 'MALLOC_TRIM_THRESHOLD_': '131072'},
+                'preload': ()},
+    'jemalloc': {'env': {'MALLOC_CONF': 'background_thread:true'},
+                 'preload': ('libjemalloc.so.2', 'libjemalloc.so')},
+    'tcmalloc': {'env': {}, 'preload': ('libtcmalloc_minimal.so.4', 'libtcmalloc.so.4',
+                                        'libtcmalloc_minimal.so', 'libtcmalloc.so')},
+}
+
+# Threads that allocate and free buffers of many sizes below glibc's mmap
+# threshold, keeping every 50th, which fragments its per-thread arenas
+WORKLOAD = '''
+import threading
+
+
+def churn(seed):
+    kept = []
+    for i in range(20):
+        batch = [bytearray(1024 + (seed * 7919 + j * 104729) % 65536) for j in range(500)]
+        kept.extend(batch[::50])
+        del batch
+    return kept
+
+
+results = []
+threads = [threading.Thread(target=lambda s=s: results.append(churn(s)))
+           for s in range(8)]
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+'''
+
+RUNNER = '''
+import gc, json, sys, time
+start = time.time()
+# Keep what the workload holds on to, like a kernel keeps its variables
+namespace = {'__name__': '__main__'}
+exec(compile(sys.argv[1], '<workload>', 'exec'), namespace)
+seconds = time.time() - start
+gc.collect()
+time.sleep(float(sys.argv[2]))
+status = {}
+try:
+    with open('/proc/self/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            status[key] = value.strip()
+    rss, peak = [int(status[k].split()[0]) * 1024 for k in ('VmRSS', 'VmHWM')]
+except (IOError, OSError, KeyError):
+    import resource
+    rss = peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps({'rss': rss, 'peak': peak, 'seconds': seconds}))
+'''
+
+
+def find_preload(profile, env_dir):
+    """Finds the library a profile preloads in an environment.
+
+    Returns
+    -------
+    str or None
+        Path of the library, None if the profile preloads nothing or the
+        library is missing
+    """
+    for name in PROFILES[profile]['preload']:
+        path = pjoin(env_dir, 'lib', name)
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def check_allocator(profile, env_dir):
+    """Makes sure an environment has what an allocator profile needs.
+
+    Returns
+    -------
+    str
+        Description of the profile for the spec
+
+    Raises
+    ------
+    KerndaError
+        If the profile preloads a library the environment does not have
+    """
+    if profile not in PROFILES:
+        raise KerndaError('unknown allocator profile {}; choose from {}'.format(
+            profile, ', '.join(sorted(PROFILES))))
+    settings = ['{}={}'.format(k, v) for k, v in sorted(PROFILES[profile]['env'].items())]
+    if PROFILES[profile]['preload']:
+        path = find_preload(profile, env_dir)
+        if path is None:
+            raise KerndaError(
+                '{} is not installed in {}'.format(profile, env_dir),
+                hint='Install it into the environment, e.g. conda install -c '
+                'conda-forge {}'.format('gperftools' if profile == 'tcmalloc' else profile))
+        settings.insert(0, 'LD_PRELOAD={}'.format(path))
+    return '{}: {}'.format(profile, ', '.join(settings) or 'no changes')
+
+
+def allocator_env(env, profile, env_dir):
+    """Applies an allocator profile to a kernel environment.
+
+    Returns
+    -------
+    dict
+        A copy of env
+
+    Raises
+    ------
+    KerndaError
+        If the profile preloads a library the environment does not have
+    """
+    env = dict(env)
+    for name, value in PROFILES[profile]['env'].items():
+        if not env.get(name):
+            env[name] = value
+    if PROFILES[profile]['preload']:
+        path = find_preload(profile, env_dir) if env_dir else None
+        if path is None:
+            raise KerndaError('{} is not installed in {}'.format(profile, env_dir))
+        env['LD_PRELOAD'] = ' '.join([path] + [p for p in env.get('LD_PRELOAD', '').split()
+                                               if p != path])
+    return env
+
+
+def measure(env_dir, profiles=None, workload=None, repeat=3, settle=1.0):
+    """Compares the steady-state resident memory of a workload per profile.
+
+    Runs the workload in the environment's interpreter once per profile
+    and repeat, then measures resident memory after a garbage collection
+    and settle seconds of rest.
+
+    Parameters
+    ----------
+    env_dir : str
+        Environment prefix
+    profiles : list, optional
+        Profiles to compare (default: all the environment supports)
+    workload : str, optional
+        Python source of the workload (default: `WORKLOAD`)
+    repeat : int, optional
+        Runs per profile; medians are reported
+    settle : float, optional
+        Seconds to wait after the workload before measuring
+
+    Returns
+    -------
+    list
+        One dict per profile with ``profile``, ``rss`` and ``peak`` (bytes),
+        ``seconds`` (workload run time) and ``error``
+    """
+    python = pjoin(env_dir, 'bin', 'python')
+    if not os.path.exists(python):
+        raise KerndaError('no interpreter found at {}'.format(python))
+    if profiles is None:
+        profiles = [p for p in sorted(PROFILES)
+                    if not PROFILES[p]['preload'] or find_preload(p, env_dir)]
+    results = []
+    for profile in profiles:
+        result = {'profile': profile, 'rss': None, 'peak': None, 'seconds': None, 'error': None}
+        try:
+            env = allocator_env(os.environ, profile, env_dir)
+            runs = []
+            for _ in range(max(1, repeat)):
+                out = subprocess.check_output(
+                    [python, '-c', RUNNER, workload or WORKLOAD, str(settle)], env=env)
+                runs.append(json.loads(out.decode('utf8').strip().splitlines()[-1]))
+            for key in ('rss', 'peak', 'seconds'):
+                result[key] = percentile(sorted(run[key] for run in runs), 50)
+        except KerndaError as e:
+            result['error'] = str(e)
+        except (subprocess.CalledProcessError, OSError, ValueError) as e:
+            result['error'] = 'workload failed: {}'.format(e)
+        results.append(result)
+    return results
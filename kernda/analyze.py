@@ -0,0 +1,228 @@
+"""Cost of ``site`` processing and sys.path of an environment.
+
+Behind ``kernda analyze-env``. Every interpreter start in an environment,
+including every kernel start, runs ``site``. It processes each ``.pth``
+file in site-packages, runs the import lines some of them hold (e.g. the
+finders of editable installs) and adds their directories to sys.path.
+Each sys.path entry then costs a ``stat`` for every module imported from
+a later entry, which adds up on network file systems.
+
+`analyze` runs `PROBE` in the environment's interpreter to time each
+``.pth`` file and the lookup cost of each sys.path entry. It then times
+whole interpreter starts to estimate what two launch options would save:
+
+* skipping the user site directory ($PYTHONNOUSERSITE, ``-s``)
+* freezing sys.path, i.e. starting without ``site`` (``-S``) and with the
+  computed sys.path; only safe when no ``.pth`` file runs code
+"""
+import json
+import os
+import subprocess
+from os.path import join as pjoin
+
+from .api import KerndaError
+from .doctor import time_argv
+
+# Variables that would make the measurements depend on the calling shell
+_CLEARED = ('PYTHONPATH', 'PYTHONHOME', 'PYTHONSTARTUP', 'PYTHONNOUSERSITE',
+            'PYTHONPROFILEIMPORTTIME')
+
+PROBE = '''
+import json, os, sys, time
+clock = getattr(time, 'perf_counter', time.time)
+# The directory of the -c script, which depends on where the kernel starts
+del sys.path[0]
+import site
+pth, parts = [], {}
+
+
+def timed(func, key=None):
+    def wrapper(*args, **kwargs):
+        start = clock()
+        before = len(sys.path)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            ms = (clock() - start) * 1000.0
+            if key:
+                parts[key] = parts.get(key, 0.0) + ms
+            else:
+                path = os.path.join(args[0], args[1])
+                try:
+                    with open(path) as f:
+                        lines = f.read().splitlines()
+                except (IOError, OSError):
+                    lines = []
+                pth.append({'path': path, 'ms': ms, 'paths_added': len(sys.path) - before,
+                            'executes': any(l.startswith(('import ', 'import\\t'))
+                                            for l in lines)})
+    return wrapper
+
+
+site.addpackage = timed(site.addpackage)
+for name in ('addusersitepackages', 'addsitepackages', 'execsitecustomize',
+             'execusercustomize'):
+    if hasattr(site, name):
+        setattr(site, name, timed(getattr(site, name), name))
+start = clock()
+site.main()
+site_ms = (clock() - start) * 1000.0
+
+from importlib.machinery import PathFinder
+entries = []
+for i, entry in enumerate(list(sys.path)):
+    sys.path_importer_cache.pop(entry, None)
+    start = clock()
+    PathFinder.find_spec('kernda_probe_cold', [entry])
+    cold = (clock() - start) * 1000.0
+    start = clock()
+    for j in range(20):
+        PathFinder.find_spec('kernda_probe_{}'.format(j), [entry])
+    entries.append({'path': entry, 'index': i, 'exists': os.path.exists(entry),
+                    'cold_ms': cold, 'lookup_us': (clock() - start) * 1e6 / 20})
+print(json.dumps({
+    'site_ms': site_ms, 'parts': parts, 'pth': pth, 'entries': entries,
+    'sys_path': sys.path, 'user_site': getattr(site, 'USER_SITE', None),
+    'user_site_enabled': bool(site.ENABLE_USER_SITE),
+}))
+'''
+
+
+def clean_environ(environ=None):
+    """Copies an environment without the variables that change ``site``."""
+    env = dict(os.environ if environ is None else environ)
+    for name in _CLEARED:
+        env.pop(name, None)
+    return env
+
+
+def probe(python, env=None):
+    """Runs `PROBE` in an interpreter and returns its measurements."""
+    out = subprocess.check_output([python, '-S', '-c', PROBE], env=env)
+    return json.loads(out.decode('utf8'))
+
+
+def analyze(prefix, top=10, repeat=5):
+    """Measures the ``site`` and sys.path cost of an environment.
+
+    Parameters
+    ----------
+    prefix : str
+        Environment prefix
+    top : int, optional
+        Number of .pth files and sys.path entries to list
+    repeat : int, optional
+        Runs per interpreter start timing; the fastest is reported
+
+    Returns
+    -------
+    dict
+        ``python``, ``site_ms`` (time in ``site``), ``parts`` (its phases),
+        ``pth_count`` and ``pth`` (the slowest .pth files, with the
+        ``runs`` it took ``site`` to process them), ``entries``
+        (the costliest sys.path entries), ``lookup_us`` (stat cost of one
+        import over all of sys.path), ``starts_ms`` (interpreter start
+        times with ``site``, without user site and with a frozen sys.path)
+        and ``savings`` (estimates per launch option)
+
+    Raises
+    ------
+    KerndaError
+        If the environment has no working interpreter
+    """
+    python = pjoin(prefix, 'bin', 'python')
+    if not os.path.exists(python):
+        raise KerndaError('no interpreter found at {}'.format(python))
+    env = clean_environ()
+    try:
+        result = probe(python, env)
+        frozen = 'import sys; sys.path[:] = {!r}'.format(result['sys_path'])
+        starts = {
+            'bare': time_argv([python, '-S', '-c', 'pass'], env, repeat),
+            'site': time_argv([python, '-c', 'pass'], env, repeat),
+            'no_user_site': time_argv([python, '-s', '-c', 'pass'], env, repeat),
+            'frozen': time_argv([python, '-S', '-c', frozen], env, repeat),
+        }
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        raise KerndaError('could not run {}: {}'.format(python, e))
+
+    # Some interpreters process the site-packages of venvs twice
+    pth, entries = [], result['entries']
+    by_path = {}
+    for item in result['pth']:
+        if item['path'] in by_path:
+            merged = by_path[item['path']]
+            merged['ms'] += item['ms']
+            merged['paths_added'] += item['paths_added']
+            merged['runs'] += 1
+        else:
+            by_path[item['path']] = dict(item, runs=1)
+            pth.append(by_path[item['path']])
+    executes = [p['path'] for p in pth if p['executes']]
+    user_pth = [p for p in pth if result['user_site'] and
+                p['path'].startswith(result['user_site'] + os.sep)]
+    savings = [{
+        'option': 'no user site',
+        'ms': max(0.0, starts['site'] - starts['no_user_site']),
+        'safe': True,
+        'detail': ('user site {} adds {} .pth files'.format(result['user_site'], len(user_pth))
+                   if result['user_site_enabled'] else 'user site is already disabled'),
+    }, {
+        'option': 'frozen sys.path',
+        'ms': max(0.0, starts['site'] - starts['frozen']),
+        'safe': not executes,
+        'detail': ('{} .pth files run code that a frozen sys.path would skip'.format(
+            len(executes)) if executes else 'no .pth file runs code'),
+        'executes': executes,
+    }]
+    return {
+        'python': python,
+        'site_ms': result['site_ms'],
+        'parts': result['parts'],
+        'pth_count': len(pth),
+        'pth': sorted(pth, key=lambda p: -p['ms'])[:top],
+        'path_entries': len(entries),
+        'entries': sorted(entries, key=lambda e: -(e['cold_ms'] + e['lookup_us'] / 1000.0))[:top],
+        'missing_entries': [e['path'] for e in entries if not e['exists']],
+        'lookup_us': sum(e['lookup_us'] for e in entries),
+        'starts_ms': starts,
+        'savings': savings,
+    }
+
+
+def format_analysis(analysis):
+    """Formats an `analyze` result as text.
+
+    Returns
+    -------
+    list
+        Lines of text
+    """
+    starts = analysis['starts_ms']
+    lines = [
+        'Interpreter start: {:.1f}ms, {:.1f}ms of it without site'.format(
+            starts['site'], starts['bare']),
+        'site processing: {:.1f}ms for {} .pth files, {} sys.path entries'.format(
+            analysis['site_ms'], analysis['pth_count'], analysis['path_entries']),
+        'Each import found late on sys.path pays {:.0f}us of lookups'.format(
+            analysis['lookup_us']),
+        '',
+        'Slowest .pth files:',
+    ]
+    for item in analysis['pth']:
+        notes = (['runs code'] if item['executes'] else []) + (
+            ['processed {} times'.format(item['runs'])] if item['runs'] > 1 else [])
+        lines.append('  {:>8.2f}ms  +{:<3} {}{}'.format(
+            item['ms'], item['paths_added'], item['path'],
+            '  ({})'.format(', '.join(notes)) if notes else ''))
+    lines.extend(['', 'Costliest sys.path entries (first lookup, then per import):'])
+    for entry in analysis['entries']:
+        lines.append('  {:>8.2f}ms {:>7.1f}us  {}{}'.format(
+            entry['cold_ms'], entry['lookup_us'], entry['path'],
+            '' if entry['exists'] else '  (missing)'))
+    lines.extend(['', 'Estimated savings per start:'])
+    for saving in analysis['savings']:
+        lines.append('  {:<16} {:>7.1f}ms  {}{}'.format(
+            saving['option'], saving['ms'], saving['detail'],
+            '' if saving['safe'] else ' (unsafe)'))
+    return lines
@@ -0,0 +1,332 @@
+"""Python API for adding environment activation to kernel specs.
+
+`build_spec` does what the ``kernda`` command does, in memory: it takes a
+kernel spec dict and returns the new spec dict plus diagnostics without
+printing or writing anything. It is safe to call from multiple threads.
+
+Example::
+
+    from kernda.api import build_spec, read_spec, write_spec
+
+    spec = read_spec('/usr/local/share/jupyter/kernels/py3/kernel.json')
+    result = build_spec(spec, env_dir='/opt/envs/py3', mode='snapshot')
+    for diag in result.diagnostics:
+        log.info('%s: %s', diag['level'], diag['message'])
+    write_spec('/srv/kernels/py3/kernel.json', result.spec)
+
+Activate script lookups and backend discovery are cached in-process and
+activation snapshots are cached on disk, so building many specs for the
+same environments only pays for that work once.
+"""
+import argparse
+import copy
+import json
+import os
+import stat
+import subprocess
+from collections import namedtuple
+from os.path import dirname
+
+from . import backends, registry, resources
+from .cache import atomic_write
+from .environ import apply_env_diff, env_size, normalize_env
+from .launch import launcher_args, normalize_options
+from .snapshot import get_snapshot, take_snapshot
+
+BuildResult = namedtuple('BuildResult', ['spec', 'diagnostics'])
+
+
+class KerndaError(Exception):
+    """Raised when a kernel spec cannot be built.
+
+    Attributes
+    ----------
+    hint : str or None
+        Suggestion on how to fix the problem
+    """
+    def __init__(self, message, hint=None):
+        super(KerndaError, self).__init__(message)
+        self.hint = hint
+
+
+def _diagnostic(level, message, **details):
+    diag = {'level': level, 'message': message}
+    diag.update(details)
+    return diag
+
+
+def resolve_env_dir(spec, env_dir=None):
+    """Determines the environment a kernel spec should activate.
+
+    Treat the path provided by the user as the environment we want to
+    activate. If the user did not provide a path, assume the path
+    containing the kernel executable is the desired environment.
+
+    Returns
+    -------
+    tuple
+        (env_dir, bin_dir)
+    """
+    bin_dir = env_dir
+    original_argv = spec.get("_kernda_original_argv") or spec['argv']
+    if not bin_dir:
+        executable = original_argv[0]
+        bin_dir = dirname(executable)
+    elif not os.path.exists(bin_dir):
+        raise KerndaError("{} does not exist".format(bin_dir))
+
+    # Add the bin subdir to the path if it's not already included.
+    if not bin_dir.endswith('bin'):
+        bin_dir += os.path.sep + 'bin'
+    return dirname(bin_dir), bin_dir
+
+
+def activation_error(backend_name, bin_dir):
+    """Describes a failed activation the way `build_spec` reports it.
+
+    Returns
+    -------
+    KerndaError
+    """
+    return KerndaError(
+        "Could not determine the location of the activation script associated with {}".format(bin_dir),
+        hint="Verify that the `{}` activation works in your current shell".format(backend_name))
+
+
+def build_spec(spec, env_dir=None, backend=None, mode=None, start_args='',
+               modules=(), display_name=None, conda_activate=False,
+               launcher_options=None, refresh=False, name=None):
+    """Adds environment activation to a kernel spec.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec, possibly already processed by kernda; it is not modified
+    env_dir : str, optional
+        Environment to activate (default: the one containing the kernel
+        executable)
+    backend : str, optional
+        Activation backend name (default: detected)
+    mode : str, optional
+        Launch mode (default: the backend's preferred mode, or snapshot
+        when modules are given)
+    start_args : str, optional
+        Extra arguments for the kernel start command, in shell syntax
+    modules : list, optional
+        Environment Modules to load before activation
+    display_name : str, optional
+        New display name
+    conda_activate : bool, optional
+        Use 'conda activate' instead of 'source activate' in source mode
+    launcher_options : dict, optional
+        Launcher options keyed by their argparse dest, e.g.
+        ``{'normalize': True, 'prune_prefixes': ['/nfs']}``
+    refresh : bool, optional
+        Capture a new activation snapshot even if the cached one is fresh
+    name : str, optional
+        Kernel spec name, i.e. the name of its directory, for the launch log
+
+    Returns
+    -------
+    BuildResult
+        (spec, diagnostics) where diagnostics is a list of dicts with
+        ``level`` and ``message`` keys
+
+    Raises
+    ------
+    KerndaError
+        If the spec cannot be built
+    """
+    spec = copy.deepcopy(spec)
+    diagnostics = []
+    modules = list(modules)
+    launcher_options = dict(launcher_options or {})
+    original_argv = spec.get("_kernda_original_argv") or spec['argv']
+    env_dir, bin_dir = resolve_env_dir(spec, env_dir)
+
+    if backend:
+        try:
+            backend_obj = backends.get_backend(backend)
+        except KeyError:
+            raise KerndaError("unknown activation backend {}".format(backend))
+    else:
+        backend_obj = backends.detect_backend(env_dir)
+        diagnostics.append(_diagnostic('info', 'detected {} environment at {}'.format(
+            backend_obj.name, env_dir), backend=backend_obj.name))
+    # Loading modules on every start is what snapshots are meant to avoid
+    mode = mode or ('snapshot' if modules else backend_obj.default_mode)
+    if mode not in backend_obj.launch_modes:
+        raise KerndaError("the {} backend does not support the {} launch mode".format(
+            backend_obj.name, mode))
+    if modules and mode == 'direct':
+        raise KerndaError("modules cannot be loaded in direct launch mode")
+
+    namespace = argparse.Namespace(**launcher_options)
+    try:
+        problems = resources.check_limits(launcher_options)
+    except ValueError as e:
+        raise KerndaError(str(e))
+    for problem in problems:
+        diagnostics.append(_diagnostic('warning', problem))
+    allocator = None
+    if launcher_options.get('allocator'):
+        from .allocator import check_allocator
+        if mode == 'source':
+            # The launcher would change the allocator of bash and the activation too
+            raise KerndaError('--allocator does not work in the source launch mode',
+                              hint='Use --mode snapshot, or --mode direct where the '
+                              'backend supports it')
+        allocator = check_allocator(launcher_options['allocator'], env_dir)
+    if launcher_options.get('profile') and mode == 'source':
+        # The activation script's own Python processes would be profiled too
+        raise KerndaError('--profile does not work in the source launch mode',
+                          hint='Use --mode snapshot, or --mode direct where the '
+                          'backend supports it')
+    try:
+        argv = backend_obj.launch_argv(env_dir, original_argv, mode=mode,
+                                       start_args=start_args,
+                                       modules=modules,
+                                       launcher_args=launcher_args(namespace),
+                                       spec_name=name,
+                                       conda_activate=conda_activate)
+        # Capture the activation now so the first kernel start is warm
+        if mode == 'snapshot':
+            if refresh:
+                entry, hit = take_snapshot(backend_obj, env_dir, modules), False
+            else:
+                entry, hit = get_snapshot(backend_obj, env_dir, modules)
+            diagnostics.append(_diagnostic(
+                'info', 'activation snapshot {}'.format('reused' if hit else 'captured'),
+                cache_hit=hit))
+    except (subprocess.CalledProcessError, ValueError, OSError):
+        raise activation_error(backend_obj.name, bin_dir)
+
+    options = normalize_options(namespace)
+    if mode == 'snapshot' and options is not None:
+        # Show what normalization does to the environment of this process
+        env = apply_env_diff(entry['diff'])
+        diff_keys = set(entry['diff']['set']) | set(entry['diff']['prepend'])
+        _, report = normalize_env(env, keep=diff_keys, **options)
+        diagnostics.append(_diagnostic(
+            'info', 'environment normalization saves {} of {} bytes'.format(
+                sum(item['bytes'] for item in report), env_size(env)),
+            report=report, env_size=env_size(env)))
+
+    spec['argv'] = argv
+    spec['_kernda_original_argv'] = original_argv
+    spec['_kernda_env_dir'] = env_dir
+    spec['_kernda_backend'] = backend_obj.name
+    spec['_kernda_mode'] = mode
+    # Everything needed to build the spec again, e.g. after the env changed
+    spec['_kernda_options'] = {
+        'start_args': start_args,
+        'modules': modules,
+        'conda_activate': conda_activate,
+        'launcher_options': launcher_options,
+        'name': name,
+    }
+
+    limits = resources.describe_limits(launcher_options)
+    if allocator:
+        limits['allocator'] = allocator
+    if limits:
+        # Readable summary of the limits the launcher applies
+        spec['_kernda_limits'] = limits
+    else:
+        spec.pop('_kernda_limits', None)
+
+    if display_name:
+        spec['display_name'] = display_name
+    return BuildResult(spec, diagnostics)
+
+
+def rebuild_spec(spec, refresh=False):
+    """Builds a kernda spec again with the options it was built with.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec previously returned by `build_spec`
+    refresh : bool, optional
+        Capture a new activation snapshot even if the cached one is fresh
+
+    Returns
+    -------
+    BuildResult
+    """
+    options = spec.get('_kernda_options', {})
+    return build_spec(spec,
+                      env_dir=spec.get('_kernda_env_dir'),
+                      backend=spec.get('_kernda_backend'),
+                      mode=spec.get('_kernda_mode'),
+                      refresh=refresh,
+                      **options)
+
+
+def is_kernda_spec(spec):
+    """Returns True if a kernel spec was built by kernda."""
+    return '_kernda_original_argv' in spec
+
+
+def read_spec(path):
+    """Reads a kernel spec from a kernel.json file."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def _spec_mode(path):
+    """Gets the permissions of path, or those a new file would get."""
+    try:
+        return stat.S_IMODE(os.stat(path).st_mode)
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_spec(path, spec):
+    """Writes a kernel spec to a kernel.json file atomically.
+
+    The file keeps its permissions, so specs under shared prefixes stay
+    readable by other users. kernda specs are recorded in the registry of
+    managed specs.
+    """
+    atomic_write(path, json.dumps(spec, indent=2), mode=_spec_mode(path))
+    if is_kernda_spec(spec) and '_kernda_env_dir' in spec:
+        registry.register(path, spec)
+
+
+def refresh_specs(paths=None, env_dir=None, refresh=False):
+    """Rebuilds and rewrites managed kernel specs.
+
+    Parameters
+    ----------
+    paths : list, optional
+        kernel.json paths (default: all managed specs, see env_dir)
+    env_dir : str, optional
+        Only refresh the managed specs activating this environment
+    refresh : bool, optional
+        Capture new activation snapshots even if the cached ones are fresh
+
+    Returns
+    -------
+    dict
+        Per spec path, ``{'ok': True, 'diagnostics': [...]}`` or
+        ``{'ok': False, 'error': message}``
+    """
+    if paths is None:
+        paths = registry.managed_specs(env_dir)
+    results = {}
+    for path in paths:
+        try:
+            result = rebuild_spec(read_spec(path), refresh=refresh)
+            write_spec(path, result.spec)
+            results[path] = {'ok': True, 'diagnostics': result.diagnostics}
+        except (KerndaError, IOError, OSError, ValueError, KeyError) as e:
+            results[path] = {'ok': False, 'error': str(e)}
+    return results
+
+
+def clear_caches():
+    """Forgets in-process resolver results, e.g. after conda was moved."""
+    backends.clear_caches()
@@ -0,0 +1,518 @@
+"""Environment activation backends.
+
+A backend knows how to recognize an environment, how to activate it in a
+shell, how to capture the environment variables that activation produces,
+how to fingerprint the environment so cached activations can be
+invalidated and how to build the kernel start command for each launch
+mode it supports.
+
+Third-party backends are discovered through the ``kernda.backends`` entry
+point group. Each entry point must refer to a `Backend` subclass.
+"""
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import threading
+import warnings
+from os.path import join as pjoin, dirname, abspath, basename, isdir, isfile
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+import shlex
+
+from .environ import diff_env
+from .launchlog import TRACE_PS4, trace_timings
+
+ENTRY_POINT_GROUP = 'kernda.backends'
+
+# This is the final form the kernel start command will take
+# after running kernda. It's at the module-level for ease of reference only.
+
+FULL_CMD_TMPL = '{source_or_conda} "{activate_script}" "{env_dir}" && exec {start_cmd} {start_args}'
+
+# Same as above for backends other than conda
+SOURCE_CMD_TMPL = '{activate} && exec {start_cmd} {start_args}'
+
+# Launch modes, roughly from slowest to fastest:
+#   source   - bash sources the activation script on every kernel start
+#   snapshot - the kernda launcher applies a cached activation and execs
+#   direct   - the kernel is exec'ed as-is, no activation at all
+LAUNCH_MODES = ('source', 'snapshot', 'direct')
+
+DUMP_ENV = 'import json, os, sys; sys.stdout.write(json.dumps(dict(os.environ)))'
+
+# Guards the in-process caches below
+_lock = threading.RLock()
+# Root prefix reported by `conda info --json`, which takes a second to run
+_conda_info_prefix = None
+_backends = None
+
+
+def clear_caches():
+    """Forgets cached conda lookups and discovered backends."""
+    global _conda_info_prefix, _backends
+    with _lock:
+        _conda_info_prefix = None
+        _backends = None
+
+
+CONDA_INFO_CMD = ['conda', 'info', '--json']
+
+
+def parse_conda_info(output):
+    """Extracts the root prefix from `conda info --json` output."""
+    if not isinstance(output, str):
+        output = output.decode('utf8')
+    return json.loads(output).get("conda_prefix") or ''
+
+
+def set_conda_info_prefix(prefix):
+    """Caches the root prefix, e.g. after running `conda info` elsewhere."""
+    global _conda_info_prefix
+    with _lock:
+        _conda_info_prefix = prefix
+
+
+def needs_conda_info(env_dir):
+    """Returns True if resolving env_dir's activate script runs `conda info`."""
+    with _lock:
+        cached = _conda_info_prefix is not None
+    return not (cached or os.path.exists(pjoin(env_dir, 'bin', 'activate')) or
+                os.getenv('CONDA_EXE'))
+
+
+def _conda_prefix_from_info():
+    global _conda_info_prefix
+    with _lock:
+        if _conda_info_prefix is None:
+            _conda_info_prefix = parse_conda_info(subprocess.check_output(CONDA_INFO_CMD))
+        return _conda_info_prefix
+
+
+def determine_conda_activate_script(env_dir):
+    """Finds the correct path to an activate script.
+
+    If no activate script exists or conda is broken / nonexistant this function will raise
+
+    Parameters
+    ----------
+    env_dir : str
+        path to an environment root
+
+    Returns
+    -------
+    str
+        Absolute path to a $PREFIX/bin/activate script
+
+    """
+    # The activate script is {bin_dir}/activate if it exists (conda<4.4, base env or virtualenv),
+    # otherwise it falls back to the activate script in the current base conda environment.
+    #
+    # In versions of conda > 4.4 environments no longer have their own activate script and rely on the base env
+    # In prior versions of conda this was a symlink in any case to the base env's activate script
+    in_env = pjoin(env_dir, 'bin', 'activate')
+    # virtualenv / conda < 4.4
+    if os.path.exists(in_env):
+        return abspath(in_env)
+    # conda 4.4+ when something has been activated
+    conda_executable_from_env = os.getenv('CONDA_EXE')
+    if conda_executable_from_env:
+        conda_prefix = abspath(pjoin(dirname(conda_executable_from_env), '..'))
+    else:
+        # conda 4.4+ when nothing is activated
+        conda_prefix = _conda_prefix_from_info()
+    if not conda_prefix:
+        raise ValueError("No conda prefix could be determined")
+
+    return abspath(pjoin(conda_prefix, 'bin', 'activate'))
+
+
+def shell_env_command(script, trace=False):
+    """Builds the command that runs a bash snippet and dumps the environment.
+
+    Parameters
+    ----------
+    script : str
+        Bash commands to run before dumping the environment
+    trace : bool, optional
+        Write a timestamped xtrace of the script to stderr, see
+        `kernda.launchlog.trace_timings`
+
+    Returns
+    -------
+    list
+        argv whose stdout is the resulting environment as JSON
+    """
+    cmd = '{} >/dev/null 2>&1 && exec {} -c {}'.format(
+        script, quote(sys.executable), quote(DUMP_ENV))
+    if trace:
+        cmd = '{{ BASH_XTRACEFD=3; PS4={}; set -x; {}; }} 3>&2'.format(
+            quote(TRACE_PS4), cmd)
+    return ['bash', '--noprofile', '--norc', '-c', cmd]
+
+
+def run_shell_env(script, environ=None, hooks=None):
+    """Runs a bash snippet and returns the environment it leaves behind.
+
+    Parameters
+    ----------
+    script : str
+        Bash commands to run before dumping the environment
+    environ : dict, optional
+        Environment to start from (default: os.environ)
+    hooks : list, optional
+        Receives the timings of the ``activate.d`` hooks the script ran
+
+    Returns
+    -------
+    dict
+        Environment of the shell after running the script
+    """
+    cmd = shell_env_command(script, trace=hooks is not None)
+    env = dict(os.environ if environ is None else environ)
+    if hooks is None:
+        output = subprocess.check_output(cmd, env=env)
+    else:
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE)
+        output, trace = proc.communicate()
+        if proc.returncode:
+            raise subprocess.CalledProcessError(proc.returncode, cmd, output)
+        lines = trace.decode('utf8', 'replace').splitlines()
+        hooks.extend(trace_timings(lines)['hooks'])
+    if sys.version_info[0] >= 3:
+        output = output.decode('utf8')
+    return json.loads(output)
+
+
+def fingerprint_paths(paths):
+    """Hashes the stat information of a list of paths.
+
+    Missing paths contribute to the hash too so that their later
+    creation changes it.
+    """
+    state = []
+    for path in paths:
+        try:
+            st = os.stat(path)
+            state.append([path, st.st_mtime, st.st_size])
+        except OSError:
+            state.append([path, None, None])
+    return hashlib.sha1(json.dumps(state).encode('utf8')).hexdigest()
+
+
+def _listdir(path):
+    try:
+        return sorted(os.listdir(path))
+    except OSError:
+        return []
+
+
+class Backend(object):
+    """Base class of environment activation backends.
+
+    Subclasses must set `name` and implement `detect` and
+    `activate_command`. The remaining methods have generic
+    implementations built on top of those two.
+    """
+    #: Name used on the command line and in kernel specs
+    name = None
+    #: Launch modes supported by the backend
+    launch_modes = ('source', 'snapshot')
+    #: Launch mode used when the user does not pick one
+    default_mode = 'snapshot'
+    #: Backends with higher priority are tried first during detection
+    priority = 0
+
+    def detect(self, env_dir):
+        """Returns True if env_dir is an environment of this backend."""
+        raise NotImplementedError
+
+    def activate_command(self, env_dir, **options):
+        """Returns a bash snippet that activates env_dir."""
+        raise NotImplementedError
+
+    def capture(self, env_dir, environ=None, prelude=None, hooks=None):
+        """Captures the environment change activation makes.
+
+        Parameters
+        ----------
+        env_dir : str
+            Environment prefix
+        environ : dict, optional
+            Environment to activate in (default: os.environ)
+        prelude : str, optional
+            Bash snippet to run before activating, e.g. module loads;
+            its changes are part of the captured diff
+        hooks : list, optional
+            Receives the timings of the ``activate.d`` hooks activation ran
+
+        Returns
+        -------
+        dict
+            Diff as computed by `kernda.environ.diff_env`
+        """
+        before = run_shell_env('true', environ)
+        after = run_shell_env(self.capture_script(env_dir, prelude), environ, hooks)
+        return diff_env(before, after)
+
+    def capture_script(self, env_dir, prelude=None):
+        """Returns the bash snippet `capture` runs.
+
+        Backends that capture without a shell return None.
+        """
+        script = self.activate_command(env_dir)
+        if prelude:
+            script = '{} && {}'.format(prelude, script)
+        return script
+
+    def watch_paths(self, env_dir):
+        """Returns the paths whose changes invalidate a cached activation."""
+        return []
+
+    def fingerprint(self, env_dir):
+        """Returns a cheap hash that changes when the environment does."""
+        return fingerprint_paths(self.watch_paths(env_dir))
+
+    def launch_argv(self, env_dir, argv, mode=None, start_args='', modules=(),
+                    launcher_args=(), spec_name=None, **options):
+        """Builds the kernel spec argv for a launch mode.
+
+        Parameters
+        ----------
+        env_dir : str
+            Environment prefix
+        argv : list
+            Original kernel start command
+        mode : str, optional
+            One of `launch_modes` (default: `default_mode`)
+        start_args : str, optional
+            Extra arguments for the kernel start command, in shell syntax
+        modules : list, optional
+            Environment Modules to load before activation
+        launcher_args : list, optional
+            Flags for the kernda launcher; in source and direct mode the
+            command is wrapped in the launcher when there are any. With
+            ``--timing`` in source mode, the bash command traces itself
+            to the launcher, see `kernda.launch.trace_script`
+        spec_name : str, optional
+            Kernel spec name the launcher records in the launch log
+        options
+            Backend specific activation options
+
+        Returns
+        -------
+        list
+            New kernel spec argv
+        """
+        from .launch import build_argv, trace_script, TRACE_CLOSE
+        mode = mode or self.default_mode
+        if mode not in self.launch_modes:
+            raise ValueError('Backend {} does not support launch mode {}'
+                             .format(self.name, mode))
+        if mode == 'snapshot':
+            extra = shlex.split(start_args) if start_args else []
+            return build_argv(self.name, env_dir, list(argv) + extra,
+                              modules=modules, extra_args=launcher_args,
+                              spec_name=spec_name, mode=mode)
+        if mode == 'source':
+            from .modules import load_command
+            timing = '--timing' in launcher_args
+            start_cmd = ' '.join(quote(x) for x in argv)
+            if timing:
+                start_cmd = TRACE_CLOSE + start_cmd
+            cmd = self.source_command(env_dir, start_cmd, start_args, **options)
+            if modules:
+                cmd = '{} && {}'.format(load_command(modules), cmd)
+            cmd = ['bash', '-c', trace_script(cmd) if timing else cmd]
+        else:
+            if modules:
+                raise ValueError('Modules cannot be loaded in direct launch mode')
+            cmd = list(argv) + (shlex.split(start_args) if start_args else [])
+        if launcher_args:
+            return build_argv(None, env_dir, cmd, extra_args=launcher_args,
+                              spec_name=spec_name, mode=mode)
+        return cmd
+
+    def source_command(self, env_dir, start_cmd, start_args, **options):
+        """Builds the bash command used in source launch mode."""
+        return SOURCE_CMD_TMPL.format(
+            activate=self.activate_command(env_dir, **options),
+            start_cmd=start_cmd,
+            start_args=start_args)
+
+
+class CondaBackend(Backend):
+    """Activates conda environments with conda's activate script."""
+    name = 'conda'
+    default_mode = 'source'
+
+    def detect(self, env_dir):
+        return isdir(pjoin(env_dir, 'conda-meta'))
+
+    def activate_command(self, env_dir, conda_activate=False, **options):
+        source_or_conda = "conda" if conda_activate else "source"
+        return '{} "{}" "{}"'.format(
+            source_or_conda, determine_conda_activate_script(env_dir), env_dir)
+
+    def watch_paths(self, env_dir):
+        activate_d = pjoin(env_dir, 'etc', 'conda', 'activate.d')
+        paths = [
+            pjoin(env_dir, 'conda-meta'),
+            pjoin(env_dir, 'conda-meta', 'history'),
+            pjoin(env_dir, 'etc', 'conda', 'env_vars.d'),
+            activate_d,
+        ]
+        paths.extend(pjoin(activate_d, fn) for fn in _listdir(activate_d))
+        return paths
+
+    def source_command(self, env_dir, start_cmd, start_args,
+                       conda_activate=False, **options):
+        return FULL_CMD_TMPL.format(
+            source_or_conda="conda" if conda_activate else "source",
+            activate_script=determine_conda_activate_script(env_dir),
+            env_dir=env_dir,
+            start_cmd=start_cmd,
+            start_args=start_args)
+
+
+class VenvBackend(Backend):
+    """Activates virtualenv / venv environments.
+
+    Activation only sets a few variables, so it is captured without
+    running a shell and the kernel can even be started directly.
+    """
+    name = 'venv'
+    launch_modes = ('source', 'snapshot', 'direct')
+    priority = 10
+
+    def detect(self, env_dir):
+        return isfile(pjoin(env_dir, 'pyvenv.cfg'))
+
+    def activate_command(self, env_dir, **options):
+        return 'source "{}"'.format(pjoin(env_dir, 'bin', 'activate'))
+
+    def capture_script(self, env_dir, prelude=None):
+        if prelude:
+            return super(VenvBackend, self).capture_script(env_dir, prelude)
+        return None
+
+    def capture(self, env_dir, environ=None, prelude=None, hooks=None):
+        if prelude:
+            return super(VenvBackend, self).capture(env_dir, environ, prelude, hooks)
+        return {
+            'set': {'VIRTUAL_ENV': abspath(env_dir)},
+            'unset': ['PYTHONHOME'],
+            'prepend': {'PATH': [abspath(pjoin(env_dir, 'bin'))]},
+        }
+
+    def watch_paths(self, env_dir):
+        return [pjoin(env_dir, 'pyvenv.cfg'), pjoin(env_dir, 'bin')]
+
+
+class PixiBackend(Backend):
+    """Activates pixi environments living in <project>/.pixi/envs/<name>."""
+    name = 'pixi'
+    priority = 20
+
+    def detect(self, env_dir):
+        envs_dir = dirname(abspath(env_dir))
+        return (basename(envs_dir) == 'envs' and
+                basename(dirname(envs_dir)) == '.pixi')
+
+    def project_dir(self, env_dir):
+        """Returns the pixi project directory owning env_dir."""
+        return dirname(dirname(dirname(abspath(env_dir))))
+
+    def manifest_path(self, env_dir):
+        """Returns the pixi manifest of the project owning env_dir."""
+        project = self.project_dir(env_dir)
+        for fn in ('pixi.toml', 'pyproject.toml'):
+            if isfile(pjoin(project, fn)):
+                return pjoin(project, fn)
+        return pjoin(project, 'pixi.toml')
+
+    def activate_command(self, env_dir, **options):
+        return 'eval "$(pixi shell-hook --shell bash --manifest-path {} --environment {})"'.format(
+            quote(self.manifest_path(env_dir)), quote(basename(abspath(env_dir))))
+
+    def watch_paths(self, env_dir):
+        return [
+            self.manifest_path(env_dir),
+            pjoin(self.project_dir(env_dir), 'pixi.lock'),
+            pjoin(env_dir, 'conda-meta'),
+            pjoin(env_dir, 'conda-meta', 'history'),
+        ]
+
+
+BUILTIN_BACKENDS = (CondaBackend, VenvBackend, PixiBackend)
+
+
+def _iter_entry_points(group):
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            import pkg_resources
+        except ImportError:
+            return []
+        return list(pkg_resources.iter_entry_points(group))
+    eps = entry_points()
+    if hasattr(eps, 'select'):
+        return list(eps.select(group=group))
+    return list(eps.get(group, []))
+
+
+def load_backends():
+    """Gets all available backends, built-in and from entry points.
+
+    Returns
+    -------
+    dict
+        Backend instances keyed by name
+    """
+    global _backends
+    with _lock:
+        if _backends is None:
+            backends = dict((cls.name, cls()) for cls in BUILTIN_BACKENDS)
+            for ep in _iter_entry_points(ENTRY_POINT_GROUP):
+                try:
+                    cls = ep.load()
+                except Exception as e:
+                    warnings.warn('Could not load kernda backend {}: {}'.format(ep.name, e))
+                    continue
+                backends[cls.name or ep.name] = cls()
+            _backends = backends
+        return _backends
+
+
+def get_backend(name):
+    """Gets a backend by name.
+
+    Raises
+    ------
+    KeyError
+        If no backend has the given name
+    """
+    return load_backends()[name]
+
+
+def detect_backend(env_dir):
+    """Picks the backend for an environment.
+
+    Falls back to conda, which also handles anything that ships a
+    bin/activate script.
+    """
+    candidates = sorted(load_backends().values(), key=lambda b: -b.priority)
+    for backend in candidates:
+        try:
+            if backend.detect(env_dir):
+                return backend
+        except Exception:
+            continue
+    return get_backend('conda')
@@ -0,0 +1,111 @@
+"""On-disk cache for activation results and other kernda state."""
+import hashlib
+import json
+import os
+import tempfile
+from os.path import join as pjoin, expanduser
+
+
+def cache_dir():
+    """Gets the root directory of the kernda cache.
+
+    Honors $KERNDA_CACHE_DIR, then $XDG_CACHE_HOME/kernda, then
+    ~/.cache/kernda.
+
+    Returns
+    -------
+    str
+        Path to the cache directory (which may not exist yet)
+    """
+    path = os.getenv('KERNDA_CACHE_DIR')
+    if path:
+        return path
+    xdg = os.getenv('XDG_CACHE_HOME') or expanduser(pjoin('~', '.cache'))
+    return pjoin(xdg, 'kernda')
+
+
+def state_dir():
+    """Gets the directory for persistent kernda state, e.g. managed specs.
+
+    Honors $KERNDA_STATE_DIR, then $XDG_STATE_HOME/kernda, then
+    ~/.local/state/kernda.
+    """
+    path = os.getenv('KERNDA_STATE_DIR')
+    if path:
+        return path
+    xdg = os.getenv('XDG_STATE_HOME') or expanduser(pjoin('~', '.local', 'state'))
+    return pjoin(xdg, 'kernda')
+
+
+def cache_key(*parts):
+    """Computes a stable hex key from JSON-serializable parts."""
+    blob = json.dumps(parts, sort_keys=True).encode('utf8')
+    return hashlib.sha1(blob).hexdigest()
+
+
+def entry_path(kind, key):
+    """Gets the path of a cache entry of the given kind."""
+    return pjoin(cache_dir(), kind, key + '.json')
+
+
+def load(kind, key):
+    """Loads a cache entry.
+
+    Returns
+    -------
+    dict or None
+        The entry or None if it does not exist or cannot be parsed
+    """
+    try:
+        with open(entry_path(kind, key)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def atomic_write(path, text, mode=None):
+    """Writes text to path via a temporary file and rename.
+
+    Readers never observe a partially written file. The file is private
+    to the user unless mode gives other permission bits.
+    """
+    dir_name = os.path.dirname(path) or '.'
+    if not os.path.isdir(dir_name):
+        try:
+            os.makedirs(dir_name)
+        except OSError:
+            # Raced with another writer
+            if not os.path.isdir(dir_name):
+                raise
+    fd, tmp = tempfile.mkstemp(dir=dir_name, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+            if mode is not None:
+                os.fchmod(f.fileno(), mode)
+        os.rename(tmp, path)
+    except Exception:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def store(kind, key, data):
+    """Stores a JSON-serializable cache entry atomically.
+
+    Returns
+    -------
+    str
+        Path to the written entry
+    """
+    path = entry_path(kind, key)
+    atomic_write(path, json.dumps(data, indent=2, sort_keys=True))
+    return path
+
+
+def remove(kind, key):
+    """Removes a cache entry if it exists."""
+    try:
+        os.remove(entry_path(kind, key))
+    except OSError:
+        pass
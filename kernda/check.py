@@ -0,0 +1,177 @@
+"""End-to-end launch test of kernel specs, behind ``kernda check``.
+
+Each selected kernel spec is started with jupyter_client, the way a
+notebook server would. The check waits for the first ``kernel_info``
+reply and, for Python kernels, asks the kernel for ``sys.prefix`` to make
+sure it runs in the environment its spec activates. Kernels are checked
+in a bounded thread pool, and each one is shut down afterwards.
+
+Needs jupyter_client, which kernda does not depend on otherwise.
+"""
+import ast
+import fnmatch
+import json
+import os
+import time
+from multiprocessing.pool import ThreadPool
+from os.path import basename, dirname, join as pjoin, realpath
+
+from .api import resolve_env_dir
+
+PREFIX_EXPRESSION = '__import__("sys").prefix'
+
+
+def select_specs(specs, patterns=None):
+    """Picks kernel specs by name.
+
+    Parameters
+    ----------
+    specs : dict
+        Resource directories by kernel spec name
+    patterns : list, optional
+        Shell-style name patterns (default: all specs)
+
+    Returns
+    -------
+    list
+        Sorted names of the matching specs
+    """
+    if not patterns:
+        return sorted(specs)
+    return sorted(name for name in specs
+                  if any(fnmatch.fnmatchcase(name, p) for p in patterns))
+
+
+def expected_prefix(spec):
+    """Gets the environment prefix a kernel spec should run in."""
+    if spec.get('_kernda_env_dir'):
+        return spec['_kernda_env_dir']
+    return resolve_env_dir(spec)[0]
+
+
+def evaluate(result, budget=None):
+    """Decides whether a checked kernel passed.
+
+    Sets ``ok`` and, for failures, ``reason`` in result.
+    """
+    reason = None
+    if result.get('error'):
+        reason = result['error']
+    elif result.get('prefix') is not None and \
+            realpath(result['prefix']) != realpath(result['expected_prefix']):
+        reason = 'runs in {} instead of {}'.format(result['prefix'], result['expected_prefix'])
+    elif budget is not None and result['ready_s'] > budget:
+        reason = 'ready after {:.2f}s, over the budget of {:.2f}s'.format(
+            result['ready_s'], budget)
+    result['ok'] = reason is None
+    if reason:
+        result['reason'] = reason
+    return result
+
+
+def check_kernel(name, resource_dir, timeout=60.0):
+    """Starts a kernel, times it until ready and checks its prefix.
+
+    Returns
+    -------
+    dict
+        ``name``, ``ready_s`` (seconds until the first kernel_info reply),
+        ``prefix`` (None for non-Python kernels), ``expected_prefix`` and
+        ``error``
+    """
+    from jupyter_client.kernelspec import KernelSpecManager
+    from jupyter_client.manager import KernelManager
+    with open(pjoin(resource_dir, 'kernel.json')) as f:
+        spec = json.load(f)
+    result = {'name': name, 'ready_s': None, 'prefix': None, 'error': None,
+              'expected_prefix': expected_prefix(spec)}
+    # Look the spec up where it was found, not only in the installed kernel dirs
+    km = KernelManager(kernel_name=basename(resource_dir),
+                       kernel_spec_manager=KernelSpecManager(kernel_dirs=[dirname(resource_dir)]))
+    client = None
+    try:
+        start = time.time()
+        km.start_kernel()
+        client = km.client()
+        client.start_channels()
+        client.wait_for_ready(timeout=timeout)
+        result['ready_s'] = time.time() - start
+        if spec.get('language', '').lower() == 'python':
+            reply = client.execute('', silent=True, reply=True, timeout=timeout,
+                                   user_expressions={'prefix': PREFIX_EXPRESSION})
+            value = reply['content']['user_expressions']['prefix']
+            result['prefix'] = ast.literal_eval(value['data']['text/plain'])
+    except Exception as e:
+        result['error'] = '{}: {}'.format(type(e).__name__, e)
+    finally:
+        if client is not None:
+            client.stop_channels()
+        try:
+            km.shutdown_kernel(now=False)
+        except Exception:
+            try:
+                km.shutdown_kernel(now=True)
+            except Exception as e:
+                # E.g. the kernel never started; one failure, not the whole check
+                if result['error'] is None:
+                    result['error'] = 'could not shut down: {}: {}'.format(
+                        type(e).__name__, e)
+    return result
+
+
+def check(patterns=None, parallel=4, budget=None, timeout=60.0, specs=None):
+    """Checks kernel specs in parallel.
+
+    Parameters
+    ----------
+    patterns : list, optional
+        Kernel spec name patterns (default: all)
+    parallel : int, optional
+        Kernels started at the same time
+    budget : float, optional
+        Seconds a kernel may take until its first kernel_info reply
+    timeout : float, optional
+        Seconds to wait for a kernel before giving up on it
+    specs : dict, optional
+        Resource directories by name (default: all installed kernel specs)
+
+    Returns
+    -------
+    list
+        Results of `check_kernel`, evaluated with `evaluate`, by name
+    """
+    if specs is None:
+        from jupyter_client.kernelspec import KernelSpecManager
+        specs = KernelSpecManager().find_kernel_specs()
+    names = select_specs(specs, patterns)
+    if not names:
+        return []
+    pool = ThreadPool(max(1, min(parallel, len(names))))
+    try:
+        results = pool.map(lambda name: check_kernel(name, specs[name], timeout), names)
+    finally:
+        pool.close()
+        pool.join()
+    return [evaluate(result, budget) for result in results]
+
+
+def summarize(results):
+    """Sums up check results.
+
+    Returns
+    -------
+    dict
+        ``checked``, ``failed`` and ``slowest_s``
+    """
+    times = [r['ready_s'] for r in results if r.get('ready_s') is not None]
+    return {
+        'checked': len(results),
+        'failed': sum(1 for r in results if not r['ok']),
+        'slowest_s': max(times) if times else None,
+    }
+
+
+def environ_budget():
+    """Gets the default budget from $KERNDA_CHECK_BUDGET, in seconds."""
+    value = os.getenv('KERNDA_CHECK_BUDGET')
+    return float(value) if value else None
@@ -3,57 +3,17 @@ from __future__ import print_function
 
 import argparse
 import json
-import os
+import socket
 import sys
-import subprocess
-from os.path import join as pjoin, dirname, isfile, expanduser, abspath
-try:
-    from shlex import quote
-except ImportError:
-    from pipes import quote
+import time
+from os.path import abspath, basename, dirname, isfile
 
-
-# This is the final form the kernel start command will take
-# after running kernda. It's at the module-level for ease of reference only.
-
-FULL_CMD_TMPL = '{source_or_conda} "{activate_script}" "{env_dir}" && exec {start_cmd} {start_args}'
-
-
-def determine_conda_activate_script(env_dir):
-    """Finds the correct path to an activate script.
-
-    If no activate script exists or conda is broken / nonexistant this function will raise
-
-    Parameters
-    ----------
-    env_dir : str
-        path to an environment root
-
-    Returns
-    -------
-    str
-        Absolute path to a $PREFIX/bin/activate script
-
-    """
-    in_env = pjoin(env_dir, 'bin', 'activate')
-    # virtualenv / conda < 4.4
-    if os.path.exists(in_env):
-        return abspath(in_env)
-    # conda 4.4+ when something has been activated
-    conda_executable_from_env = os.getenv('CONDA_EXE')
-    if conda_executable_from_env:
-        conda_prefix = abspath(pjoin(dirname(conda_executable_from_env), '..'))
-    else:
-        # conda 4.4+ when nothing is activated
-        output = subprocess.check_output(['conda', 'info', '--json'])
-        if sys.version_info[0] >= 3:
-            output = output.decode('utf8')
-
-        conda_prefix = json.loads(output).get("conda_prefix")
-    if not conda_prefix:
-        raise ValueError("No conda prefix could be determined")
-
-    return abspath(pjoin(conda_prefix, 'bin', 'activate'))
+from . import server
+from .api import KerndaError, build_spec, read_spec, refresh_specs, write_spec
+from .backends import FULL_CMD_TMPL, LAUNCH_MODES, determine_conda_activate_script  # noqa: F401
+from .environ import format_report
+from .launch import add_launcher_arguments, launcher_options
+from .modules import parse_modules
 
 
 def add_activation(args):
@@ -74,69 +34,606 @@ def add_activation(args):
         print('Error: kernel spec {} not found'.format(args.kernelspec))
         return 1
 
-    with open(input_fn) as f:
-        spec = json.load(f)
-
-    # Treat the path provided by the user as the conda environment we
-    # want to activate. If the user did not provide a path, assume the
-    # path containing the conda kernel is the desired environment.
-    bin_dir = args.env_dir
-    original_argv = spec.get("_kernda_original_argv") or spec['argv']
-    if not bin_dir:
-        executable = original_argv[0]
-        bin_dir = dirname(executable)
-    elif bin_dir and not os.path.exists(bin_dir):
-        print("Error: {} does not exist".format(bin_dir), file=sys.stderr)
+    spec = read_spec(input_fn)
+    options = dict(
+        env_dir=abspath(args.env_dir) if args.env_dir else None,
+        backend=args.backend,
+        mode=args.mode,
+        start_args=args.start_args,
+        modules=parse_modules(args.modules),
+        display_name=args.display_name,
+        conda_activate=args.conda_activate,
+        launcher_options=launcher_options(args),
+        refresh=args.refresh,
+        name=basename(dirname(abspath(input_fn))))
+    try:
+        if args.server is not None:
+            # Thin client mode: the daemon does the work with warm caches
+            result = server.request('build', args.server or None, spec=spec, options=options)
+            spec, diagnostics = result['spec'], result['diagnostics']
+        else:
+            spec, diagnostics = build_spec(spec, **options)
+    except socket.error as e:
+        print("Error: could not reach the kernda server: {}".format(e), file=sys.stderr)
+        return 1
+    except KerndaError as e:
+        _print_error(e)
         return 1
 
-    # Add the bin subdir to the path if it's not already included.
-    if not bin_dir.endswith('bin'):
-        bin_dir += os.path.sep + 'bin'
-
-    # Retrieve the activate script associated with this environment.
-    # This will return {bin_dir}/activate if it exists (conda<4.4, base env or virtualenv), otherwise it will fall back
-    # to the activate script in the current base conda environment.
-    #
-    # In versions of conda > 4.4 environments no longer have their own activate script and rely on the base env
-    # In prior versions of conda this was a symlink in any case to the base env's activate script
-    try:
-        activate_script = determine_conda_activate_script(pjoin(bin_dir, '..'))
-    except (subprocess.CalledProcessError, ValueError):
-        print("Error: Could not determine the location of the activation script associated with {}".format(bin_dir),
-              file=sys.stderr)
-        print("       Verify that the `conda` command works in your current shell by running `conda --info`",
-              file=sys.stderr)
-        return 1
-    # Use source activate or conda activate, depending on the CLI flag
-    source_or_conda = "conda" if args.conda_activate else "source"
-    env_dir = dirname(bin_dir)
-    start_cmd = ' '.join(quote(x) for x in original_argv)
-    full_cmd = FULL_CMD_TMPL.format(
-        source_or_conda=source_or_conda,
-        activate_script=activate_script,
-        env_dir=env_dir,
-        start_cmd=start_cmd,
-        start_args=args.start_args)
-    spec['argv'] = ['bash', '-c', full_cmd]
-    spec['_kernda_original_argv'] = original_argv
-
-    if args.display_name:
-        spec['display_name'] = args.display_name
+    for diag in diagnostics:
+        if diag['level'] == 'warning':
+            print('Warning: {}'.format(diag['message']), file=sys.stderr)
+        if 'report' in diag:
+            print('Environment normalization:', file=sys.stderr)
+            for line in format_report(diag['report'], diag['env_size']):
+                print('  ' + line, file=sys.stderr)
 
     # Print the new kernel spec JSON to stdout for redirection
     print(json.dumps(spec, indent=2))
 
     # Overwrite the original if requested
     if args.overwrite:
-        with open(input_fn, 'w') as f:
-            json.dump(spec, f, indent=2)
+        write_spec(input_fn, spec)
         print('Wrote to {}'.format(input_fn), file=sys.stderr)
 
     return 0
 
 
+def _print_error(e):
+    print("Error: {}".format(e), file=sys.stderr)
+    if getattr(e, 'hint', None):
+        print("       {}".format(e.hint), file=sys.stderr)
+
+
+def serve_command(argv):
+    """Run the kernda daemon."""
+    parser = argparse.ArgumentParser(prog='kernda serve',
+                                     description='Serve kernel spec builds over a Unix socket')
+    parser.add_argument('--socket', default=None,
+                        help='Socket path (default: $KERNDA_SOCKET or '
+                        '$XDG_RUNTIME_DIR/kernda.sock)')
+    args = parser.parse_args(argv)
+    try:
+        srv = server.KerndaServer(args.socket)
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    print('kernda serving on {}'.format(srv.path), file=sys.stderr)
+    try:
+        srv.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        srv.server_close()
+    return 0
+
+
+def status_command(argv):
+    """Show the status and request latencies of a kernda daemon."""
+    parser = argparse.ArgumentParser(prog='kernda status',
+                                     description='Show the status of the kernda server')
+    parser.add_argument('--socket', default=None, help='Socket path of the server')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    try:
+        status = server.request('status', args.socket, timeout=10)
+    except (socket.error, KerndaError) as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps(status, indent=2))
+        return 0
+    print('pid {pid}, up {uptime:.0f}s, {managed_specs} managed spec(s), socket {socket}'
+          .format(**status))
+    for op, stats in sorted(status['stats'].items()):
+        print('{:>8}: {count} req, {errors} err, p50 {p50_ms:.2f}ms, p95 {p95_ms:.2f}ms, '
+              'max {max_ms:.2f}ms'.format(op, **stats))
+    return 0
+
+
+def refresh_command(argv):
+    """Rebuild managed kernel specs with the options they were built with."""
+    parser = argparse.ArgumentParser(prog='kernda refresh',
+                                     description='Rebuild kernda-managed kernel specs')
+    parser.add_argument('paths', nargs='*', metavar='kernel.json',
+                        help='Specs to refresh (default: all managed specs)')
+    parser.add_argument('--env-dir', default=None,
+                        help='Only refresh the managed specs of this environment')
+    parser.add_argument('--force', action='store_true',
+                        help='Capture new activation snapshots even if fresh')
+    parser.add_argument('--server', nargs='?', const='', default=None, metavar='SOCKET',
+                        help='Let a kernda server do the work')
+    args = parser.parse_args(argv)
+    paths = [abspath(p) for p in args.paths] or None
+    # The server resolves relative paths against its own working directory
+    env_dir = abspath(args.env_dir) if args.env_dir else None
+    try:
+        if args.server is not None:
+            results = server.request('refresh', args.server or None, paths=paths,
+                                     env_dir=env_dir, refresh=args.force)
+        else:
+            results = refresh_specs(paths, env_dir, refresh=args.force)
+    except (socket.error, KerndaError) as e:
+        _print_error(e)
+        return 1
+    failed = 0
+    for path, result in sorted(results.items()):
+        if result['ok']:
+            print('Refreshed {}'.format(path), file=sys.stderr)
+        else:
+            failed += 1
+            print('Error: {}: {}'.format(path, result['error']), file=sys.stderr)
+    return 1 if failed else 0
+
+
+def watch_command(argv):
+    """Refresh managed specs whenever their environments change."""
+    from .watch import watch
+    parser = argparse.ArgumentParser(prog='kernda watch',
+                                     description='Watch managed environments and '
+                                     'refresh their kernel specs when they change')
+    parser.add_argument('--delay', type=float, default=2.0,
+                        help='Seconds without changes before refreshing (default: 2)')
+    parser.add_argument('--poll', action='store_true',
+                        help='Poll instead of using inotify')
+    parser.add_argument('--interval', type=float, default=2.0,
+                        help='Polling interval in seconds (default: 2)')
+    args = parser.parse_args(argv)
+
+    def log(message):
+        print(message, file=sys.stderr)
+    try:
+        watch(delay=args.delay, poll=args.poll, interval=args.interval, log=log)
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+def _ms(value):
+    return '-' if value is None else '{:.1f}'.format(value)
+
+
+def stats_command(argv):
+    """Show kernel launch latency percentiles from the launch history."""
+    from . import history
+    parser = argparse.ArgumentParser(prog='kernda stats',
+                                     description='Show kernel launch latency percentiles')
+    parser.add_argument('--since', default='7d',
+                        help='Time window to report on, e.g. 30m, 24h or 7d (default: 7d)')
+    parser.add_argument('--group-by', default='spec',
+                        help='Comma-separated keys to group by: {} (default: spec)'
+                        .format(', '.join(sorted(history.GROUP_COLUMNS))))
+    parser.add_argument('--history', default=None,
+                        help='History database (default: $KERNDA_HISTORY or '
+                        'history.sqlite in the state dir)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    group_by = [key.strip() for key in args.group_by.split(',') if key.strip()]
+    now = time.time()
+    try:
+        since = now - history.parse_window(args.since)
+        stats = history.launch_stats(since, now, group_by, args.history)
+    except ValueError as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps({'since': since, 'until': now, 'group_by': group_by,
+                          'groups': stats}, indent=2))
+        return 0
+    header = group_by + ['n', 'hit%', 'act p50', 'p95', 'p99',
+                         'launch p50', 'p95', 'p99']
+    rows = []
+    for entry in stats:
+        hit_rate = entry['cache_hit_rate']
+        rows.append([str(entry[key]) for key in group_by] + [
+            str(entry['count']),
+            '-' if hit_rate is None else '{:.0f}'.format(hit_rate * 100)] + [
+            _ms(entry[kind][p]) for kind in ('activation', 'launch')
+            for p in ('p50_ms', 'p95_ms', 'p99_ms')])
+    widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+    for row in [header] + rows:
+        print('  '.join(cell.ljust(width) if i < len(group_by) else cell.rjust(width)
+                        for i, (cell, width) in enumerate(zip(row, widths))).rstrip())
+    if not rows:
+        print('No launches recorded in the last {}'.format(args.since), file=sys.stderr)
+    return 0
+
+
+def regressions_command(argv):
+    """List launch latency regressions detected after environment changes."""
+    from . import history, regression
+    parser = argparse.ArgumentParser(prog='kernda regressions',
+                                     description='List launch latency regressions '
+                                     'detected after environment changes')
+    parser.add_argument('--env-dir', default=None,
+                        help='Only list regressions of this environment')
+    parser.add_argument('--since', default='30d',
+                        help='Time window, e.g. 24h or 7d (default: 30d)')
+    parser.add_argument('--history', default=None,
+                        help='History database (default: $KERNDA_HISTORY or '
+                        'history.sqlite in the state dir)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    try:
+        since = time.time() - history.parse_window(args.since)
+    except ValueError as e:
+        _print_error(e)
+        return 1
+    env_dir = abspath(args.env_dir) if args.env_dir else None
+    events = regression.regressions(env_dir, since, args.history)
+    if args.json:
+        print(json.dumps(events, indent=2))
+        return 0
+    for event in events:
+        print('{} {}: {} {:.0f}ms -> {:.0f}ms (p={:.2g})'.format(
+            time.strftime('%Y-%m-%d %H:%M', time.localtime(event['time'])),
+            event['env_dir'], event['metric'], event['baseline_ms'],
+            event['current_ms'], event['p_value']))
+        packages = event['packages']
+        for name, version in sorted(packages.get('added', {}).items()):
+            print('    + {} {}'.format(name, version))
+        for name, version in sorted(packages.get('removed', {}).items()):
+            print('    - {} {}'.format(name, version))
+        for name, (old, new) in sorted(packages.get('changed', {}).items()):
+            print('    ~ {} {} -> {}'.format(name, old, new))
+    if not events:
+        print('No regressions in the last {}'.format(args.since), file=sys.stderr)
+    return 0
+
+
+def doctor_command(argv):
+    """Time each phase of a kernel start and suggest how to speed it up."""
+    from .doctor import diagnose, format_phases
+    parser = argparse.ArgumentParser(prog='kernda doctor',
+                                     description='Show where the start time of a '
+                                     'kernel goes, phase by phase')
+    parser.add_argument('kernelspec', help='Path to a kernel.json file')
+    parser.add_argument('--env-dir', default=None,
+                        help='Environment to activate (default: from the spec)')
+    parser.add_argument('--backend', default=None,
+                        help='Activation backend (default: from the spec or detected)')
+    parser.add_argument('--module', dest='modules', action='append', default=None,
+                        help='Environment Module to load (default: from the spec)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per phase, the fastest is reported (default: 3)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    if not isfile(args.kernelspec):
+        print('Error: kernel spec {} not found'.format(args.kernelspec), file=sys.stderr)
+        return 1
+    modules = parse_modules(args.modules) if args.modules is not None else None
+    try:
+        phases = diagnose(read_spec(args.kernelspec), args.env_dir, args.backend,
+                          modules, args.repeat)
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps(phases, indent=2))
+    else:
+        for line in format_phases(phases):
+            print(line)
+    return 0
+
+
+def check_command(argv):
+    """Start kernel specs end to end and check their start time and prefix."""
+    from . import check
+    parser = argparse.ArgumentParser(prog='kernda check',
+                                     description='Start kernels and check that they '
+                                     'run in the right environment within a time budget')
+    parser.add_argument('names', nargs='*', metavar='NAME',
+                        help='Kernel spec names or patterns like py3* (default: all)')
+    parser.add_argument('--parallel', type=int, default=4,
+                        help='Kernels to start at the same time (default: 4)')
+    parser.add_argument('--budget', type=float, default=check.environ_budget(),
+                        help='Seconds a kernel may take to answer kernel_info '
+                        '(default: $KERNDA_CHECK_BUDGET or no budget)')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for a kernel (default: 60)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    try:
+        results = check.check(args.names, args.parallel, args.budget, args.timeout)
+    except ImportError as e:
+        _print_error(KerndaError('kernda check needs jupyter_client ({})'.format(e),
+                                 hint='pip install jupyter_client'))
+        return 1
+    summary = check.summarize(results)
+    if args.json:
+        print(json.dumps({'summary': summary, 'results': results}, indent=2))
+    else:
+        for result in results:
+            ready = '-' if result['ready_s'] is None else '{:.2f}s'.format(result['ready_s'])
+            print('{:<4} {:<24} {:>8}  {}'.format(
+                'ok' if result['ok'] else 'FAIL', result['name'], ready,
+                result.get('reason') or result['prefix'] or ''))
+        print('{checked} checked, {failed} failed'.format(**summary), file=sys.stderr)
+    if not results:
+        print('Error: no kernel specs matched', file=sys.stderr)
+        return 1
+    return 1 if summary['failed'] else 0
+
+
+def loadtest_command(argv):
+    """Start many kernels of a spec at once and report latency by concurrency."""
+    from . import history, loadtest
+    parser = argparse.ArgumentParser(prog='kernda loadtest',
+                                     description='Start many kernels of a spec and '
+                                     'show how start latency grows with concurrency')
+    parser.add_argument('kernelspec', help='Path to a kernel.json file')
+    parser.add_argument('-n', '--count', type=int, default=10,
+                        help='Kernels to start per launch mode (default: 10)')
+    parser.add_argument('--rate', type=float, default=None,
+                        help='Kernel starts per second (default: all at once)')
+    parser.add_argument('--poisson', action='store_true',
+                        help='Random arrivals at --rate instead of evenly spaced ones')
+    parser.add_argument('--replay', default=None, metavar='WINDOW',
+                        help='Replay the arrivals of launches recorded in the '
+                        'history over a window like 1h, up to --count')
+    parser.add_argument('--replay-spec', default=None,
+                        help='Only replay launches of this kernel spec name')
+    parser.add_argument('--speedup', type=float, default=1.0,
+                        help='Divide replayed gaps by this factor (default: 1)')
+    parser.add_argument('--mode', dest='modes', action='append', choices=LAUNCH_MODES,
+                        help='Launch mode to test; may be repeated to compare '
+                        'modes (default: the mode of the spec)')
+    parser.add_argument('--timeout', type=float, default=120.0,
+                        help='Seconds to wait for each kernel (default: 120)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    if not isfile(args.kernelspec):
+        print('Error: kernel spec {} not found'.format(args.kernelspec), file=sys.stderr)
+        return 1
+    spec = read_spec(args.kernelspec)
+    if args.replay:
+        try:
+            since = time.time() - history.parse_window(args.replay)
+        except ValueError as e:
+            _print_error(e)
+            return 1
+        offsets = loadtest.replay_offsets(args.replay_spec, since, limit=args.count,
+                                          speedup=args.speedup)
+        if not offsets:
+            print('Error: no launches recorded in the last {}'.format(args.replay),
+                  file=sys.stderr)
+            return 1
+    else:
+        offsets = loadtest.arrival_offsets(args.count, args.rate, args.poisson)
+    modes = args.modes or [spec.get('_kernda_mode') or 'source']
+    try:
+        report = loadtest.run(spec, modes, offsets, args.timeout)
+    except ImportError as e:
+        _print_error(KerndaError('kernda loadtest needs jupyter_client ({})'.format(e),
+                                 hint='pip install jupyter_client'))
+        return 1
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print('{:<9} {:>9} {:>5} {:>7} {:>11} {:>9} {:>10} {:>9}'.format(
+        'mode', 'in flight', 'n', 'failed', 'ready p50', 'p95', 'act p50', 'p95'))
+    for mode in modes:
+        for row in report[mode]['by_concurrency'] + [dict(report[mode], in_flight='all')]:
+            print('{:<9} {:>9} {:>5} {:>7} {:>11} {:>9} {:>10} {:>9}'.format(
+                mode, row['in_flight'], row['count'], row['failed'],
+                _ms(row['ready']['p50_ms']), _ms(row['ready']['p95_ms']),
+                _ms(row['activation']['p50_ms']), _ms(row['activation']['p95_ms'])))
+    failed = sum(report[mode]['failed'] for mode in modes)
+    return 1 if failed else 0
+
+
+def profile_command(argv):
+    """Summarize the heaviest imports of profiled kernel starts."""
+    from . import profile
+    parser = argparse.ArgumentParser(prog='kernda profile',
+                                     description='Rank the heaviest imports over kernel '
+                                     'starts profiled with --profile')
+    parser.add_argument('--spec', default=None,
+                        help='Only look at launches of this kernel spec name')
+    parser.add_argument('--kind', choices=profile.PROFILE_MODES, default='importtime',
+                        help='Profiles to summarize (default: importtime)')
+    parser.add_argument('--profile-dir', default=None,
+                        help='Profile directory (default: $KERNDA_PROFILE_DIR or '
+                        'profiles in the state dir)')
+    parser.add_argument('--last', type=int, default=None,
+                        help='Only look at the N most recent profiles')
+    parser.add_argument('--sort', choices=('self', 'cumulative'), default='self',
+                        help='Median time to rank imports by (default: self)')
+    parser.add_argument('--top', type=int, default=20,
+                        help='Number of rows to show (default: 20)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    paths = profile.profile_files(args.kind, args.profile_dir, args.spec)
+    if args.last:
+        paths = paths[-args.last:]
+    if not paths:
+        print('Error: no {} profiles found in {}'.format(
+            args.kind, profile.profile_dir(args.profile_dir)), file=sys.stderr)
+        return 1
+    if args.kind == 'importtime':
+        rows = profile.summarize_imports(paths, args.top, args.sort)
+    else:
+        rows = profile.summarize_cprofile(paths, args.top)
+    if args.json:
+        print(json.dumps({'profiles': paths, 'rows': rows}, indent=2))
+        return 0
+    if args.kind == 'importtime':
+        print('{:>10} {:>10} {:>8}  {}'.format('self ms', 'cum ms', 'launches', 'module'))
+        for row in rows:
+            print('{:>10.1f} {:>10.1f} {:>8}  {}'.format(
+                row['self_ms'], row['cumulative_ms'], row['launches'], row['module']))
+    else:
+        print('{:>10} {:>10} {:>8}  {}'.format('cum ms', 'self ms', 'calls', 'function'))
+        for row in rows:
+            print('{:>10.1f} {:>10.1f} {:>8.0f}  {}'.format(
+                row['cumulative_ms'], row['self_ms'], row['calls'], row['function']))
+    print('{} profiles, medians per launch'.format(len(paths)) if args.kind == 'importtime'
+          else '{} profiles, means per launch'.format(len(paths)), file=sys.stderr)
+    return 0
+
+
+def analyze_env_command(argv):
+    """Measure the site and sys.path cost of an environment."""
+    from .analyze import analyze, format_analysis
+    parser = argparse.ArgumentParser(prog='kernda analyze-env',
+                                     description='Measure what .pth files and sys.path '
+                                     'entries cost every interpreter start in an environment')
+    parser.add_argument('prefix', help='Environment prefix')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of .pth files and sys.path entries to list (default: 10)')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='Runs per start time measurement, the fastest is '
+                        'reported (default: 5)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    try:
+        analysis = analyze(abspath(args.prefix), args.top, args.repeat)
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps(analysis, indent=2))
+    else:
+        for line in format_analysis(analysis):
+            print(line)
+    return 0
+
+
+def allocators_command(argv):
+    """Compare the resident memory of a workload under each allocator profile."""
+    from . import allocator
+    from .resources import format_size
+    parser = argparse.ArgumentParser(prog='kernda allocators',
+                                     description='Compare the steady-state resident memory '
+                                     'of a workload under each allocator profile')
+    parser.add_argument('prefix', help='Environment prefix')
+    parser.add_argument('--profile', dest='profiles', action='append',
+                        choices=sorted(allocator.PROFILES),
+                        help='Profile to measure; may be repeated (default: all the '
+                        'environment supports)')
+    parser.add_argument('--workload', default=None, metavar='FILE',
+                        help='Python script to run as the workload (default: threads '
+                        'that churn through objects of many sizes)')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per profile, medians are reported (default: 3)')
+    parser.add_argument('--settle', type=float, default=1.0,
+                        help='Seconds to wait after the workload before measuring '
+                        '(default: 1)')
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    workload = None
+    try:
+        if args.workload:
+            with open(args.workload) as f:
+                workload = f.read()
+        results = allocator.measure(abspath(args.prefix), args.profiles, workload,
+                                    args.repeat, args.settle)
+    except (IOError, OSError) as e:
+        _print_error(KerndaError('could not read the workload: {}'.format(e)))
+        return 1
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        base = dict((r['profile'], r['rss']) for r in results).get('default')
+        print('{:<10} {:>12} {:>12} {:>8} {:>8}'.format('profile', 'steady RSS', 'peak RSS',
+                                                      'vs def.', 'seconds'))
+        for r in results:
+            if r['error']:
+                print('{:<10} {}'.format(r['profile'], r['error']))
+                continue
+            print('{:<10} {:>12} {:>12} {:>8} {:>8.2f}'.format(
+                r['profile'], format_size(r['rss']), format_size(r['peak']),
+                '{:+.0f}%'.format(100.0 * (r['rss'] - base) / base) if base else '-',
+                r['seconds']))
+    return 1 if any(r['error'] for r in results) else 0
+
+
+def warm_command(argv):
+    """Compile the most imported packages of an environment into its bytecode cache."""
+    from . import pycache
+    from .resources import format_size, size
+    parser = argparse.ArgumentParser(prog='kernda warm',
+                                     description='Compile the most imported packages of an '
+                                     'environment into the bytecode cache kernels started '
+                                     'with --pycache use')
+    parser.add_argument('prefix', help='Environment prefix')
+    parser.add_argument('--module', dest='modules', action='append', default=[],
+                        help='Compile the package of this module; may be repeated '
+                        '(default: what --spec launches or a kernel start imports)')
+    parser.add_argument('--spec', default=None,
+                        help='Rank packages by the importtime profiles of launches of '
+                        'this kernel spec name, see --profile')
+    parser.add_argument('--profile-dir', default=None,
+                        help='Profile directory (default: $KERNDA_PROFILE_DIR or '
+                        'profiles in the state dir)')
+    parser.add_argument('--top', type=int, default=50,
+                        help='Number of packages to compile (default: 50)')
+    parser.add_argument('--pycache-dir', default=None,
+                        help='Root of the bytecode caches (default: $KERNDA_PYCACHE_DIR '
+                        'or kernda-pycache-<uid> in the temporary directory)')
+    parser.add_argument('--max-age', type=float, default=pycache.MAX_AGE_DAYS,
+                        metavar='DAYS',
+                        help='Evict bytecode unused for DAYS first (default: {:g})'.format(
+                            pycache.MAX_AGE_DAYS))
+    parser.add_argument('--max-size', type=size, default=pycache.MAX_SIZE, metavar='SIZE',
+                        help='Evict the least recently used bytecode over SIZE first '
+                        '(default: {})'.format(format_size(pycache.MAX_SIZE)))
+    parser.add_argument('--json', action='store_true', help='Print JSON')
+    args = parser.parse_args(argv)
+    try:
+        evicted = pycache.evict(args.pycache_dir, args.max_age, args.max_size)
+        result = pycache.warm(abspath(args.prefix), args.modules, args.spec,
+                              args.profile_dir, args.top, args.pycache_dir)
+    except (IOError, OSError) as e:
+        _print_error(KerndaError('could not evict old bytecode: {}'.format(e)))
+        return 1
+    except KerndaError as e:
+        _print_error(e)
+        return 1
+    result['evicted'] = evicted
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return 0
+    print('{:>8} {:>8}  {}'.format('compiled', 'files', 'package'))
+    for item in result['packages']:
+        print('{:>8} {:>8}  {}{}'.format(item['compiled'], item['files'], item['module'],
+                                         '  ({})'.format(item['error']) if item['error'] else ''))
+    print('{} files compiled into {} in {:.1f}s; evicted {} files ({})'.format(
+        sum(item['compiled'] for item in result['packages']), result['prefix'],
+        result['seconds'], evicted['removed'], format_size(evicted['freed'])), file=sys.stderr)
+    return 0
+
+
+COMMANDS = {
+    'serve': serve_command,
+    'status': status_command,
+    'refresh': refresh_command,
+    'watch': watch_command,
+    'stats': stats_command,
+    'regressions': regressions_command,
+    'doctor': doctor_command,
+    'check': check_command,
+    'loadtest': loadtest_command,
+    'profile': profile_command,
+    'analyze-env': analyze_env_command,
+    'allocators': allocators_command,
+    'warm': warm_command,
+}
+
+
 def cli(argv=sys.argv[1:]):
-    """Parse command line args and execute add_activation."""
+    """Parse command line args and execute add_activation.
+
+    The first argument may also name one of the `COMMANDS`.
+    """
+    if argv and argv[0] in COMMANDS and not isfile(argv[0]):
+        return COMMANDS[argv[0]](argv[1:])
     parser = argparse.ArgumentParser(description='')
     parser.add_argument('kernelspec', metavar='kernel.json',
                         help='Path to a kernel spec')
@@ -161,6 +658,26 @@ def cli(argv=sys.argv[1:]):
                         help=("Use 'conda /path/to/activate' (when True) or "
                               "'source /path/to/activate' (when False). Defaults to "
                               "False"))
+    parser.add_argument("--backend", dest="backend", type=str, default=None,
+                        help="Activation backend to use, e.g. conda, venv, pixi "
+                        "or one installed via the kernda.backends entry point "
+                        "(default: detected from the environment)")
+    parser.add_argument("--mode", dest="mode", choices=LAUNCH_MODES, default=None,
+                        help="How the kernel activates its environment on start: "
+                        "'source' runs the activation script in bash, 'snapshot' "
+                        "applies a cached activation via the kernda launcher, "
+                        "'direct' skips activation (default: the backend's "
+                        "preferred mode, or snapshot when modules are given)")
+    parser.add_argument("--module", dest="modules", action="append", default=[],
+                        help="Environment Module (Lmod) to load before activating "
+                        "the environment; may be repeated or comma-separated")
+    add_launcher_arguments(parser)
+    parser.add_argument("--refresh", action='store_true', default=False,
+                        help="Capture a new activation snapshot even if the cached "
+                        "one is fresh")
+    parser.add_argument("--server", nargs='?', const='', default=None, metavar='SOCKET',
+                        help="Build the spec in a running `kernda serve` daemon "
+                        "(default socket: $KERNDA_SOCKET or $XDG_RUNTIME_DIR/kernda.sock)")
 
     args, unknown = parser.parse_known_args(argv)
     return add_activation(args)
@@ -0,0 +1,71 @@
+"""conda plugin that refreshes kernda-managed specs after transactions.
+
+Registered through the ``conda`` entry point group. After ``conda install``,
+``update``, ``remove``, ``env update`` or ``env config vars`` against a
+prefix, the kernel specs kernda manages for that prefix are rebuilt and
+their activation snapshots captured again, inside the conda process.
+
+Prefixes without managed specs cost one read of the small registry file;
+the rest of kernda is only imported when there is work to do.
+"""
+from __future__ import print_function
+
+import sys
+
+from . import registry
+
+try:
+    from conda.plugins import hookimpl
+    from conda.plugins.types import CondaPostCommand
+except ImportError:
+    # Imported outside of conda, e.g. by the tests
+    hookimpl = None
+
+# conda command names after which activation may have changed
+RUN_FOR = frozenset(['install', 'update', 'upgrade', 'remove', 'uninstall',
+                     'env_update', 'env_vars'])
+
+
+def refresh_prefix(prefix):
+    """Refreshes the managed specs of a prefix, if it has any.
+
+    Failures are reported on stderr but never fail the conda command.
+
+    Returns
+    -------
+    dict
+        Results of `kernda.api.refresh_specs`, empty when nothing is managed
+    """
+    try:
+        paths = registry.managed_specs(prefix)
+        if not paths:
+            return {}
+        from .api import refresh_specs
+        results = refresh_specs(paths)
+    except Exception as e:
+        print('kernda: could not refresh kernel specs of {}: {}'.format(prefix, e),
+              file=sys.stderr)
+        return {}
+    for path, result in sorted(results.items()):
+        if result['ok']:
+            print('kernda: refreshed {}'.format(path), file=sys.stderr)
+        else:
+            print('kernda: could not refresh {}: {}'.format(path, result['error']),
+                  file=sys.stderr)
+    return results
+
+
+def post_command(command):
+    """Refreshes the specs of the prefix conda just operated on."""
+    from conda.base.context import context
+    refresh_prefix(context.target_prefix)
+
+
+if hookimpl is not None:
+    @hookimpl
+    def conda_post_commands():
+        yield CondaPostCommand(
+            name='kernda-refresh',
+            action=post_command,
+            run_for=set(RUN_FOR),
+        )
@@ -0,0 +1,224 @@
+"""Step-by-step timing of a kernel start, behind ``kernda doctor``.
+
+`diagnose` runs each part of a kernel start on its own and times it. The
+parts are:
+
+* bash startup
+* resolving the activate script
+* loading Environment Modules
+* running the activate script itself (for conda, its bootstrap)
+* each ``activate.d`` hook
+* starting the kernda launcher
+* starting the interpreter
+* ``site``/.pth processing
+* importing the kernel module
+
+Each phase comes with advice on the kernda mode or option that removes or
+reduces it. Phases that the spec's launch mode does not pay on every start
+are marked as such, e.g. activation in snapshot mode.
+"""
+import os
+import subprocess
+import sys
+import time
+from os.path import basename, join as pjoin
+
+from . import backends
+from .api import KerndaError, resolve_env_dir
+from .modules import load_command
+
+
+def time_call(func, repeat=3):
+    """Runs func repeat times and returns the fastest run in milliseconds."""
+    best = None
+    for _ in range(max(1, repeat)):
+        start = time.time()
+        func()
+        elapsed = (time.time() - start) * 1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def time_argv(argv, env=None, repeat=3):
+    """Times a command, returning the fastest of repeat runs in milliseconds.
+
+    Raises
+    ------
+    subprocess.CalledProcessError
+        If the command fails
+    """
+    with open(os.devnull, 'w') as devnull:
+        def run():
+            subprocess.check_call(argv, env=env, stdout=devnull, stderr=devnull)
+        return time_call(run, repeat)
+
+
+def kernel_module(argv):
+    """Gets the module a kernel start command runs with -m, if any."""
+    for i, arg in enumerate(argv[:-1]):
+        if arg == '-m':
+            return argv[i + 1]
+    return None
+
+
+def kernel_python(argv, env_dir):
+    """Gets the interpreter a kernel start command runs."""
+    if argv and basename(argv[0]).startswith('python'):
+        return argv[0]
+    return pjoin(env_dir, 'bin', 'python')
+
+
+def _phase(name, ms, per_launch, advice, **details):
+    phase = {'phase': name, 'ms': max(0.0, ms), 'per_launch': per_launch,
+             'advice': advice}
+    phase.update(details)
+    return phase
+
+
+def diagnose(spec, env_dir=None, backend=None, modules=None, repeat=3):
+    """Times each phase of a kernel start.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec, with or without kernda activation
+    env_dir : str, optional
+        Environment to activate (default: from the spec)
+    backend : str, optional
+        Activation backend name (default: from the spec or detected)
+    modules : list, optional
+        Environment Modules to load (default: from the spec)
+    repeat : int, optional
+        Runs per phase; the fastest run is reported
+
+    Returns
+    -------
+    list
+        Phases, slowest first, with ``phase``, ``ms``, ``per_launch`` (the
+        spec's launch mode pays this on every start) and ``advice``
+
+    Raises
+    ------
+    KerndaError
+        If the environment cannot be activated
+    """
+    options = spec.get('_kernda_options', {})
+    argv = spec.get('_kernda_original_argv') or spec['argv']
+    env_dir = env_dir or spec.get('_kernda_env_dir') or resolve_env_dir(spec)[0]
+    backend_name = backend or spec.get('_kernda_backend')
+    try:
+        backend_obj = (backends.get_backend(backend_name) if backend_name
+                       else backends.detect_backend(env_dir))
+    except KeyError:
+        raise KerndaError('unknown activation backend {}'.format(backend_name))
+    modules = list(options.get('modules') or () if modules is None else modules)
+    # Specs kernda has not processed yet do not activate at all
+    mode = spec.get('_kernda_mode') or (
+        'source' if spec['argv'][0] == 'bash' else None)
+    source = mode == 'source'
+    snapshot_advice = ('--mode snapshot replays the cached activation instead of '
+                       'running this on every start')
+    phases = []
+
+    bash_ms = time_argv(['bash', '-c', 'true'], repeat=repeat)
+    phases.append(_phase('bash startup', bash_ms, source,
+                         snapshot_advice if source else 'Not paid in this launch mode'))
+
+    needs_info = backend_obj.name == 'conda' and backends.needs_conda_info(env_dir)
+
+    def resolve():
+        # Forget the cached `conda info` result to time a cold lookup
+        backends.set_conda_info_prefix(None)
+        backend_obj.activate_command(env_dir,
+                                     conda_activate=options.get('conda_activate', False))
+    resolve_ms = time_call(resolve, 1)
+    phases.append(_phase(
+        'resolve activate script', resolve_ms, False,
+        'Set $CONDA_EXE so kernda does not have to run `conda info`' if needs_info
+        else 'Paid when specs are built and snapshots captured, not per start'))
+
+    baseline_ms = time_call(lambda: backends.run_shell_env('true'), repeat)
+    if modules:
+        modules_ms = time_call(lambda: backends.run_shell_env(load_command(modules)),
+                               repeat) - baseline_ms
+        phases.append(_phase('load modules', modules_ms, source,
+                             snapshot_advice if source else
+                             'Cached together with the activation snapshot',
+                             modules=modules))
+    else:
+        modules_ms = 0.0
+
+    # Time the activation command source mode runs, which is also what a
+    # snapshot capture runs
+    script = backend_obj.activate_command(
+        env_dir, conda_activate=options.get('conda_activate', False))
+    if modules:
+        script = '{} && {}'.format(load_command(modules), script)
+    hooks = []
+    try:
+        start = time.time()
+        env = backends.run_shell_env(script, hooks=hooks)
+        activate_ms = (time.time() - start) * 1000.0 - baseline_ms - modules_ms
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        raise KerndaError('could not activate {}: {}'.format(env_dir, e))
+    phases.append(_phase(
+        'conda bootstrap' if backend_obj.name == 'conda' else 'activate script',
+        activate_ms - sum(h['ms'] for h in hooks), source,
+        snapshot_advice if source else 'Only paid when the snapshot is captured'))
+    for hook in hooks:
+        phases.append(_phase(
+            'hook ' + basename(hook['path']), hook['ms'], source,
+            'Runs on every start in source mode; snapshot mode runs it only '
+            'when capturing' if source else 'Only paid when the snapshot is captured',
+            path=hook['path']))
+
+    launcher_ms = time_argv([sys.executable, '-c', 'import kernda.launch'], repeat=repeat)
+    phases.append(_phase(
+        'kernda launcher', launcher_ms, spec['argv'][1:3] == ['-m', 'kernda.launch'],
+        'Paid in snapshot mode and with launcher options; venv environments '
+        'can use --mode direct without options to skip it'))
+
+    python = kernel_python(argv, env_dir)
+    try:
+        bare_ms = time_argv([python, '-S', '-c', 'pass'], env, repeat)
+        site_ms = time_argv([python, '-c', 'pass'], env, repeat)
+    except (subprocess.CalledProcessError, OSError) as e:
+        raise KerndaError('could not run {}: {}'.format(python, e))
+    phases.append(_phase('interpreter startup', bare_ms, True,
+                         'Fixed cost of the interpreter; slow file systems make it worse'))
+    phases.append(_phase('site/.pth processing', site_ms - bare_ms, True,
+                         'Grows with .pth files, editable installs and sys.path entries '
+                         'in the environment; kernda analyze-env lists the worst'))
+
+    module = kernel_module(argv)
+    if module:
+        try:
+            import_ms = time_argv([python, '-c', 'import ' + module], env, repeat) - site_ms
+        except subprocess.CalledProcessError:
+            import_ms = None
+        if import_ms is not None:
+            phases.append(_phase('import ' + module, import_ms, True,
+                                 "The kernel's own imports; activation options cannot "
+                                 "remove them", module=module))
+
+    phases.sort(key=lambda p: -p['ms'])
+    return phases
+
+
+def format_phases(phases):
+    """Formats diagnose results as a ranked table.
+
+    Returns
+    -------
+    list
+        Lines of text
+    """
+    total = sum(p['ms'] for p in phases if p['per_launch'])
+    lines = ['{:>3}  {:<32} {:>9} {:>6}  {}'.format('#', 'phase', 'ms', 'share', 'advice')]
+    for rank, phase in enumerate(phases, 1):
+        share = '{:.0f}%'.format(100.0 * phase['ms'] / total) \
+            if phase['per_launch'] and total else '-'
+        lines.append('{:>3}  {:<32} {:>9.1f} {:>6}  {}'.format(
+            rank, phase['phase'][:32], phase['ms'], share, phase['advice']))
+    lines.append('Estimated start time in this launch mode: {:.0f}ms'.format(total))
+    return lines
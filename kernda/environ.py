@@ -0,0 +1,215 @@
+"""Helpers for comparing and applying activated process environments."""
+import os
+import re
+
+# Variables that differ between any two shells and say nothing about
+# the activation itself
+VOLATILE_VARS = frozenset(['_', 'SHLVL', 'PWD', 'OLDPWD'])
+
+
+def diff_env(before, after):
+    """Computes the change an activation made to an environment.
+
+    PATH-like variables whose new value ends with the old value are
+    recorded as a list of prepended entries so that the diff can be
+    applied on top of a different base environment later on.
+
+    Parameters
+    ----------
+    before : dict
+        Environment prior to activation
+    after : dict
+        Environment after activation
+
+    Returns
+    -------
+    dict
+        Diff with ``set``, ``unset`` and ``prepend`` keys
+    """
+    diff = {'set': {}, 'unset': [], 'prepend': {}}
+    for key, value in after.items():
+        if key in VOLATILE_VARS:
+            continue
+        old = before.get(key)
+        if old == value:
+            continue
+        if old and value.endswith(os.pathsep + old):
+            head = value[:-len(os.pathsep + old)]
+            diff['prepend'][key] = head.split(os.pathsep)
+        else:
+            diff['set'][key] = value
+    diff['unset'] = sorted(key for key in before
+                           if key not in after and key not in VOLATILE_VARS)
+    return diff
+
+
+def apply_env_diff(diff, environ=None):
+    """Applies a diff from `diff_env` to an environment.
+
+    Parameters
+    ----------
+    diff : dict
+        Activation diff
+    environ : dict, optional
+        Base environment (default: os.environ)
+
+    Returns
+    -------
+    dict
+        New environment; the base is not modified
+    """
+    env = dict(os.environ if environ is None else environ)
+    for key in diff.get('unset', ()):
+        env.pop(key, None)
+    env.update(diff.get('set', {}))
+    for key, entries in diff.get('prepend', {}).items():
+        parts = list(entries)
+        if env.get(key):
+            parts.append(env[key])
+        env[key] = os.pathsep.join(parts)
+    return env
+
+
+# Variables holding os.pathsep separated lists of directories (or files)
+# that are searched in order
+PATH_VARS = ('PATH', 'LD_LIBRARY_PATH', 'DYLD_LIBRARY_PATH', 'LIBRARY_PATH',
+             'CPATH', 'PKG_CONFIG_PATH', 'PYTHONPATH', 'XDG_DATA_DIRS')
+
+# Names of inherited variables that probably hold credentials
+SECRET_NAME_RE = re.compile(r'TOKEN|SECRET|PASSW(OR)?D|API_?KEY|PRIVATE_KEY|CREDENTIAL',
+                            re.IGNORECASE)
+
+
+def env_size(env):
+    """Computes the number of bytes an environment occupies in a process."""
+    return sum(len(k) + len(v) + 2 for k, v in env.items())
+
+
+def _rewrite_paths(env, path_vars, keep_entry):
+    """Filters the entries of PATH-like variables.
+
+    Returns
+    -------
+    int
+        Number of removed entries
+    """
+    removed = 0
+    for key in path_vars:
+        value = env.get(key)
+        if not value:
+            continue
+        entries = value.split(os.pathsep)
+        kept = [entry for entry in entries if keep_entry(key, entry)]
+        removed += len(entries) - len(kept)
+        if len(kept) != len(entries):
+            env[key] = os.pathsep.join(kept)
+    return removed
+
+
+def normalize_env(env, path_vars=PATH_VARS, prune_missing=True,
+                  prune_prefixes=(), max_value_size=None, drop_secrets=False,
+                  keep=()):
+    """Removes redundant and costly content from an environment.
+
+    Steps run in order and each one is reported separately:
+
+    * ``dedupe``: drop repeated entries of PATH-like variables, keeping
+      the first occurrence so lookup precedence is unchanged
+    * ``missing``: drop absolute entries that do not exist
+    * ``prefix``: drop entries below any of prune_prefixes, e.g. slow mounts
+    * ``oversized``: drop variables whose value exceeds max_value_size,
+      except the PATH-like ones, which the steps above shrink instead
+    * ``secrets``: drop variables that look like they hold credentials
+
+    Parameters
+    ----------
+    env : dict
+        Environment to normalize; it is not modified
+    path_vars : sequence, optional
+        Names of PATH-like variables to clean up
+    prune_missing : bool, optional
+        Drop non-existent entries (default: True)
+    prune_prefixes : sequence, optional
+        Directory prefixes whose entries are dropped
+    max_value_size : int, optional
+        Drop inherited variables with longer values, other than path_vars
+        (default: keep all)
+    drop_secrets : bool, optional
+        Drop inherited variables with secret-looking names (default: False)
+    keep : sequence, optional
+        Names of variables that must never be dropped, e.g. the ones
+        activation set
+
+    Returns
+    -------
+    tuple
+        (env, report) where report is a list of dicts with ``step``,
+        ``removed`` (entries or variables) and ``bytes`` saved
+    """
+    env = dict(env)
+    report = []
+    keep = set(keep)
+
+    def step(name, func):
+        size = env_size(env)
+        removed = func()
+        if removed:
+            report.append({'step': name, 'removed': removed,
+                           'bytes': size - env_size(env)})
+
+    def dedupe():
+        seen = {}
+
+        def first(key, entry):
+            entries = seen.setdefault(key, set())
+            if entry in entries:
+                return False
+            entries.add(entry)
+            return True
+        return _rewrite_paths(env, path_vars, first)
+
+    def exists(key, entry):
+        return not os.path.isabs(entry) or os.path.exists(entry)
+
+    prefixes = tuple(p.rstrip(os.sep) + os.sep for p in prune_prefixes)
+
+    def outside_prefixes(key, entry):
+        return not (entry + os.sep).startswith(prefixes)
+
+    def drop_vars(predicate):
+        names = [k for k, v in env.items() if k not in keep and predicate(k, v)]
+        for name in names:
+            del env[name]
+        return len(names)
+
+    step('dedupe', dedupe)
+    if prune_missing:
+        step('missing', lambda: _rewrite_paths(env, path_vars, exists))
+    if prefixes:
+        step('prefix', lambda: _rewrite_paths(env, path_vars, outside_prefixes))
+    if max_value_size:
+        # Without PATH the kernel command may not even be found
+        step('oversized', lambda: drop_vars(
+            lambda k, v: k not in path_vars and len(v) > max_value_size))
+    if drop_secrets:
+        step('secrets', lambda: drop_vars(lambda k, v: SECRET_NAME_RE.search(k)))
+    return env, report
+
+
+def format_report(report, before):
+    """Formats a normalization report as human readable lines.
+
+    Parameters
+    ----------
+    report : list
+        Report from `normalize_env`
+    before : int
+        Size of the environment prior to normalization, in bytes
+    """
+    lines = []
+    for item in report:
+        lines.append('{step:>10}: removed {removed} item(s), saved {bytes} bytes '
+                     '({pct:.1f}%)'.format(pct=100.0 * item['bytes'] / max(before, 1), **item))
+    total = sum(item['bytes'] for item in report)
+    lines.append('{:>10}: {} -> {} bytes'.format('total', before, before - total))
+    return lines
@@ -0,0 +1,231 @@
+"""SQLite history of kernel launches for latency statistics.
+
+The launcher adds one row per kernel start, from a process detached from
+the kernel start, see `kernda.launch.detach`. The database runs in WAL
+mode, so many launchers can write while ``kernda stats`` reads. It also
+holds the per-environment baselines and regression events of
+`kernda.regression`.
+"""
+import os
+import re
+import sqlite3
+import time
+from os.path import dirname, join as pjoin
+
+from .cache import state_dir
+from .util import percentile
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS launches (
+    time REAL NOT NULL,
+    spec TEXT,
+    env_dir TEXT,
+    host TEXT,
+    mode TEXT,
+    backend TEXT,
+    pid INTEGER,
+    cache_hit INTEGER,
+    activation_ms REAL,
+    launch_ms REAL,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS launches_time ON launches (time);
+CREATE INDEX IF NOT EXISTS launches_env ON launches (env_dir, fingerprint);
+CREATE TABLE IF NOT EXISTS baselines (
+    env_dir TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    packages TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS regressions (
+    time REAL NOT NULL,
+    env_dir TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    baseline_ms REAL,
+    current_ms REAL,
+    p_value REAL,
+    baseline_fingerprint TEXT,
+    fingerprint TEXT,
+    packages TEXT
+);
+'''
+
+# `kernda stats --group-by` keys and the columns they group on
+GROUP_COLUMNS = {
+    'spec': 'spec',
+    'env': 'env_dir',
+    'host': 'host',
+    'mode': 'mode',
+}
+
+# Seconds per unit of time windows like 30m or 7d
+_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+_WINDOW_RE = re.compile(r'^(\d+(?:\.\d+)?)([smhdw]?)$')
+
+
+def history_path():
+    """Gets the history database path from $KERNDA_HISTORY or the state dir."""
+    return os.getenv('KERNDA_HISTORY') or pjoin(state_dir(), 'history.sqlite')
+
+
+def connect(path=None, timeout=10.0):
+    """Opens the history database, creating it if needed.
+
+    Parameters
+    ----------
+    path : str, optional
+        Database path (default: `history_path`)
+    timeout : float, optional
+        Seconds to wait for concurrent writers
+
+    Returns
+    -------
+    sqlite3.Connection
+    """
+    path = path or history_path()
+    if not os.path.isdir(dirname(path)):
+        try:
+            os.makedirs(dirname(path))
+        except OSError:
+            pass
+    conn = sqlite3.connect(path, timeout=timeout)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def record(entry, path=None):
+    """Adds a launch record of the launcher to the history.
+
+    Parameters
+    ----------
+    entry : dict
+        Launch record as written to the launch log, optionally with the
+        ``fingerprint`` of its environment
+    path : str, optional
+        Database path (default: `history_path`)
+    """
+    launch_ms = None
+    if entry.get('exec') is not None:
+        launch_ms = (entry['exec'] - entry['time']) * 1000.0
+    hit = entry.get('cache_hit')
+    conn = connect(path)
+    try:
+        with conn:
+            conn.execute(
+                'INSERT INTO launches (time, spec, env_dir, host, mode, backend, pid, '
+                'cache_hit, activation_ms, launch_ms, fingerprint) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (entry['time'], entry.get('spec'), entry.get('env_dir'),
+                 entry.get('host'), entry.get('mode'), entry.get('backend'),
+                 entry.get('pid'), None if hit is None else int(hit),
+                 entry.get('activation_ms'), launch_ms, entry.get('fingerprint')))
+    finally:
+        conn.close()
+
+
+def parse_window(text):
+    """Converts a time window like 90s, 30m, 24h, 7d or 2w to seconds.
+
+    Raises
+    ------
+    ValueError
+        If text is not a valid window
+    """
+    match = _WINDOW_RE.match(text.strip())
+    if match is None:
+        raise ValueError('invalid time window: {}'.format(text))
+    return float(match.group(1)) * _UNITS[match.group(2) or 's']
+
+
+def launch_times(spec=None, since=None, until=None, path=None):
+    """Lists the start times of recorded launches, oldest first.
+
+    Parameters
+    ----------
+    spec : str, optional
+        Only list launches of this kernel spec name
+    since, until : float, optional
+        Only list launches at or after since and before until
+    path : str, optional
+        Database path (default: `history_path`)
+    """
+    query = 'SELECT time FROM launches WHERE time >= ? AND time < ?'
+    params = [since or 0, time.time() if until is None else until]
+    if spec:
+        query += ' AND spec = ?'
+        params.append(spec)
+    conn = connect(path)
+    try:
+        return [row[0] for row in conn.execute(query + ' ORDER BY time', params)]
+    finally:
+        conn.close()
+
+
+def _summary(values):
+    values = sorted(v for v in values if v is not None)
+    return {
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'p99_ms': percentile(values, 99),
+        'max_ms': values[-1] if values else None,
+    }
+
+
+def launch_stats(since=None, until=None, group_by=('spec',), path=None):
+    """Computes launch latency percentiles from the history.
+
+    Parameters
+    ----------
+    since : float, optional
+        Only count launches at or after this timestamp
+    until : float, optional
+        Only count launches before this timestamp (default: now)
+    group_by : list, optional
+        Keys of `GROUP_COLUMNS` to group launches by
+    path : str, optional
+        Database path (default: `history_path`)
+
+    Returns
+    -------
+    list
+        One dict per group, sorted by group, with the group keys, ``count``,
+        ``cache_hit_rate`` and percentile summaries of ``activation`` and
+        ``launch`` (launcher start to kernel exec) latency
+
+    Raises
+    ------
+    ValueError
+        If a group_by key is unknown
+    """
+    for key in group_by:
+        if key not in GROUP_COLUMNS:
+            raise ValueError('cannot group by {}; choose from {}'.format(
+                key, ', '.join(sorted(GROUP_COLUMNS))))
+    columns = [GROUP_COLUMNS[key] for key in group_by]
+    until = time.time() if until is None else until
+    conn = connect(path)
+    try:
+        rows = conn.execute(
+            'SELECT {} activation_ms, launch_ms, cache_hit FROM launches '
+            'WHERE time >= ? AND time < ?'.format(''.join(c + ', ' for c in columns)),
+            (since or 0, until)).fetchall()
+    finally:
+        conn.close()
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(tuple(row[:len(columns)]), []).append(row[len(columns):])
+    stats = []
+    for group, samples in sorted(groups.items(), key=lambda item: [str(v) for v in item[0]]):
+        hits = [s[2] for s in samples if s[2] is not None]
+        entry = dict(zip(group_by, group))
+        entry.update({
+            'count': len(samples),
+            'cache_hit_rate': float(sum(hits)) / len(hits) if hits else None,
+            'activation': _summary(s[0] for s in samples),
+            'launch': _summary(s[1] for s in samples),
+        })
+        stats.append(entry)
+    return stats
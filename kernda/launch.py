@@ -0,0 +1,620 @@
+"""Kernel launcher used by kernel specs in snapshot launch mode.
+
+Kernel specs written with ``--mode snapshot`` start the kernel with::
+
+    python -m kernda.launch --backend NAME --env-dir PREFIX [--module M]... -- KERNEL ARGV...
+
+The launcher applies the cached activation of the environment (capturing
+a new one when the environment changed since the last capture) and execs
+the kernel in place, so no shell or activation script runs on a warm start.
+
+Kernel specs in the other launch modes go through the launcher without
+``--backend`` when they use any of the launcher options, e.g. environment
+normalization. The launcher then applies those options and execs the
+command as-is.
+
+Every launch is recorded in the launch log (`kernda.launchlog`), the
+launch history (`kernda.history`) and optionally in Prometheus metrics
+(`kernda.metrics`). With ``--timing`` in source mode the ``bash -c``
+command traces itself to `TRACE_FD`. The launcher forks a short-lived reader for that trace before
+it execs bash, so the kernel keeps the launcher's pid. The reader writes
+the launch record once bash reaches the ``exec`` of the kernel.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import re
+import select
+import socket
+import sys
+import time
+
+from .backends import get_backend
+from .environ import apply_env_diff, normalize_env
+from .launchlog import TRACE_PS4, record_launch, trace_timings
+from .snapshot import load_snapshot, take_snapshot
+
+# File descriptor on which timed source mode commands write their xtrace
+TRACE_FD = 19
+# Prefix for the kernel start command that keeps the kernel from
+# inheriting the trace pipe
+TRACE_CLOSE = '{}>&- '.format(TRACE_FD)
+# Seconds the trace reader waits for bash to reach the kernel exec
+TRACE_TIMEOUT = 300
+_EXEC_RE = re.compile(r'^\+\d+(?:\.\d+)? exec ')
+
+
+def _resources_type(name):
+    """Gets an argparse type that imports `kernda.resources` only when used.
+
+    Most launches set none of the resource options, so the launcher does not
+    import that module, or the other option modules, up front.
+    """
+    def parse(value):
+        from . import resources
+        return getattr(resources, name)(value)
+    parse.__name__ = name
+    return parse
+
+
+def add_launcher_arguments(parser):
+    """Adds the options the launcher applies at kernel start to a parser.
+
+    The same options are accepted by the kernda command line, which
+    forwards them to the launcher with `launcher_args`.
+
+    Returns
+    -------
+    list
+        The added argparse actions
+    """
+    group = parser.add_argument_group('launcher options')
+    return [
+        group.add_argument('--normalize', action='store_true', default=False,
+                           help='Dedupe PATH-like variables and drop entries that '
+                           'do not exist before starting the kernel; in source mode '
+                           'before activation, so entries it adds stay'),
+        group.add_argument('--prune-prefix', dest='prune_prefixes', action='append',
+                           default=[], metavar='DIR',
+                           help='Drop PATH-like entries below DIR, e.g. slow mounts; '
+                           'may be repeated'),
+        group.add_argument('--max-var-size', dest='max_var_size', type=int,
+                           default=None, metavar='BYTES',
+                           help='Drop inherited variables with values larger '
+                           'than BYTES'),
+        group.add_argument('--drop-secrets', action='store_true', default=False,
+                           help='Drop inherited variables whose names look like '
+                           'they hold credentials (TOKEN, SECRET, PASSWORD, ...)'),
+        group.add_argument('--timing', action='store_true', default=False,
+                           help='Time the activation script and each activate.d '
+                           'hook it runs in the launch log (needs bash 5)'),
+        group.add_argument('--launch-log', dest='launch_log', default=None,
+                           metavar='PATH',
+                           help='Launch log to append to (default: '
+                           '$KERNDA_LAUNCH_LOG or launches.jsonl in the state dir)'),
+        group.add_argument('--prom-file', dest='prom_file', default=None,
+                           metavar='PATH',
+                           help='Prometheus textfile to keep launch metrics in '
+                           '(default: $KERNDA_PROM_FILE, if set)'),
+        group.add_argument('--trace-dir', dest='trace_dir', default=None,
+                           metavar='DIR',
+                           help='Directory to write OTLP JSON traces of launches to '
+                           '(default: $KERNDA_TRACE_DIR, if set)'),
+        group.add_argument('--trace-kernel-info', action='store_true', default=False,
+                           help='End launch traces at the first kernel_info reply '
+                           'of the kernel (needs jupyter_client)'),
+        group.add_argument('--profile', default=None, choices=('importtime', 'cprofile'),
+                           help='Profile the kernel until it is ready with -X '
+                           'importtime or cProfile, one file per launch; not '
+                           'available in source mode'),
+        group.add_argument('--profile-dir', dest='profile_dir', default=None,
+                           metavar='DIR',
+                           help='Directory for --profile files (default: '
+                           '$KERNDA_PROFILE_DIR or profiles in the state dir)'),
+        group.add_argument('--thread-cap', dest='thread_cap', type=_resources_type('thread_cap'),
+                           default=None,
+                           metavar='N|auto',
+                           help='Cap BLAS/OpenMP/numexpr thread pools at N threads, or '
+                           'with auto at the available CPUs divided by the kernels '
+                           'running on the node; thread variables already set win'),
+        group.add_argument('--placement', default=None,
+                           choices=('round-robin', 'least-loaded'),
+                           help='Pin the kernel to the CPUs of one NUMA node, picked '
+                           'round-robin or by fewest kernels, and prefer its memory '
+                           'when numactl is available'),
+        group.add_argument('--placement-file', dest='placement_file', default=None,
+                           metavar='PATH',
+                           help='Allocation file shared by the launches on a node '
+                           '(default: $KERNDA_PLACEMENT_FILE or one per host in the '
+                           'state dir)'),
+        group.add_argument('--limit-as', dest='limit_as', type=_resources_type('size'),
+                           default=None,
+                           metavar='SIZE',
+                           help='Limit the address space of the kernel, e.g. 16G'),
+        group.add_argument('--limit-nofile', dest='limit_nofile', type=_resources_type('nofile'),
+                           default=None, metavar='N',
+                           help='Limit the open files of the kernel'),
+        group.add_argument('--cgroup', default=None, metavar='DIR',
+                           help='Start the kernel in a new child of this writable '
+                           'cgroup v2 directory'),
+        group.add_argument('--memory-max', dest='memory_max', type=_resources_type('size'),
+                           default=None, metavar='SIZE',
+                           help='memory.max of the kernel cgroup, e.g. 8G (needs --cgroup)'),
+        group.add_argument('--cpu-weight', dest='cpu_weight',
+                           type=_resources_type('cpu_weight'),
+                           default=None, metavar='N',
+                           help='cpu.weight of the kernel cgroup, 1-10000 with 100 as '
+                           'the default share (needs --cgroup)'),
+        group.add_argument('--priority', default=None,
+                           choices=('batch', 'idle', 'interactive', 'normal'),
+                           help='CPU and I/O priority tier of the kernel: interactive, '
+                           'normal, batch (nice 10, SCHED_BATCH) or idle (nice 19, '
+                           'idle I/O, SCHED_IDLE)'),
+        group.add_argument('--allocator', default=None,
+                           choices=('compact', 'jemalloc', 'tcmalloc'),
+                           help='Memory allocator profile: compact glibc arenas, or '
+                           'jemalloc or tcmalloc preloaded from the environment; not '
+                           'in source mode'),
+        group.add_argument('--pycache', action='store_true', default=False,
+                           help='Keep the bytecode of the kernel in a cache per environment '
+                           'and interpreter on local storage ($PYTHONPYCACHEPREFIX, '
+                           'Python 3.8+)'),
+        group.add_argument('--pycache-dir', dest='pycache_dir', default=None,
+                           metavar='DIR',
+                           help='Root of the --pycache caches (default: $KERNDA_PYCACHE_DIR '
+                           'or kernda-pycache-<uid> in the temporary directory)'),
+        group.add_argument('--pycache-max-age', dest='pycache_max_age', type=float,
+                           default=30.0, metavar='DAYS',
+                           help='Evict bytecode unused for DAYS (default: 30)'),
+        group.add_argument('--pycache-max-size', dest='pycache_max_size',
+                           type=_resources_type('size'), default=1024 ** 3, metavar='SIZE',
+                           help='Evict the least recently used bytecode over SIZE '
+                           '(default: 1G)'),
+    ]
+
+
+def launcher_options(args):
+    """Collects the launcher options that differ from their defaults.
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed arguments from a parser set up with `add_launcher_arguments`
+
+    Returns
+    -------
+    dict
+        Option values keyed by argparse dest
+    """
+    options = {}
+    for action in add_launcher_arguments(argparse.ArgumentParser(add_help=False)):
+        value = getattr(args, action.dest, action.default)
+        if value is not None and value != action.default:
+            options[action.dest] = value
+    return options
+
+
+def launcher_args(args):
+    """Converts parsed launcher options back into launcher flags.
+
+    Options left at their defaults are omitted.
+
+    Parameters
+    ----------
+    args : Namespace
+        Parsed arguments from a parser set up with `add_launcher_arguments`
+
+    Returns
+    -------
+    list
+        Command line flags for the launcher
+    """
+    flags = []
+    for action in add_launcher_arguments(argparse.ArgumentParser(add_help=False)):
+        value = getattr(args, action.dest, action.default)
+        if value is None or value == action.default:
+            continue
+        flag = action.option_strings[0]
+        if action.nargs == 0:
+            flags.append(flag)
+        elif isinstance(value, list):
+            for item in value:
+                flags.extend([flag, str(item)])
+        else:
+            flags.extend([flag, str(value)])
+    return flags
+
+
+def normalize_options(args):
+    """Gets `normalize_env` keyword arguments from launcher options.
+
+    Returns
+    -------
+    dict or None
+        None when no normalization was requested
+    """
+    options = {
+        'prune_missing': getattr(args, 'normalize', False),
+        'prune_prefixes': getattr(args, 'prune_prefixes', None) or [],
+        'max_value_size': getattr(args, 'max_var_size', None),
+        'drop_secrets': getattr(args, 'drop_secrets', False),
+    }
+    if not any(options.values()):
+        return None
+    return options
+
+
+def build_argv(backend_name, env_dir, argv, python=None, modules=(),
+               extra_args=(), spec_name=None, mode=None):
+    """Builds the kernel spec argv that starts a kernel via the launcher.
+
+    Parameters
+    ----------
+    backend_name : str or None
+        Name of the activation backend or None to skip activation
+    env_dir : str or None
+        Environment prefix, recorded in the launch log without a backend
+    argv : list
+        Kernel start command
+    python : str, optional
+        Interpreter that has kernda installed (default: sys.executable)
+    modules : list, optional
+        Environment Modules to load before activation
+    extra_args : list, optional
+        Launcher flags from `launcher_args`
+    spec_name : str, optional
+        Kernel spec name recorded in the launch log
+    mode : str, optional
+        Launch mode recorded in the launch log
+
+    Returns
+    -------
+    list
+        Kernel spec argv
+    """
+    cmd = [python or sys.executable, '-m', 'kernda.launch']
+    if backend_name:
+        cmd.extend(['--backend', backend_name])
+    if env_dir:
+        cmd.extend(['--env-dir', env_dir])
+    for module in modules:
+        cmd.extend(['--module', module])
+    if spec_name:
+        cmd.extend(['--spec-name', spec_name])
+    if mode:
+        cmd.extend(['--mode', mode])
+    return cmd + list(extra_args) + ['--'] + list(argv)
+
+
+def activated_environ(backend, env_dir, environ=None, modules=(), hooks=None,
+                      timings=None):
+    """Gets the environment the kernel should run with.
+
+    hooks, when given, receives the ``activate.d`` hook timings of a
+    snapshot captured on the way. timings, when given, receives the
+    ``resolved`` timestamp at which the cached snapshot was found fresh or
+    not.
+
+    Returns
+    -------
+    tuple
+        (environ, entry, hit) where entry is the applied snapshot and hit
+        is True when the cached snapshot was fresh
+    """
+    entry = load_snapshot(backend, env_dir, modules=modules)
+    hit = entry is not None
+    if timings is not None:
+        timings['resolved'] = time.time()
+    if not hit:
+        entry = take_snapshot(backend, env_dir, modules, hooks=hooks)
+    return apply_env_diff(entry['diff'], environ), entry, hit
+
+
+def trace_script(script):
+    """Makes a bash script write a timestamped xtrace to `TRACE_FD`.
+
+    The kernel start command in the script should begin with
+    `TRACE_CLOSE`.
+    """
+    return 'BASH_XTRACEFD={}; PS4=\'{}\'; set -x; {}'.format(TRACE_FD, TRACE_PS4, script)
+
+
+def read_trace(fd, timeout=TRACE_TIMEOUT):
+    """Reads trace lines from fd until bash execs the kernel or exits.
+
+    Returns
+    -------
+    list
+        Trace lines
+    """
+    deadline = time.time() + timeout
+    lines = []
+    buf = b''
+    while True:
+        remaining = deadline - time.time()
+        if remaining <= 0 or not select.select([fd], [], [], remaining)[0]:
+            break
+        chunk = os.read(fd, 64 * 1024)
+        if not chunk:
+            break
+        parts = (buf + chunk).split(b'\n')
+        buf = parts.pop()
+        for part in parts:
+            lines.append(part.decode('utf8', 'replace'))
+            # The top-level exec is the last thing bash traces
+            if _EXEC_RE.match(lines[-1]):
+                return lines
+    if buf:
+        lines.append(buf.decode('utf8', 'replace'))
+    return lines
+
+
+def detach(func, *args, **kwargs):
+    """Runs func(*args, **kwargs) in a double-forked process and returns at once.
+
+    The process is reparented to init, so the kernel the launcher is about
+    to become never has to reap it. Errors in func are ignored.
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            if os.fork() == 0:
+                func(*args, **kwargs)
+        finally:
+            os._exit(0)
+    os.waitpid(pid, 0)
+
+
+def save_record(record, prom_file=None, trace_dir=None, kernel_info=None):
+    """Saves a launch record to the history, metrics and trace directory.
+
+    Also checks the launch for latency regressions, see `kernda.regression`.
+
+    Parameters
+    ----------
+    record : dict
+        Launch record as written to the launch log
+    prom_file : str, optional
+        Prometheus textfile, see `kernda.metrics.prom_path`
+    trace_dir : str, optional
+        Directory for OTLP JSON traces; needs trace ids in record
+    kernel_info : str, optional
+        Connection file of the kernel; the trace then ends at the
+        kernel's first kernel_info reply
+    """
+    from . import history, metrics, regression, tracing
+    prom_file = metrics.prom_path(prom_file)
+    if prom_file:
+        try:
+            metrics.record(record, prom_file)
+        except (IOError, OSError):
+            pass
+    if trace_dir:
+        if kernel_info:
+            try:
+                record['kernel_ready'] = tracing.wait_kernel_info(kernel_info)
+            except Exception:
+                pass
+        try:
+            tracing.write_trace(tracing.launch_spans(record), trace_dir, record.get('host'))
+        except (IOError, OSError):
+            pass
+    regression.observe(record)
+    history.record(record)
+    regression.check_record(record)
+
+
+def _finish_trace(r, w, record, path, outputs, timeout):
+    os.close(w)
+    timings = trace_timings(read_trace(r, timeout))
+    record.update(timings)
+    record['activated'] = timings['exec']
+    if timings['exec'] is not None:
+        record['activation_ms'] = (timings['exec'] - record['time']) * 1000.0
+    record_launch(record, path)
+    save_record(record, **outputs)
+
+
+def trace_in_background(record, path=None, timeout=TRACE_TIMEOUT, **outputs):
+    """Detaches a reader for the trace of a timed source mode command.
+
+    Afterwards `TRACE_FD` is the write end of the trace pipe. The reader
+    completes record with the traced timings and saves it to the launch
+    log and, with the keyword arguments of `save_record`, elsewhere.
+    """
+    r, w = os.pipe()
+    detach(_finish_trace, r, w, record, path, outputs, timeout)
+    os.close(r)
+    os.dup2(w, TRACE_FD)
+    os.close(w)
+
+
+def main(argv=None):
+    """Parses launcher arguments, activates and execs the kernel."""
+    start = time.time()
+    if argv is None:
+        argv = sys.argv[1:]
+    parser = argparse.ArgumentParser(prog='python -m kernda.launch',
+                                     description='Activate an environment from '
+                                     'a cached snapshot and exec a kernel')
+    parser.add_argument('--backend', default=None,
+                        help='Name of the activation backend (default: no activation)')
+    parser.add_argument('--env-dir', default=None,
+                        help='Path to the environment to activate, or only to '
+                        'record in the launch log without --backend')
+    parser.add_argument('--module', dest='modules', action='append', default=[],
+                        help='Environment Module to load before activation')
+    parser.add_argument('--spec-name', default=None,
+                        help='Kernel spec name for the launch log')
+    parser.add_argument('--mode', default=None,
+                        help='Launch mode for the launch log (default: snapshot '
+                        'with --backend, direct without)')
+    add_launcher_arguments(parser)
+    parser.add_argument('cmd', nargs=argparse.REMAINDER,
+                        help='Kernel start command, after --')
+    args = parser.parse_args(argv)
+    cmd = args.cmd[1:] if args.cmd[:1] == ['--'] else args.cmd
+    if not cmd:
+        parser.error('no kernel start command given')
+    if args.backend and not args.env_dir:
+        parser.error('--backend requires --env-dir')
+
+    keep = ()
+    hit = None
+    hooks = [] if args.timing else None
+    timings = {}
+    if args.backend:
+        env, entry, hit = activated_environ(get_backend(args.backend), args.env_dir,
+                                            modules=args.modules, hooks=hooks,
+                                            timings=timings)
+        keep = set(entry['diff'].get('set', ())) | set(entry['diff'].get('prepend', ()))
+    else:
+        env = dict(os.environ)
+    options = normalize_options(args)
+    if options is not None:
+        env, _ = normalize_env(env, keep=keep, **options)
+    node = None
+    if args.placement:
+        from . import placement
+        try:
+            cmd, node = placement.place(args.placement, cmd, args.placement_file)
+        except (AttributeError, IOError, OSError) as e:
+            # No sched_setaffinity outside Linux
+            print('kernda: not placing the kernel: {}'.format(e), file=sys.stderr)
+    cap = None
+    if args.thread_cap is not None:
+        from .resources import apply_thread_caps, resolve_thread_cap
+        # After placement, so an automatic cap counts the CPUs of the node only
+        cap = resolve_thread_cap(args.thread_cap)
+        env = apply_thread_caps(env, cap)
+    limits = {}
+    if args.limit_as or args.limit_nofile:
+        from .resources import apply_rlimits
+        try:
+            limits = apply_rlimits(args.limit_as, args.limit_nofile)
+        except (ValueError, OSError) as e:
+            print('kernda: could not limit the kernel: {}'.format(e), file=sys.stderr)
+    if args.allocator and args.mode == 'source':
+        print('kernda: not changing the allocator of bash and the activation script in '
+              'source mode', file=sys.stderr)
+    elif args.allocator:
+        from .allocator import allocator_env
+        from .api import KerndaError
+        try:
+            env = allocator_env(env, args.allocator, args.env_dir)
+            limits['allocator'] = args.allocator
+        except KerndaError as e:
+            print('kernda: not changing the allocator: {}'.format(e), file=sys.stderr)
+    if args.priority:
+        from .resources import apply_priority
+        try:
+            applied, problems = apply_priority(args.priority)
+            limits['priority'] = dict(applied, tier=args.priority)
+        except OSError as e:
+            problems = [str(e)]
+        for problem in problems:
+            print('kernda: {}'.format(problem), file=sys.stderr)
+    cgroup = None
+    if args.cgroup:
+        from .resources import create_cgroup
+        try:
+            cgroup = limits['cgroup'] = create_cgroup(
+                args.cgroup, args.memory_max, args.cpu_weight)
+        except (IOError, OSError) as e:
+            print('kernda: not starting the kernel in a cgroup: {}'.format(e),
+                  file=sys.stderr)
+    pycache_prefix = None
+    evict = False
+    if args.pycache:
+        from . import pycache
+        try:
+            env, pycache_prefix = pycache.apply_pycache(
+                env, args.env_dir or os.path.dirname(os.path.dirname(cmd[0])),
+                args.pycache_dir)
+            evict = pycache.claim_eviction(args.pycache_dir)
+        except (IOError, OSError) as e:
+            print('kernda: not moving the bytecode cache: {}'.format(e), file=sys.stderr)
+
+    end = time.time()
+    mode = args.mode or ('snapshot' if args.backend else 'direct')
+    record = {
+        'time': start,
+        'spec': args.spec_name,
+        'env_dir': args.env_dir,
+        'backend': args.backend,
+        'mode': mode,
+        'cache_hit': hit,
+        'activated': end,
+        'activation_ms': (end - start) * 1000.0,
+        'host': socket.gethostname(),
+        'pid': os.getpid(),
+    }
+    record.update(timings)
+    if cap is not None:
+        record['thread_cap'] = cap
+    if node is not None:
+        record['numa_node'] = node
+    if limits:
+        record['limits'] = limits
+    if pycache_prefix:
+        record['pycache'] = pycache_prefix
+    # As tracing.trace_dir, without importing tracing for untraced launches
+    outputs = {'prom_file': args.prom_file,
+               'trace_dir': args.trace_dir or os.getenv('KERNDA_TRACE_DIR') or None}
+    if outputs['trace_dir']:
+        from . import tracing
+        parent = tracing.parse_traceparent(os.environ.get(tracing.TRACEPARENT))
+        record['trace_id'] = parent[0] if parent else tracing.new_id(16)
+        record['parent_span_id'] = parent[1] if parent else None
+        record['span_id'] = tracing.new_id(8)
+        env[tracing.TRACEPARENT] = tracing.format_traceparent(record['trace_id'],
+                                                              record['span_id'])
+        if args.trace_kernel_info:
+            outputs['kernel_info'] = tracing.connection_file(cmd)
+    if args.profile and args.mode == 'source':
+        print('kernda: not profiling bash and the activation script in source mode',
+              file=sys.stderr)
+        args.profile = None
+    if args.profile:
+        from . import profile
+        record['profile'] = profile.profile_path(args.profile, args.profile_dir,
+                                                 args.spec_name, start)
+    try:
+        if args.timing and mode == 'source':
+            trace_in_background(record, args.launch_log, **outputs)
+        else:
+            if hooks is not None:
+                record['hooks'] = hooks
+            record['exec'] = time.time()
+            record_launch(record, args.launch_log)
+            # SQLite takes milliseconds to import, so let a detached process wait
+            detach(save_record, record, **outputs)
+    except (IOError, OSError):
+        # Never fail a kernel start because the log is not writable
+        pass
+    if evict:
+        # Walking the bytecode cache takes a while
+        detach(pycache.evict, args.pycache_dir, args.pycache_max_age, args.pycache_max_size)
+    if args.profile:
+        try:
+            env = profile.prepare(env, args.profile, record['profile'])
+        except (IOError, OSError) as e:
+            print('kernda: not profiling the kernel: {}'.format(e), file=sys.stderr)
+    if cgroup:
+        from .resources import join_cgroup
+        # Only now, so the detached processes above are not charged to the kernel
+        try:
+            join_cgroup(cgroup)
+        except (IOError, OSError) as e:
+            print('kernda: not starting the kernel in a cgroup: {}'.format(e),
+                  file=sys.stderr)
+            try:
+                os.rmdir(cgroup)
+            except OSError:
+                pass
+    os.execvpe(cmd[0], cmd, env)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
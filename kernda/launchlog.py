@@ -0,0 +1,176 @@
+"""Log of kernel launches made through the kernda launcher.
+
+The launcher appends one JSON line per kernel start. Each line is a single
+``O_APPEND`` write, so concurrent launches never interleave records. Once
+the log grows past $KERNDA_LAUNCH_LOG_MAX_BYTES (default 10 MiB) it is
+renamed to ``<log>.1``, shifting older logs up to ``<log>.BACKUPS``.
+
+Records carry wall clock timestamps of the launch phases: ``time`` (the
+launcher started), ``activated`` and ``exec``. With ``--timing`` they also
+list the ``activate.d`` hooks that ran, timed from a bash xtrace whose
+prompt holds ``$EPOCHREALTIME`` (bash 5+), see `trace_timings`.
+"""
+import errno
+import json
+import os
+import re
+from os.path import join as pjoin
+
+from .cache import state_dir
+
+# How much of the end of the log `read_launches` looks at
+TAIL_BYTES = 256 * 1024
+# Size at which the log is rotated and how many rotated logs are kept
+MAX_BYTES = 10 * 1024 * 1024
+BACKUPS = 2
+
+# PS4 that makes bash prefix each traced command with a timestamp
+TRACE_PS4 = '+$EPOCHREALTIME '
+_TRACE_RE = re.compile(r'^(\++)(\d+(?:\.\d+)?) (.*)$')
+_HOOK_RE = re.compile(r"""^(?:\.|source) '?([^']*/activate\.d/[^']*)'?$""")
+
+
+def log_path():
+    """Gets the launch log path from $KERNDA_LAUNCH_LOG or the state dir."""
+    return os.getenv('KERNDA_LAUNCH_LOG') or pjoin(state_dir(), 'launches.jsonl')
+
+
+def max_bytes():
+    """Gets the rotation size from $KERNDA_LAUNCH_LOG_MAX_BYTES."""
+    try:
+        return int(os.getenv('KERNDA_LAUNCH_LOG_MAX_BYTES', MAX_BYTES))
+    except ValueError:
+        return MAX_BYTES
+
+
+def rotate(path, backups=BACKUPS):
+    """Renames a log to <path>.1, shifting older rotated logs up."""
+    for i in range(backups - 1, 0, -1):
+        src = '{}.{}'.format(path, i)
+        if os.path.exists(src):
+            os.rename(src, '{}.{}'.format(path, i + 1))
+    if backups > 0:
+        os.rename(path, path + '.1')
+    else:
+        os.remove(path)
+
+
+def record_launch(entry, path=None, limit=None):
+    """Appends a launch record to the log, rotating the log when full.
+
+    Parameters
+    ----------
+    entry : dict
+        JSON-serializable launch record
+    path : str, optional
+        Log path (default: `log_path`)
+    limit : int, optional
+        Rotation size in bytes (default: `max_bytes`, 0 disables rotation)
+    """
+    path = path or log_path()
+    limit = max_bytes() if limit is None else limit
+    line = (json.dumps(entry, sort_keys=True) + '\n').encode('utf8')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    except OSError as e:
+        if e.errno != errno.ENOENT:
+            raise
+        os.makedirs(os.path.dirname(path))
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, line)
+        st = os.fstat(fd)
+    finally:
+        os.close(fd)
+    if limit and st.st_size >= limit:
+        try:
+            # Another launcher may have rotated the log in the meantime
+            if os.stat(path).st_ino == st.st_ino:
+                rotate(path)
+        except OSError:
+            pass
+
+
+def trace_timings(lines):
+    """Extracts phase and hook timings from a timestamped bash xtrace.
+
+    Parameters
+    ----------
+    lines : iterable of str
+        Trace written with PS4 set to `TRACE_PS4`; bash repeats the ``+``
+        once per nesting level of sourced files, functions and evals
+
+    Returns
+    -------
+    dict
+        ``shell_start`` (first traced command), ``exec`` (the top-level
+        ``exec`` of the kernel; None when bash never got there) and
+        ``hooks``, a list of sourced ``activate.d`` scripts with their
+        ``start`` timestamp and duration in ``ms``
+    """
+    hooks = []
+    running = []
+    first = last = exec_time = None
+    for line in lines:
+        match = _TRACE_RE.match(line.rstrip('\n'))
+        if match is None:
+            # Continuation of a multi-line command or untimed output
+            continue
+        depth, ts, command = len(match.group(1)), float(match.group(2)), match.group(3)
+        if first is None:
+            first = ts
+        # A hook ends with the next command that is not nested in it
+        while running and running[-1][0] >= depth:
+            _, hook_path, start = running.pop()
+            hooks.append({'path': hook_path, 'start': start, 'ms': (ts - start) * 1000.0})
+        hook = _HOOK_RE.match(command)
+        if hook:
+            running.append((depth, hook.group(1), ts))
+        if depth == 1 and command.startswith('exec '):
+            exec_time = ts
+        last = ts
+    for _, hook_path, start in running:
+        hooks.append({'path': hook_path, 'start': start, 'ms': (last - start) * 1000.0})
+    hooks.sort(key=lambda h: h['start'])
+    return {'shell_start': first, 'exec': exec_time, 'hooks': hooks}
+
+
+def read_launches(path=None, spec=None, limit=100):
+    """Reads the most recent launch records.
+
+    Parameters
+    ----------
+    path : str, optional
+        Log path (default: `log_path`)
+    spec : str, optional
+        Only return launches of this kernel spec name
+    limit : int, optional
+        Maximum number of records, newest last
+
+    Returns
+    -------
+    list
+        Launch records
+    """
+    path = path or log_path()
+    try:
+        with open(path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - TAIL_BYTES))
+            data = f.read()
+    except (IOError, OSError):
+        return []
+    lines = data.decode('utf8', 'replace').splitlines()
+    if size > TAIL_BYTES:
+        # The first line is probably cut off
+        lines = lines[1:]
+    records = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue
+        if spec is None or record.get('spec') == spec:
+            records.append(record)
+    return records[-limit:]
@@ -0,0 +1,328 @@
+"""Concurrent kernel start load test, behind ``kernda loadtest``.
+
+`run` starts a number of kernels of one spec with jupyter_client and
+measures how their start latency grows with the number of starts in
+flight. Kernels arrive all at once, at a fixed rate, as a Poisson process
+or at the offsets of launches recorded in the history (see
+`replay_offsets`). Each launch mode to compare gets its own copy of the
+spec, built with `kernda.api.build_spec` into a scratch kernel directory.
+The copies write their launch records to a scratch launch log, which is
+where the activation latency of each kernel comes from. Modes run one
+after the other, and all kernels of a mode are shut down before the next
+mode starts.
+
+Going through the launcher adds its startup to source and direct mode
+launches, see ``kernda doctor``.
+
+Needs jupyter_client, which kernda does not depend on otherwise.
+"""
+import json
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+from os.path import join as pjoin
+
+from . import history
+from .api import build_spec
+from .launchlog import read_launches
+from .util import percentile
+
+
+def arrival_offsets(count, rate=None, poisson=False, seed=None):
+    """Computes when each kernel of a load test starts.
+
+    Parameters
+    ----------
+    count : int
+        Number of kernels
+    rate : float, optional
+        Kernel starts per second (default: all at once)
+    poisson : bool, optional
+        Draw exponential gaps with mean 1/rate instead of fixed ones
+    seed : int, optional
+        Random seed for Poisson arrivals
+
+    Returns
+    -------
+    list
+        Seconds from the start of the test, ascending
+    """
+    if not rate:
+        return [0.0] * count
+    rng = random.Random(seed)
+    offsets, offset = [], 0.0
+    for _ in range(count):
+        offsets.append(offset)
+        offset += rng.expovariate(rate) if poisson else 1.0 / rate
+    return offsets
+
+
+def replay_offsets(spec=None, since=None, until=None, limit=None, speedup=1.0, path=None):
+    """Gets arrival offsets from launches recorded in the history.
+
+    Parameters
+    ----------
+    spec : str, optional
+        Only replay launches of this kernel spec name
+    since, until : float, optional
+        Time window of the launches to replay
+    limit : int, optional
+        Replay at most this many launches, the first in the window
+    speedup : float, optional
+        Divide the recorded gaps by this factor
+    path : str, optional
+        History database path (default: `kernda.history.history_path`)
+
+    Returns
+    -------
+    list
+        Seconds from the first replayed launch, ascending
+    """
+    times = history.launch_times(spec, since, until, path)
+    if limit:
+        times = times[:limit]
+    return [(t - times[0]) / speedup for t in times]
+
+
+# Launcher options that write outside the launch log
+_OWN_OUTPUTS = ('prom_file', 'trace_dir', 'trace_kernel_info', 'profile', 'profile_dir')
+
+
+def build_mode_specs(spec, modes, directory, name='loadtest', **options):
+    """Writes a copy of a spec per launch mode into a kernel directory.
+
+    Launches of the copies are only recorded in directory: in the launch
+    log ``launches.jsonl`` and the history ``history.sqlite``. Metrics,
+    trace and profile outputs of the spec are dropped. Source mode copies
+    time the activation, see ``--timing``.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec to test, with or without kernda activation
+    modes : list
+        Launch modes to compare
+    directory : str
+        Kernel directory to write the ``<name>-<mode>`` specs to
+    name : str, optional
+        Prefix of the spec names
+    options
+        Further `kernda.api.build_spec` arguments
+
+    Returns
+    -------
+    dict
+        Spec names by mode
+    """
+    base = dict(spec.get('_kernda_options', {}), **options)
+    base.pop('name', None)
+    launcher = dict(base.pop('launcher_options', None) or {},
+                    launch_log=pjoin(directory, 'launches.jsonl'))
+    for key in _OWN_OUTPUTS:
+        launcher.pop(key, None)
+    # Keep synthetic launches out of the history, regression baselines,
+    # metrics and traces of real ones
+    env = dict(spec.get('env', {}), KERNDA_HISTORY=pjoin(directory, 'history.sqlite'),
+               KERNDA_PROM_FILE='', KERNDA_TRACE_DIR='')
+    names = {}
+    for mode in modes:
+        spec_name = '{}-{}'.format(name, mode)
+        # Without timing, source mode records the launcher's own time as
+        # activation rather than that of the bash activation
+        mode_launcher = dict(launcher, timing=True) if mode == 'source' else launcher
+        built, _ = build_spec(spec, env_dir=spec.get('_kernda_env_dir'),
+                              backend=spec.get('_kernda_backend'), mode=mode,
+                              launcher_options=mode_launcher, name=spec_name, **base)
+        built['env'] = env
+        os.makedirs(pjoin(directory, spec_name))
+        with open(pjoin(directory, spec_name, 'kernel.json'), 'w') as f:
+            json.dump(built, f, indent=2)
+        names[mode] = spec_name
+    return names
+
+
+def _kernel_pid(km):
+    provisioner = getattr(km, 'provisioner', None)
+    if provisioner is not None and getattr(provisioner, 'pid', None):
+        return provisioner.pid
+    kernel = getattr(km, 'kernel', None)
+    return getattr(kernel, 'pid', None)
+
+
+class _Launch(threading.Thread):
+    """Starts one kernel at its offset and waits until it is ready."""
+
+    def __init__(self, test, index, offset):
+        super(_Launch, self).__init__()
+        self.daemon = True
+        self.test = test
+        self.result = {'index': index, 'offset': offset, 'in_flight': None,
+                       'ready_ms': None, 'pid': None, 'error': None}
+        self.km = None
+
+    def run(self):
+        from jupyter_client.manager import KernelManager
+        test = self.test
+        delay = test.start + self.result['offset'] - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        with test.lock:
+            test.in_flight += 1
+            self.result['in_flight'] = test.in_flight
+        client = None
+        try:
+            started = time.time()
+            self.km = KernelManager(kernel_name=test.spec_name,
+                                    kernel_spec_manager=test.spec_manager)
+            self.km.start_kernel()
+            self.result['pid'] = _kernel_pid(self.km)
+            client = self.km.client()
+            client.start_channels()
+            client.wait_for_ready(timeout=test.timeout)
+            self.result['ready_ms'] = (time.time() - started) * 1000.0
+        except Exception as e:
+            self.result['error'] = '{}: {}'.format(type(e).__name__, e)
+        finally:
+            if client is not None:
+                client.stop_channels()
+            with test.lock:
+                test.in_flight -= 1
+
+
+class _ModeTest(object):
+    def __init__(self, spec_name, spec_manager, timeout):
+        self.spec_name = spec_name
+        self.spec_manager = spec_manager
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.start = None
+
+
+def _shutdown(km):
+    try:
+        km.shutdown_kernel(now=False)
+    except Exception:
+        try:
+            km.shutdown_kernel(now=True)
+        except Exception:
+            pass
+
+
+def run_mode(spec_name, spec_manager, offsets, timeout=120.0):
+    """Starts kernels of one spec at the given offsets.
+
+    All kernels stay up until the last one is ready or failed, then they
+    are shut down in parallel.
+
+    Returns
+    -------
+    list
+        One dict per kernel with ``index``, ``offset``, ``in_flight`` (starts
+        in flight, including this one, when it began), ``ready_ms`` (until
+        the first kernel_info reply), ``pid`` and ``error``
+    """
+    test = _ModeTest(spec_name, spec_manager, timeout)
+    launches = [_Launch(test, i, offset) for i, offset in enumerate(offsets)]
+    test.start = time.time()
+    for launch in launches:
+        launch.start()
+    for launch in launches:
+        launch.join()
+    stoppers = [threading.Thread(target=_shutdown, args=(launch.km,))
+                for launch in launches if launch.km is not None]
+    for stopper in stoppers:
+        stopper.start()
+    for stopper in stoppers:
+        stopper.join()
+    return [launch.result for launch in launches]
+
+
+def add_activation(results, records):
+    """Adds ``activation_ms`` and ``launch_ms`` from launch records by pid."""
+    by_pid = dict((r.get('pid'), r) for r in records)
+    for result in results:
+        record = by_pid.get(result['pid'])
+        result['activation_ms'] = record.get('activation_ms') if record else None
+        result['launch_ms'] = None
+        if record and record.get('exec') is not None:
+            result['launch_ms'] = (record['exec'] - record['time']) * 1000.0
+    return results
+
+
+def _percentiles(values):
+    values = sorted(v for v in values if v is not None)
+    return {'p50_ms': percentile(values, 50), 'p95_ms': percentile(values, 95),
+            'max_ms': values[-1] if values else None}
+
+
+def summarize(results):
+    """Summarizes the kernels of one mode, overall and by concurrency.
+
+    Returns
+    -------
+    dict
+        ``count``, ``failed``, ``ready`` and ``activation`` percentiles and
+        ``by_concurrency``, a list of the same per ``in_flight`` value
+    """
+    def summary(group):
+        return {
+            'count': len(group),
+            'failed': sum(1 for r in group if r['error']),
+            'ready': _percentiles(r['ready_ms'] for r in group),
+            'activation': _percentiles(r.get('activation_ms') for r in group),
+        }
+    totals = summary(results)
+    groups = {}
+    for result in results:
+        groups.setdefault(result['in_flight'], []).append(result)
+    totals['by_concurrency'] = [dict(summary(group), in_flight=in_flight)
+                                for in_flight, group in sorted(groups.items())]
+    return totals
+
+
+def run(spec, modes, offsets, timeout=120.0, **options):
+    """Load tests a kernel spec in each launch mode.
+
+    Parameters
+    ----------
+    spec : dict
+        Kernel spec to test
+    modes : list
+        Launch modes to compare
+    offsets : list
+        Start offsets of the kernels in seconds, see `arrival_offsets`
+        and `replay_offsets`
+    timeout : float, optional
+        Seconds to wait for each kernel to become ready
+    options
+        Further `kernda.api.build_spec` arguments
+
+    Returns
+    -------
+    dict
+        Per mode, the `summarize` summary with the raw ``results``
+
+    Raises
+    ------
+    KerndaError
+        If a mode cannot be built for the spec
+    """
+    from jupyter_client.kernelspec import KernelSpecManager
+    directory = tempfile.mkdtemp(prefix='kernda-loadtest-')
+    try:
+        names = build_mode_specs(spec, modes, directory, **options)
+        spec_manager = KernelSpecManager(kernel_dirs=[directory])
+        report = {}
+        for mode in modes:
+            results = run_mode(names[mode], spec_manager, offsets, timeout)
+            records = read_launches(pjoin(directory, 'launches.jsonl'), names[mode],
+                                    limit=len(offsets) * 2)
+            add_activation(results, records)
+            report[mode] = dict(summarize(results), results=results)
+        return report
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
@@ -0,0 +1,130 @@
+"""Prometheus metrics of kernel launches for node_exporter's textfile collector.
+
+When the launcher is given ``--prom-file`` or $KERNDA_PROM_FILE is set,
+every launch updates counters kept in ``<prom file>.state`` next to the
+``.prom`` file. Updates hold an exclusive lock on the state. The ``.prom``
+file is rewritten atomically, so the collector never reads a partial file.
+Like the launch history, the update runs detached from the kernel start.
+"""
+import contextlib
+import fcntl
+import json
+import os
+
+from .cache import atomic_write
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HISTOGRAMS = (
+    ('kernda_activation_seconds', 'activation_ms',
+     'Time from launcher start to the end of environment activation'),
+    ('kernda_launch_seconds', 'launch_ms',
+     'Time from launcher start to the exec of the kernel'),
+)
+CACHE_COUNTER = ('kernda_snapshot_cache_total',
+                 'Snapshot mode launches by activation snapshot cache result')
+
+
+def prom_path(path=None):
+    """Gets the .prom file path from path or $KERNDA_PROM_FILE, if any."""
+    return path or os.getenv('KERNDA_PROM_FILE') or None
+
+
+@contextlib.contextmanager
+def _locked(state_path):
+    with open(state_path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _load(state_path):
+    try:
+        with open(state_path) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _observe(histogram, seconds):
+    if not histogram:
+        histogram.update({'buckets': [0] * len(BUCKETS), 'sum': 0.0, 'count': 0})
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+    histogram['sum'] += seconds
+    histogram['count'] += 1
+
+
+def update(state, record):
+    """Adds a launch record of the launcher to the metrics state."""
+    labels = json.dumps([['spec', record.get('spec') or ''],
+                         ['mode', record.get('mode') or '']])
+    if record.get('exec') is not None:
+        record = dict(record, launch_ms=(record['exec'] - record['time']) * 1000.0)
+    for name, key, _ in HISTOGRAMS:
+        if record.get(key) is not None:
+            series = state.setdefault(name, {})
+            _observe(series.setdefault(labels, {}), record[key] / 1000.0)
+    if record.get('cache_hit') is not None:
+        labels = json.dumps(json.loads(labels) +
+                            [['result', 'hit' if record['cache_hit'] else 'miss']])
+        series = state.setdefault(CACHE_COUNTER[0], {})
+        series[labels] = series.get(labels, 0) + 1
+    return state
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    return '{' + ','.join('{}="{}"'.format(k, _escape(v)) for k, v in pairs) + '}'
+
+
+def render(state):
+    """Renders the metrics state in the Prometheus text format."""
+    lines = []
+    for name, _, help_text in HISTOGRAMS:
+        lines.extend(['# HELP {} {}'.format(name, help_text),
+                      '# TYPE {} histogram'.format(name)])
+        for labels, histogram in sorted(state.get(name, {}).items()):
+            labels = json.loads(labels)
+            for bound, count in zip(BUCKETS, histogram['buckets']):
+                lines.append('{}_bucket{} {}'.format(
+                    name, _format_labels(labels, [['le', repr(bound)]]), count))
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(labels, [['le', '+Inf']]), histogram['count']))
+            lines.append('{}_sum{} {!r}'.format(name, _format_labels(labels),
+                                                histogram['sum']))
+            lines.append('{}_count{} {}'.format(name, _format_labels(labels),
+                                                histogram['count']))
+    name, help_text = CACHE_COUNTER
+    lines.extend(['# HELP {} {}'.format(name, help_text),
+                  '# TYPE {} counter'.format(name)])
+    for labels, count in sorted(state.get(name, {}).items()):
+        lines.append('{}{} {}'.format(name, _format_labels(json.loads(labels)), count))
+    return '\n'.join(lines) + '\n'
+
+
+def record(entry, path):
+    """Counts a launch and rewrites the .prom file.
+
+    Parameters
+    ----------
+    entry : dict
+        Launch record as written to the launch log
+    path : str
+        Path of the .prom file
+    """
+    state_path = path + '.state'
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    with _locked(state_path):
+        state = update(_load(state_path), entry)
+        atomic_write(state_path, json.dumps(state, sort_keys=True), mode=0o644)
+        atomic_write(path, render(state), mode=0o644)
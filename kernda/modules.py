@@ -0,0 +1,69 @@
+"""Environment Modules / Lmod support.
+
+Modules listed for a kernel are loaded before the environment is
+activated. Loading them is slow (Lmod consults its spider cache on every
+call), so in snapshot mode the combined result of ``module load`` and the
+activation is captured once and cached under a key that includes the
+module list and a fingerprint of the directories on $MODULEPATH.
+"""
+import os
+from os.path import join as pjoin
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+from .backends import fingerprint_paths
+
+# Defines the module function in shells that did not inherit it, using the
+# init script that both Lmod and Environment Modules ship
+MODULE_INIT = '{ type module >/dev/null 2>&1 || . "$MODULESHOME/init/bash"; }'
+
+
+def parse_modules(values):
+    """Flattens repeated and comma-separated module arguments.
+
+    Parameters
+    ----------
+    values : list or None
+        Values of --module options, e.g. ['gcc/9,cuda', 'openmpi']
+
+    Returns
+    -------
+    list
+        Module names in load order, e.g. ['gcc/9', 'cuda', 'openmpi']
+    """
+    modules = []
+    for value in values or ():
+        modules.extend(m.strip() for m in value.split(',') if m.strip())
+    return modules
+
+
+def load_command(modules):
+    """Builds the bash snippet that loads modules.
+
+    Returns
+    -------
+    str
+        Snippet or an empty string when there are no modules
+    """
+    if not modules:
+        return ''
+    return '{} && module load {}'.format(
+        MODULE_INIT, ' '.join(quote(m) for m in modules))
+
+
+def modulepath_fingerprint(modules, environ=None):
+    """Hashes the module directories that can provide the given modules.
+
+    Adding, removing or updating a module version changes the mtime of
+    its ``$MODULEPATH/<name>`` directory, which changes the fingerprint.
+    """
+    environ = os.environ if environ is None else environ
+    paths = []
+    for root in environ.get('MODULEPATH', '').split(os.pathsep):
+        if not root:
+            continue
+        paths.append(root)
+        paths.extend(pjoin(root, m.split('/')[0]) for m in modules)
+    return fingerprint_paths(paths)
@@ -0,0 +1,194 @@
+"""NUMA-aware CPU placement of kernels, behind the ``--placement`` option.
+
+The launcher picks a NUMA node for each kernel, pins itself to the
+node's CPUs and then execs the kernel, which inherits the affinity. When
+``numactl`` is on PATH, the kernel also runs under
+``numactl --preferred=<node>``, so its memory is allocated on the same
+node when possible.
+
+Nodes come from ``/sys/devices/system/node``, limited to the CPUs the
+launcher may run on. A machine without NUMA information counts as one
+node. Placements are kept in an allocation file by kernel pid, and
+entries of kernels that exited are dropped. Updates hold an exclusive
+lock, so concurrent launches see each other's choices. Two policies
+exist:
+
+* ``round-robin`` cycles through the nodes
+* ``least-loaded`` picks the node with the fewest live kernels
+"""
+import contextlib
+import errno
+import fcntl
+import json
+import os
+import socket
+from os.path import join as pjoin
+
+from .cache import atomic_write, state_dir
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
+POLICIES = ('round-robin', 'least-loaded')
+NODE_ROOT = '/sys/devices/system/node'
+
+
+def parse_cpulist(text):
+    """Parses a kernel CPU list like ``0-3,8,10-11`` into a list of CPUs."""
+    cpus = []
+    for part in text.strip().split(','):
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def _allowed_cpus():
+    if hasattr(os, 'sched_getaffinity'):
+        return set(os.sched_getaffinity(0))
+    import multiprocessing
+    return set(range(multiprocessing.cpu_count()))
+
+
+def numa_nodes(root=NODE_ROOT, allowed=None):
+    """Lists NUMA nodes with CPUs this process may use.
+
+    Returns
+    -------
+    dict
+        Sorted CPU lists by node number; one node 0 with all allowed CPUs
+        when there is no NUMA information
+    """
+    allowed = _allowed_cpus() if allowed is None else set(allowed)
+    nodes = {}
+    try:
+        names = os.listdir(root)
+    except OSError:
+        names = []
+    for name in names:
+        if not (name.startswith('node') and name[4:].isdigit()):
+            continue
+        try:
+            with open(pjoin(root, name, 'cpulist')) as f:
+                cpus = [cpu for cpu in parse_cpulist(f.read()) if cpu in allowed]
+        except (IOError, OSError, ValueError):
+            continue
+        if cpus:
+            nodes[int(name[4:])] = cpus
+    return nodes or {0: sorted(allowed)}
+
+
+def placement_path(path=None):
+    """Gets the allocation file from path, $KERNDA_PLACEMENT_FILE or the state dir.
+
+    The default is per host, so a state dir on a shared home directory
+    works.
+    """
+    return path or os.getenv('KERNDA_PLACEMENT_FILE') or pjoin(
+        state_dir(), 'placement-{}.json'.format(socket.gethostname()))
+
+
+@contextlib.contextmanager
+def _locked(path):
+    """Serializes allocation file updates across processes."""
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+    with open(path + '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def choose_node(nodes, allocations, policy, last=None):
+    """Picks a node for a new kernel.
+
+    Parameters
+    ----------
+    nodes : list
+        Node numbers to choose from
+    allocations : dict
+        Node numbers of live kernels by pid
+    policy : str
+        One of `POLICIES`
+    last : int, optional
+        Node picked last, for round-robin
+    """
+    nodes = sorted(nodes)
+    if policy == 'round-robin':
+        later = [node for node in nodes if last is None or node > last]
+        return later[0] if later else nodes[0]
+    load = dict((node, 0) for node in nodes)
+    for node in allocations.values():
+        if node in load:
+            load[node] += 1
+    return min(nodes, key=lambda node: (load[node], node))
+
+
+def allocate(policy, pid=None, path=None, nodes=None):
+    """Picks and records the node of a kernel.
+
+    Parameters
+    ----------
+    policy : str
+        One of `POLICIES`
+    pid : int, optional
+        Kernel pid (default: this process, which execs the kernel)
+    path : str, optional
+        Allocation file (default: `placement_path`)
+    nodes : dict, optional
+        CPU lists by node (default: `numa_nodes`)
+
+    Returns
+    -------
+    tuple
+        (node, cpus)
+    """
+    pid = os.getpid() if pid is None else pid
+    nodes = numa_nodes() if nodes is None else nodes
+    path = placement_path(path)
+    with _locked(path):
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (IOError, OSError, ValueError):
+            state = {}
+        allocations = dict((int(p), node) for p, node in state.get('kernels', {}).items()
+                           if int(p) != pid and _alive(int(p)))
+        node = choose_node(nodes, allocations, policy, state.get('last'))
+        allocations[pid] = node
+        state = {'last': node, 'kernels': dict((str(p), n) for p, n in allocations.items())}
+        atomic_write(path, json.dumps(state, sort_keys=True))
+    return node, nodes[node]
+
+
+def place(policy, argv, path=None):
+    """Pins this process to the CPUs of a node before it execs a kernel.
+
+    Returns
+    -------
+    tuple
+        (argv, node) where argv runs the kernel under ``numactl
+        --preferred`` when numactl is available
+    """
+    node, cpus = allocate(policy, path=path)
+    os.sched_setaffinity(0, cpus)
+    numactl = which('numactl')
+    if numactl:
+        argv = [numactl, '--preferred={}'.format(node), '--'] + list(argv)
+    return argv, node
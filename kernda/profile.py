@@ -0,0 +1,294 @@
+"""Profiles of kernel startup, behind ``--profile`` and ``kernda profile``.
+
+With ``--profile importtime`` or ``--profile cprofile`` the launcher puts a
+``sitecustomize`` module (`SITECUSTOMIZE`) on the kernel's PYTHONPATH. It
+works on the kernel until it is ready, i.e. until ipykernel's
+``IPKernelApp.start`` enters the event loop, or until exit for other
+kernels:
+
+* ``importtime`` sets $PYTHONPROFILEIMPORTTIME, which makes the
+  interpreter report each import on stderr (Python 3.7+). The launcher
+  points stderr at the profile file and the kernel gets its own stderr
+  back when ready.
+* ``cprofile`` runs the kernel under `cProfile` and dumps the stats.
+
+Either way the module takes itself and its variables out of the
+environment first, so processes the kernel starts are not profiled, and
+then imports any ``sitecustomize`` of the environment itself. Profiles are
+written to one file per launch in `profile_dir`. Source mode is not
+supported: every Python the activation script runs would be profiled too.
+"""
+import glob
+import os
+import re
+import time
+from os.path import basename, join as pjoin
+
+from .cache import atomic_write, cache_dir, state_dir
+
+PROFILE_MODES = ('importtime', 'cprofile')
+EXTENSIONS = {'importtime': '.importtime', 'cprofile': '.prof'}
+
+_IMPORT_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S.*)$')
+_NAME_RE = re.compile(r'^(.*)-\d{8}-\d{6}-\d+$')
+
+SITECUSTOMIZE = '''\
+# Written by kernda to profile kernel startup, see kernda.profile
+import os
+import sys
+
+
+def _kernda_profile():
+    here = os.path.dirname(os.path.abspath(__file__))
+    mode = os.environ.pop('KERNDA_PROFILE', None)
+    out = os.environ.pop('KERNDA_PROFILE_OUT', None)
+    saved = os.environ.pop('KERNDA_PROFILE_STDERR', None)
+    os.environ.pop('PYTHONPROFILEIMPORTTIME', None)
+    paths = [p for p in os.environ.get('PYTHONPATH', '').split(os.pathsep)
+             if p and os.path.abspath(p) != here]
+    if paths:
+        os.environ['PYTHONPATH'] = os.pathsep.join(paths)
+    else:
+        os.environ.pop('PYTHONPATH', None)
+    if not mode or not out:
+        return here
+    profiler = None
+    if mode == 'cprofile':
+        import cProfile
+        profiler = cProfile.Profile()
+    done = []
+
+    def finish():
+        if done:
+            return
+        done.append(True)
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(out)
+        if saved is not None:
+            sys.stderr.flush()
+            os.dup2(int(saved), 2)
+            os.close(int(saved))
+            # Pass on what else was written to stderr, e.g. warnings
+            with open(out) as f:
+                lines = [line for line in f if not line.startswith('import time:')]
+            if lines:
+                sys.stderr.write(''.join(lines))
+                sys.stderr.flush()
+
+    class Finder(object):
+        """Ends the profile when ipykernel starts its event loop."""
+
+        def find_spec(self, name, path=None, target=None):
+            if name != 'ipykernel.kernelapp':
+                return None
+            sys.meta_path.remove(self)
+            import importlib.util
+            spec = importlib.util.find_spec(name)
+            if spec is None or spec.loader is None:
+                return spec
+            exec_module = spec.loader.exec_module
+
+            def exec_and_patch(module):
+                exec_module(module)
+                start = module.IPKernelApp.start
+
+                def patched(self):
+                    finish()
+                    return start(self)
+                module.IPKernelApp.start = patched
+            spec.loader.exec_module = exec_and_patch
+            return spec
+
+    import atexit
+    atexit.register(finish)
+    if sys.version_info[0] >= 3:
+        sys.meta_path.insert(0, Finder())
+    if profiler is not None:
+        profiler.enable()
+    return here
+
+
+_kernda_here = _kernda_profile()
+_kernda_self = sys.modules.pop('sitecustomize')
+sys.path[:] = [p for p in sys.path if os.path.abspath(p) != _kernda_here]
+try:
+    import sitecustomize  # noqa: F401
+except ImportError:
+    pass
+finally:
+    # The import machinery expects a module under this name once we return
+    sys.modules.setdefault('sitecustomize', _kernda_self)
+'''
+
+
+def profile_dir(path=None):
+    """Gets the profile directory from path, $KERNDA_PROFILE_DIR or the state dir."""
+    return path or os.getenv('KERNDA_PROFILE_DIR') or pjoin(state_dir(), 'profiles')
+
+
+def site_dir():
+    """Writes `SITECUSTOMIZE` to the cache if needed and returns its directory."""
+    path = pjoin(cache_dir(), 'profile-site')
+    filename = pjoin(path, 'sitecustomize.py')
+    try:
+        with open(filename) as f:
+            current = f.read() == SITECUSTOMIZE
+    except (IOError, OSError):
+        current = False
+    if not current:
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:
+                pass
+        atomic_write(filename, SITECUSTOMIZE, mode=0o644)
+    return path
+
+
+def profile_path(mode, directory=None, spec_name=None, start=None, pid=None):
+    """Gets the per-launch profile file ``<spec>-<date>-<time>-<pid>.<ext>``."""
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(start or time.time()))
+    name = '{}-{}-{}{}'.format(spec_name or 'kernel', stamp, pid or os.getpid(),
+                               EXTENSIONS[mode])
+    return pjoin(profile_dir(directory), name)
+
+
+def prepare(env, mode, path):
+    """Sets up a kernel environment to profile its startup into path.
+
+    For ``importtime``, also points stderr of this process at path, so
+    call it right before exec'ing the kernel.
+
+    Returns
+    -------
+    dict
+        The kernel environment
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    site = site_dir()
+    env = dict(env)
+    env['PYTHONPATH'] = os.pathsep.join([site] + [p for p in env.get(
+        'PYTHONPATH', '').split(os.pathsep) if p])
+    env['KERNDA_PROFILE'] = mode
+    env['KERNDA_PROFILE_OUT'] = path
+    if mode == 'importtime':
+        env['PYTHONPROFILEIMPORTTIME'] = '1'
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        saved = os.dup(2)
+        if hasattr(os, 'set_inheritable'):
+            os.set_inheritable(saved, True)
+        os.dup2(fd, 2)
+        os.close(fd)
+        env['KERNDA_PROFILE_STDERR'] = str(saved)
+    return env
+
+
+def profile_files(mode, directory=None, spec_name=None):
+    """Lists recorded profiles, oldest first.
+
+    Parameters
+    ----------
+    mode : str
+        Profile mode, one of `PROFILE_MODES`
+    directory : str, optional
+        Profile directory (default: `profile_dir`)
+    spec_name : str, optional
+        Only list profiles of launches of this kernel spec name
+    """
+    paths = []
+    for path in glob.glob(pjoin(profile_dir(directory), '*' + EXTENSIONS[mode])):
+        match = _NAME_RE.match(basename(path)[:-len(EXTENSIONS[mode])])
+        if match and (spec_name is None or match.group(1) == spec_name):
+            paths.append(path)
+    return sorted(paths, key=os.path.getmtime)
+
+
+def parse_importtime(lines):
+    """Parses the lines of a ``-X importtime`` report, skipping other output.
+
+    Returns
+    -------
+    list
+        (module, self_us, cumulative_us, depth) tuples in report order,
+        where top-level imports have depth 0
+    """
+    imports = []
+    for line in lines:
+        match = _IMPORT_RE.match(line.rstrip('\n'))
+        if match:
+            imports.append((match.group(4), int(match.group(1)), int(match.group(2)),
+                            len(match.group(3)) // 2))
+    return imports
+
+
+def read_importtime(path):
+    """Parses a ``-X importtime`` report file, see `parse_importtime`."""
+    with open(path) as f:
+        return parse_importtime(f)
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def summarize_imports(paths, top=20, sort='self'):
+    """Ranks the heaviest imports over several importtime profiles.
+
+    Parameters
+    ----------
+    paths : list
+        importtime profile files
+    top : int, optional
+        Number of modules to return
+    sort : str, optional
+        ``self`` or ``cumulative`` median time to rank by
+
+    Returns
+    -------
+    list
+        Dicts with ``module``, ``launches`` (profiles importing it) and
+        the median ``self_ms`` and ``cumulative_ms`` over those launches
+    """
+    samples = {}
+    for path in paths:
+        for module, self_us, cumulative_us, _ in read_importtime(path):
+            samples.setdefault(module, []).append((self_us, cumulative_us))
+    ranked = [{
+        'module': module,
+        'launches': len(values),
+        'self_ms': _median([v[0] for v in values]) / 1000.0,
+        'cumulative_ms': _median([v[1] for v in values]) / 1000.0,
+    } for module, values in samples.items()]
+    ranked.sort(key=lambda r: (-r[sort + '_ms'], r['module']))
+    return ranked[:top]
+
+
+def summarize_cprofile(paths, top=20):
+    """Ranks functions by cumulative time over several cProfile profiles.
+
+    Returns
+    -------
+    list
+        Dicts with ``function``, ``calls``, ``self_ms`` and
+        ``cumulative_ms``, averaged per launch
+    """
+    import pstats
+    if not paths:
+        return []
+    stats = pstats.Stats(*paths)
+    count = float(len(paths))
+    ranked = []
+    for (filename, line, name), (_, calls, tottime, cumtime, _) in stats.stats.items():
+        ranked.append({
+            'function': '{}:{}({})'.format(filename, line, name),
+            'calls': calls / count,
+            'self_ms': tottime * 1000.0 / count,
+            'cumulative_ms': cumtime * 1000.0 / count,
+        })
+    ranked.sort(key=lambda r: -r['cumulative_ms'])
+    return ranked[:top]
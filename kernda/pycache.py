@@ -0,0 +1,330 @@
+"""Bytecode caches of kernels on local storage, behind ``--pycache``.
+
+Read-only environments cannot write ``__pycache__``, so every kernel
+start compiles the modules it imports from source again, and environments
+on network file systems read their bytecode over the network. With
+``--pycache`` the launcher sets $PYTHONPYCACHEPREFIX (Python 3.8+) of the
+kernel to a directory per environment and interpreter below a root on
+local storage, see `pycache_root`. The interpreter then reads and writes
+all bytecode there, and ignores ``__pycache__`` of the environment.
+
+The first start under a new prefix compiles everything it imports.
+`warm` fills the prefix ahead of time, see ``kernda warm``. `evict`
+removes bytecode not used for a number of days and the least recently
+used bytecode over a size budget. Launches run it at most once an hour,
+in a process detached from the kernel start.
+"""
+import glob
+import json
+import os
+import subprocess
+import tempfile
+import time
+from os.path import basename, join as pjoin, realpath
+
+from .cache import cache_key
+from .profile import parse_importtime, profile_files, summarize_imports
+
+MAX_AGE_DAYS = 30.0
+MAX_SIZE = 1024 ** 3
+EVICT_INTERVAL = 3600
+# What ipykernel imports until the kernel is ready
+KERNEL_MODULES = ('ipykernel.kernelapp',)
+
+# Compiles the files of packages into sys.pycache_prefix, skipping files
+# with current bytecode
+WARM = '''
+import compileall, importlib.util, json, os, sys
+if getattr(sys, 'pycache_prefix', None) is None:
+    sys.exit('PYTHONPYCACHEPREFIX needs Python 3.8 or later')
+
+
+def stale(path):
+    try:
+        return os.stat(importlib.util.cache_from_source(path)).st_mtime < \\
+            os.stat(path).st_mtime
+    except OSError:
+        return True
+
+
+results = []
+for name in sys.argv[1:]:
+    item = {'module': name, 'files': 0, 'compiled': 0, 'error': None}
+    results.append(item)
+    try:
+        spec = importlib.util.find_spec(name)
+    except Exception as e:
+        item['error'] = str(e)
+        continue
+    if spec is None or not (spec.origin or '').endswith('.py'):
+        item['error'] = 'no Python source'
+        continue
+    if spec.submodule_search_locations:
+        paths = [os.path.join(root, f)
+                 for location in spec.submodule_search_locations
+                 for root, _, files in os.walk(location) for f in files
+                 if f.endswith('.py')]
+    else:
+        paths = [spec.origin]
+    for path in paths:
+        item['files'] += 1
+        if stale(path) and compileall.compile_file(path, quiet=2):
+            item['compiled'] += 1
+print(json.dumps({'prefix': sys.pycache_prefix, 'packages': results}))
+'''
+
+
+def pycache_root(path=None):
+    """Gets the root of bytecode caches.
+
+    From path, $KERNDA_PYCACHE_DIR or ``kernda-pycache-<uid>`` in the
+    system's temporary directory, which is usually local. The cache dir
+    is not used because home directories are often on NFS.
+    """
+    if path or os.getenv('KERNDA_PYCACHE_DIR'):
+        return path or os.getenv('KERNDA_PYCACHE_DIR')
+    return pjoin(tempfile.gettempdir(), 'kernda-pycache-{}'.format(os.getuid()))
+
+
+def interpreter_name(env_dir):
+    """Names the interpreter of an environment after its ``lib/pythonX.Y``.
+
+    Returns
+    -------
+    str
+        e.g. ``python3.11``, or ``python`` when the version is unclear
+    """
+    names = set(basename(p) for p in glob.glob(pjoin(env_dir, 'lib', 'python[0-9]*'))
+                if os.path.isdir(p))
+    return names.pop() if len(names) == 1 else 'python'
+
+
+def prefix_dir(env_dir, root=None):
+    """Gets the bytecode cache of an environment and its interpreter.
+
+    ``<root>/<env name>-<hash of its path>/<interpreter>``
+    """
+    env_dir = realpath(env_dir)
+    return pjoin(pycache_root(root), '{}-{}'.format(basename(env_dir),
+                                                    cache_key(env_dir)[:10]),
+                 interpreter_name(env_dir))
+
+
+def _make_root(root):
+    """Creates root private to the user, refusing one owned by someone else."""
+    if not os.path.isdir(root):
+        try:
+            os.makedirs(root, 0o700)
+        except OSError:
+            if not os.path.isdir(root):
+                raise
+    if os.stat(root).st_uid != os.getuid():
+        raise OSError('{} belongs to another user'.format(root))
+
+
+def evict(root=None, max_age=MAX_AGE_DAYS, max_size=MAX_SIZE, now=None):
+    """Removes unused and least recently used bytecode below root.
+
+    Parameters
+    ----------
+    root : str, optional
+        Root of the bytecode caches (default: `pycache_root`)
+    max_age : float, optional
+        Days since a file was last read or written after which it goes
+    max_size : int, optional
+        Bytes to keep at most; least recently used files go first
+
+    Returns
+    -------
+    dict
+        ``removed`` files, ``freed`` and remaining ``size`` in bytes
+    """
+    root = pycache_root(root)
+    now = time.time() if now is None else now
+    files = []
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            if not name.endswith('.pyc'):
+                continue
+            path = pjoin(dirpath, name)
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+    files.sort()
+    total = sum(f[1] for f in files)
+    removed = freed = 0
+    for used, nbytes, path in files:
+        if (max_age is None or now - used <= max_age * 86400) and (
+                max_size is None or total <= max_size):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= nbytes
+        removed += 1
+        freed += nbytes
+    for dirpath, _, _ in sorted(os.walk(root), reverse=True):
+        if dirpath != root:
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+    return {'removed': removed, 'freed': freed, 'size': total}
+
+
+def claim_eviction(root=None, interval=EVICT_INTERVAL):
+    """Tells whether to run `evict`, at most once per interval seconds.
+
+    A true answer claims the run, so concurrent launches skip it.
+    """
+    stamp = pjoin(pycache_root(root), '.evicted')
+    try:
+        if time.time() - os.path.getmtime(stamp) < interval:
+            return False
+    except OSError:
+        pass
+    with open(stamp, 'a'):
+        os.utime(stamp, None)
+    return True
+
+
+def apply_pycache(env, env_dir, root=None):
+    """Points a kernel environment at the bytecode cache of env_dir.
+
+    An existing $PYTHONPYCACHEPREFIX wins.
+
+    Returns
+    -------
+    tuple
+        (env, prefix) where env is a copy and prefix is the directory
+        the kernel uses
+
+    Raises
+    ------
+    OSError
+        If the cache cannot be created
+    """
+    env = dict(env)
+    if env.get('PYTHONPYCACHEPREFIX'):
+        return env, env['PYTHONPYCACHEPREFIX']
+    root = pycache_root(root)
+    _make_root(root)
+    prefix = prefix_dir(env_dir, root)
+    if not os.path.isdir(prefix):
+        os.makedirs(prefix)
+    env['PYTHONPYCACHEPREFIX'] = prefix
+    return env, prefix
+
+
+def trace_imports(python, env, modules=KERNEL_MODULES):
+    """Lists the modules an interpreter imports for modules, slowest first.
+
+    Running the imports under the bytecode cache also compiles them.
+    """
+    from .api import KerndaError
+    source = '; '.join('import {}'.format(m) for m in modules)
+    proc = subprocess.Popen([python, '-X', 'importtime', '-c', source], env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, err = proc.communicate()
+    if proc.returncode != 0:
+        raise KerndaError('could not import {} with {}'.format(', '.join(modules), python),
+                          hint='Name the modules to compile with --module, or rank '
+                          'them by the profiles of a kernel spec with --spec')
+    imports = parse_importtime(err.decode('utf8', 'replace').splitlines())
+    return [m[0] for m in sorted(imports, key=lambda m: -m[1])]
+
+
+def imported_packages(modules, launches=None):
+    """Lists the top-level packages of modules.
+
+    In the order of their first module, or by the most launches of any of
+    their modules when launches by module are given.
+    """
+    packages = []
+    for module in modules:
+        name = module.split('.')[0]
+        if name not in packages:
+            packages.append(name)
+    if launches:
+        most = {}
+        for module in modules:
+            name = module.split('.')[0]
+            most[name] = max(most.get(name, 0), launches.get(module, 0))
+        packages.sort(key=lambda name: -most[name])
+    return packages
+
+
+def warm(env_dir, modules=None, spec_name=None, profile_dir=None, top=50, root=None):
+    """Compiles the most imported packages of an environment into its cache.
+
+    Packages come from modules if given, else from the importtime
+    profiles of spec_name (see ``--profile``), ranked by the launches that
+    imported them, else from what a kernel imports until it is ready.
+
+    Parameters
+    ----------
+    env_dir : str
+        Environment prefix
+    modules : list, optional
+        Modules whose packages to compile
+    spec_name : str, optional
+        Kernel spec name whose profiles to rank imports by
+    profile_dir : str, optional
+        Profile directory (default: `kernda.profile.profile_dir`)
+    top : int, optional
+        Number of packages to compile
+    root : str, optional
+        Root of the bytecode caches (default: `pycache_root`)
+
+    Returns
+    -------
+    dict
+        ``prefix``, ``source`` of the packages (``modules``, ``profiles``
+        or ``trace``), ``packages`` with ``module``, ``files``,
+        ``compiled`` and ``error`` each, and ``seconds``
+
+    Raises
+    ------
+    KerndaError
+        If the environment has no interpreter supporting PYTHONPYCACHEPREFIX,
+        or tracing the imports of a kernel fails
+    """
+    # Not at the top: kernda.api imports the launcher, which imports this module
+    from .api import KerndaError
+    start = time.time()
+    python = pjoin(env_dir, 'bin', 'python')
+    if not os.path.exists(python):
+        raise KerndaError('no interpreter found at {}'.format(python))
+    env = dict(os.environ)
+    env.pop('PYTHONPYCACHEPREFIX', None)
+    try:
+        env, prefix = apply_pycache(env, env_dir, root)
+    except (IOError, OSError) as e:
+        raise KerndaError('could not create the bytecode cache: {}'.format(e))
+    if modules:
+        source, packages = 'modules', imported_packages(modules)
+    else:
+        paths = profile_files('importtime', profile_dir, spec_name) if spec_name else []
+        if paths:
+            ranked = summarize_imports(paths, top=None)
+            source = 'profiles'
+            packages = imported_packages([r['module'] for r in ranked],
+                                         dict((r['module'], r['launches']) for r in ranked))
+        else:
+            source = 'trace'
+            packages = imported_packages(trace_imports(python, env))
+    try:
+        out = subprocess.check_output([python, '-c', WARM] + packages[:top], env=env)
+        result = json.loads(out.decode('utf8').strip().splitlines()[-1])
+    except (subprocess.CalledProcessError, OSError, ValueError) as e:
+        raise KerndaError('could not compile in {}: {}'.format(python, e),
+                          hint='PYTHONPYCACHEPREFIX needs Python 3.8 or later')
+    if source != 'modules':
+        # Built-in and frozen modules of the interpreter have no bytecode
+        result['packages'] = [p for p in result['packages']
+                              if p['error'] != 'no Python source']
+    return {'prefix': prefix, 'source': source, 'packages': result['packages'],
+            'seconds': time.time() - start}
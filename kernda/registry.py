@@ -0,0 +1,94 @@
+"""Registry of the kernel specs kernda manages.
+
+Every kernel spec written by kernda is recorded here with the environment
+it activates, so specs can be refreshed when their environment changes
+without scanning every kernel directory.
+"""
+import contextlib
+import fcntl
+import json
+import os
+from os.path import abspath, join as pjoin
+
+from .cache import atomic_write, state_dir
+
+
+def registry_path():
+    """Gets the path of the registry file."""
+    return pjoin(state_dir(), 'managed.json')
+
+
+@contextlib.contextmanager
+def _locked():
+    """Serializes registry updates across processes."""
+    path = registry_path() + '.lock'
+    if not os.path.isdir(os.path.dirname(path)):
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError:
+            pass
+    with open(path, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def load():
+    """Loads the registry.
+
+    Returns
+    -------
+    dict
+        Entries with ``env_dir`` and ``backend`` keyed by spec path
+    """
+    try:
+        with open(registry_path()) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def _save(entries):
+    atomic_write(registry_path(), json.dumps(entries, indent=2, sort_keys=True))
+
+
+def register(spec_path, spec):
+    """Records a kernda spec written to spec_path."""
+    spec_path = abspath(spec_path)
+    entry = {
+        'env_dir': abspath(spec['_kernda_env_dir']),
+        'backend': spec.get('_kernda_backend'),
+        'mode': spec.get('_kernda_mode'),
+    }
+    with _locked():
+        entries = load()
+        if entries.get(spec_path) != entry:
+            entries[spec_path] = entry
+            _save(entries)
+
+
+def unregister(spec_path):
+    """Forgets a spec, e.g. after it was deleted."""
+    spec_path = abspath(spec_path)
+    with _locked():
+        entries = load()
+        if entries.pop(spec_path, None) is not None:
+            _save(entries)
+
+
+def managed_specs(env_dir=None):
+    """Lists managed spec paths, optionally only those activating env_dir.
+
+    Specs that no longer exist are skipped.
+    """
+    target = abspath(env_dir) if env_dir else None
+    return sorted(path for path, entry in load().items()
+                  if (target is None or entry.get('env_dir') == target) and
+                  os.path.exists(path))
+
+
+def managed_envs():
+    """Lists the environments that have managed specs."""
+    return sorted(set(entry['env_dir'] for entry in load().values()))
@@ -0,0 +1,274 @@
+"""Detection of launch latency regressions after environment changes.
+
+Each launch is stored in the history with the fingerprint its environment
+had at the time, see `kernda.backends.Backend.fingerprint`. The first
+fingerprint seen for an environment becomes its baseline, together with
+the list of installed packages. Once `MIN_SAMPLES` launches have been
+made with a new fingerprint, their latencies are compared with the
+baseline launches using a one-sided Mann-Whitney U test. A slowdown that
+is both significant and large enough is recorded as a regression event
+naming the packages added, removed or changed since the baseline. The new
+fingerprint then becomes the baseline.
+"""
+import glob
+import json
+import math
+import os
+import time
+from os.path import basename, join as pjoin
+
+from . import history
+from .backends import detect_backend, get_backend
+
+# Launches needed with a new fingerprint before it is compared
+MIN_SAMPLES = 5
+# Baseline launches compared against, newest first
+MAX_BASELINE_SAMPLES = 50
+# Significance level of the test
+ALPHA = 0.01
+# Minimum slowdown of the median, relative and absolute
+MIN_RATIO = 1.5
+MIN_DELTA_MS = 50.0
+METRICS = ('activation_ms', 'launch_ms')
+
+
+def env_fingerprint(env_dir, backend_name=None):
+    """Fingerprints an environment with its backend."""
+    backend = None
+    if backend_name:
+        try:
+            backend = get_backend(backend_name)
+        except KeyError:
+            pass
+    return (backend or detect_backend(env_dir)).fingerprint(env_dir)
+
+
+def package_versions(env_dir):
+    """Lists the packages installed in an environment.
+
+    Reads the ``conda-meta/<name>-<version>-<build>.json`` records of conda
+    environments and falls back to ``*.dist-info`` directories.
+
+    Returns
+    -------
+    dict
+        ``<version>-<build>`` (conda) or version (dist-info) by name
+    """
+    packages = {}
+    records = glob.glob(pjoin(env_dir, 'conda-meta', '*.json'))
+    if records:
+        for path in records:
+            parts = basename(path)[:-len('.json')].rsplit('-', 2)
+            if len(parts) == 3:
+                packages[parts[0]] = '{}-{}'.format(parts[1], parts[2])
+        return packages
+    for path in glob.glob(pjoin(env_dir, 'lib', 'python*', 'site-packages', '*.dist-info')):
+        name, _, version = basename(path)[:-len('.dist-info')].partition('-')
+        packages[name.lower().replace('_', '-')] = version
+    return packages
+
+
+def package_diff(before, after):
+    """Compares two `package_versions` results.
+
+    Returns
+    -------
+    dict
+        ``added`` and ``removed`` map names to versions, ``changed`` maps
+        names to [old, new] versions
+    """
+    return {
+        'added': dict((n, v) for n, v in after.items() if n not in before),
+        'removed': dict((n, v) for n, v in before.items() if n not in after),
+        'changed': dict((n, [before[n], v]) for n, v in after.items()
+                        if n in before and before[n] != v),
+    }
+
+
+def _ranks(values):
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    ranks = [0.0] * len(values)
+    i = 0
+    while i < len(order):
+        j = i
+        while j + 1 < len(order) and values[order[j + 1]] == values[order[i]]:
+            j += 1
+        for k in range(i, j + 1):
+            # Ties share the average of their ranks
+            ranks[order[k]] = (i + j) / 2.0 + 1
+        i = j + 1
+    return ranks
+
+
+def mann_whitney_p(before, after):
+    """One-sided p-value that values in after tend to be larger than in before.
+
+    Uses the normal approximation of the Mann-Whitney U statistic with a
+    continuity correction, which is adequate from about five samples each.
+    """
+    n1, n2 = len(before), len(after)
+    if not n1 or not n2:
+        return 1.0
+    ranks = _ranks(list(before) + list(after))
+    u = sum(ranks[n1:]) - n2 * (n2 + 1) / 2.0
+    mean = n1 * n2 / 2.0
+    sigma = math.sqrt(n1 * n2 * (n1 + n2 + 1) / 12.0)
+    if sigma == 0:
+        return 1.0
+    z = (u - mean - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def _median(values):
+    values = sorted(values)
+    mid = len(values) // 2
+    return values[mid] if len(values) % 2 else (values[mid - 1] + values[mid]) / 2.0
+
+
+def _samples(conn, env_dir, fingerprint, metric, limit):
+    return [row[0] for row in conn.execute(
+        'SELECT {0} FROM launches WHERE env_dir = ? AND fingerprint = ? '
+        'AND {0} IS NOT NULL ORDER BY time DESC LIMIT ?'.format(metric),
+        (env_dir, fingerprint, limit))]
+
+
+def check(env_dir, fingerprint, path=None, now=None):
+    """Updates the baseline of an environment and detects regressions.
+
+    Called after each launch has been added to the history.
+
+    Parameters
+    ----------
+    env_dir : str
+        Environment prefix
+    fingerprint : str
+        Current fingerprint of the environment
+    path : str, optional
+        History database path (default: `kernda.history.history_path`)
+    now : float, optional
+        Timestamp of the check (default: now)
+
+    Returns
+    -------
+    list
+        Regression events recorded by this call
+    """
+    now = time.time() if now is None else now
+    conn = history.connect(path)
+    try:
+        # Serialize concurrent checks so an event is recorded once
+        conn.isolation_level = None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            events = _check(conn, env_dir, fingerprint, now)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+    finally:
+        conn.close()
+    return events
+
+
+def _set_baseline(conn, env_dir, fingerprint, packages, now):
+    conn.execute('INSERT OR REPLACE INTO baselines (env_dir, fingerprint, packages, created) '
+                 'VALUES (?, ?, ?, ?)',
+                 (env_dir, fingerprint, json.dumps(packages, sort_keys=True), now))
+
+
+def _check(conn, env_dir, fingerprint, now):
+    row = conn.execute('SELECT fingerprint, packages FROM baselines WHERE env_dir = ?',
+                       (env_dir,)).fetchone()
+    if row is None:
+        _set_baseline(conn, env_dir, fingerprint, package_versions(env_dir), now)
+        return []
+    baseline_fingerprint, baseline_packages = row[0], json.loads(row[1])
+    if baseline_fingerprint == fingerprint:
+        return []
+    current = dict((m, _samples(conn, env_dir, fingerprint, m, MAX_BASELINE_SAMPLES))
+                   for m in METRICS)
+    if len(current['activation_ms']) < MIN_SAMPLES:
+        return []
+
+    packages = package_versions(env_dir)
+    diff = package_diff(baseline_packages, packages)
+    events = []
+    for metric in METRICS:
+        before = _samples(conn, env_dir, baseline_fingerprint, metric, MAX_BASELINE_SAMPLES)
+        after = current[metric]
+        if len(before) < MIN_SAMPLES or len(after) < MIN_SAMPLES:
+            continue
+        baseline_ms, current_ms = _median(before), _median(after)
+        p_value = mann_whitney_p(before, after)
+        if (p_value < ALPHA and current_ms >= baseline_ms * MIN_RATIO and
+                current_ms - baseline_ms >= MIN_DELTA_MS):
+            event = {
+                'time': now,
+                'env_dir': env_dir,
+                'metric': metric,
+                'baseline_ms': baseline_ms,
+                'current_ms': current_ms,
+                'p_value': p_value,
+                'baseline_fingerprint': baseline_fingerprint,
+                'fingerprint': fingerprint,
+                'packages': diff,
+            }
+            conn.execute(
+                'INSERT INTO regressions (time, env_dir, metric, baseline_ms, current_ms, '
+                'p_value, baseline_fingerprint, fingerprint, packages) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                (now, env_dir, metric, baseline_ms, current_ms, p_value,
+                 baseline_fingerprint, fingerprint, json.dumps(diff, sort_keys=True)))
+            events.append(event)
+    # Later changes are compared against this state of the environment
+    _set_baseline(conn, env_dir, fingerprint, packages, now)
+    return events
+
+
+def observe(record):
+    """Fingerprints the environment of a launch record and checks it.
+
+    Sets ``fingerprint`` in record; call before adding the record to the
+    history and `check_record` afterwards.
+    """
+    if record.get('env_dir') and os.path.isdir(record['env_dir']):
+        record['fingerprint'] = env_fingerprint(record['env_dir'], record.get('backend'))
+    return record
+
+
+def check_record(record, path=None):
+    """Runs `check` for a launch record prepared with `observe`."""
+    if not record.get('fingerprint'):
+        return []
+    return check(record['env_dir'], record['fingerprint'], path)
+
+
+def regressions(env_dir=None, since=None, path=None):
+    """Lists recorded regression events, newest first.
+
+    Parameters
+    ----------
+    env_dir : str, optional
+        Only list events of this environment
+    since : float, optional
+        Only list events at or after this timestamp
+    path : str, optional
+        History database path (default: `kernda.history.history_path`)
+    """
+    query = ('SELECT time, env_dir, metric, baseline_ms, current_ms, p_value, '
+             'baseline_fingerprint, fingerprint, packages FROM regressions WHERE time >= ?')
+    params = [since or 0]
+    if env_dir:
+        query += ' AND env_dir = ?'
+        params.append(env_dir)
+    conn = history.connect(path)
+    try:
+        rows = conn.execute(query + ' ORDER BY time DESC', params).fetchall()
+    finally:
+        conn.close()
+    keys = ('time', 'env_dir', 'metric', 'baseline_ms', 'current_ms', 'p_value',
+            'baseline_fingerprint', 'fingerprint', 'packages')
+    events = [dict(zip(keys, row)) for row in rows]
+    for event in events:
+        event['packages'] = json.loads(event['packages'] or '{}')
+    return events
@@ -0,0 +1,491 @@
+"""Resource controls the launcher applies to a kernel before exec'ing it.
+
+Thread caps (``--thread-cap``) keep BLAS, OpenMP and numexpr pools from
+sizing themselves to every core of a shared node. With ``auto`` the cap
+is the CPUs available to the launcher (its affinity mask and cgroup CPU
+quota) divided by the number of kernels running on the node, counting
+the new one. Thread variables already set, by the user, the kernel spec
+or the activation, are left alone.
+
+Limits (``--limit-as``, ``--limit-nofile``) are set with `setrlimit`.
+Linux ignores ``RLIMIT_RSS``, so resident memory is limited through
+cgroup v2 instead. With ``--cgroup DIR`` the launcher moves itself into a
+new ``kernel-<pid>`` child of DIR, a cgroup v2 sub-tree delegated to the
+user, with the given ``memory.max`` and ``cpu.weight``. Children left
+empty by exited kernels are removed by later launches.
+
+Priority tiers (``--priority``) map to a nice value, an I/O priority set
+with ``ioprio_set`` and a scheduling policy, see `PRIORITY_TIERS`.
+Unprivileged users can only lower priorities, so the ``interactive``
+tier only raises the I/O priority within the best-effort class, which
+they may do.
+"""
+import argparse
+import ctypes
+import errno
+import math
+import os
+import platform
+import re
+from os.path import join as pjoin
+
+# Variables that size the thread pools of common numeric libraries
+THREAD_VARS = (
+    'OMP_NUM_THREADS',
+    'MKL_NUM_THREADS',
+    'OPENBLAS_NUM_THREADS',
+    'BLIS_NUM_THREADS',
+    'VECLIB_MAXIMUM_THREADS',
+    'NUMEXPR_NUM_THREADS',
+    'NUMEXPR_MAX_THREADS',
+)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def cgroup_paths(text=None):
+    """Parses /proc/self/cgroup.
+
+    Returns
+    -------
+    dict
+        Cgroup path by controller name, with ``''`` for the cgroup v2
+        unified hierarchy
+    """
+    text = _read('/proc/self/cgroup') if text is None else text
+    paths = {}
+    for line in (text or '').splitlines():
+        parts = line.split(':', 2)
+        if len(parts) != 3:
+            continue
+        if parts[0] == '0' and not parts[1]:
+            paths[''] = parts[2]
+        for controller in parts[1].split(','):
+            if controller:
+                paths[controller] = parts[2]
+    return paths
+
+
+def _ancestors(path):
+    while True:
+        yield path
+        if path in ('', '/'):
+            return
+        path = os.path.dirname(path)
+
+
+def cgroup_cpu_quota(root=CGROUP_ROOT, paths=None):
+    """Gets the CPU quota of this process's cgroup in CPUs.
+
+    Reads ``cpu.max`` (cgroup v2) or ``cpu.cfs_quota_us`` and
+    ``cpu.cfs_period_us`` (cgroup v1) of the cgroup and its ancestors and
+    returns the tightest quota.
+
+    Returns
+    -------
+    float or None
+        None when no quota is set
+    """
+    paths = cgroup_paths() if paths is None else paths
+    quotas = []
+    if '' in paths:
+        for path in _ancestors(paths['']):
+            value = _read(pjoin(root, path.lstrip('/'), 'cpu.max'))
+            if value and not value.startswith('max'):
+                quota, _, period = value.partition(' ')
+                quotas.append(float(quota) / float(period or 100000))
+    if 'cpu' in paths:
+        for path in _ancestors(paths['cpu']):
+            for mount in ('cpu', 'cpu,cpuacct'):
+                directory = pjoin(root, mount, path.lstrip('/'))
+                quota = _read(pjoin(directory, 'cpu.cfs_quota_us'))
+                period = _read(pjoin(directory, 'cpu.cfs_period_us'))
+                if quota and period and int(quota) > 0:
+                    quotas.append(float(quota) / float(period))
+                    break
+    return min(quotas) if quotas else None
+
+
+def available_cpus(root=CGROUP_ROOT, paths=None):
+    """Gets the number of CPUs this process may use, at least 1."""
+    if hasattr(os, 'sched_getaffinity'):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        import multiprocessing
+        cpus = multiprocessing.cpu_count()
+    quota = cgroup_cpu_quota(root, paths)
+    if quota is not None:
+        cpus = min(cpus, int(math.ceil(quota)))
+    return max(1, cpus)
+
+
+def is_kernel_argv(argv):
+    """Tells whether a command line looks like a running Jupyter kernel."""
+    for i, arg in enumerate(argv[:-1]):
+        if arg in ('-f', '--f') and os.path.basename(argv[i + 1]).startswith('kernel-'):
+            return True
+    return any(arg.startswith('--f=') and os.path.basename(arg[4:]).startswith('kernel-')
+               for arg in argv)
+
+
+def running_kernels(proc='/proc'):
+    """Counts the Jupyter kernels running on this node, of any user.
+
+    Returns 0 where there is no /proc.
+    """
+    count = 0
+    try:
+        pids = [name for name in os.listdir(proc) if name.isdigit()]
+    except OSError:
+        return 0
+    for pid in pids:
+        if int(pid) == os.getpid():
+            continue
+        cmdline = _read(pjoin(proc, pid, 'cmdline'))
+        if cmdline and is_kernel_argv(cmdline.split('\0')):
+            count += 1
+    return count
+
+
+def thread_cap(value):
+    """Parses a ``--thread-cap`` value: a positive number or ``auto``."""
+    if value == 'auto':
+        return value
+    try:
+        cap = int(value)
+    except ValueError:
+        cap = 0
+    if cap < 1:
+        raise argparse.ArgumentTypeError(
+            "thread cap must be a positive number or 'auto', not {!r}".format(value))
+    return cap
+
+
+def resolve_thread_cap(cap, cpus=None, kernels=None):
+    """Computes the thread cap for a new kernel.
+
+    Parameters
+    ----------
+    cap : int or str
+        Fixed cap or ``auto``
+    cpus : int, optional
+        Available CPUs (default: `available_cpus`)
+    kernels : int, optional
+        Kernels already running (default: `running_kernels`)
+    """
+    if cap != 'auto':
+        return int(cap)
+    cpus = available_cpus() if cpus is None else cpus
+    kernels = running_kernels() if kernels is None else kernels
+    return max(1, cpus // (kernels + 1))
+
+
+def apply_thread_caps(env, cap):
+    """Sets the `THREAD_VARS` that are not set in env to cap.
+
+    Returns
+    -------
+    dict
+        A copy of env
+    """
+    env = dict(env)
+    for name in THREAD_VARS:
+        if not env.get(name):
+            env[name] = str(cap)
+    return env
+
+
+_SIZE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmgt]?)i?b?$', re.IGNORECASE)
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+# Controllers the cgroup options need
+CGROUP_CONTROLLERS = {'memory_max': 'memory', 'cpu_weight': 'cpu'}
+
+
+def size(value):
+    """Parses a size like 512M, 8G or 8GiB into bytes, for argparse."""
+    match = _SIZE_RE.match(str(value).strip())
+    if match is None or float(match.group(1)) <= 0:
+        raise argparse.ArgumentTypeError('invalid size: {!r}'.format(value))
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+
+def format_size(value):
+    """Formats a number of bytes, e.g. 8.0 GiB."""
+    for unit in ('TiB', 'GiB', 'MiB', 'KiB'):
+        factor = _SIZE_UNITS[unit[0].lower()]
+        if value >= factor:
+            return '{:.1f} {}'.format(value / float(factor), unit)
+    return '{} B'.format(value)
+
+
+def _bounded_int(low, high, name):
+    def parse(value):
+        try:
+            number = int(value)
+        except ValueError:
+            number = None
+        if number is None or not low <= number <= high:
+            raise argparse.ArgumentTypeError('{} must be a number from {} to {}, not {!r}'
+                                             .format(name, low, high, value))
+        return number
+    return parse
+
+
+nofile = _bounded_int(1, 2 ** 30, 'open file limit')
+cpu_weight = _bounded_int(1, 10000, 'cpu.weight')
+
+
+def describe_limits(options):
+    """Describes the resource limits among launcher options.
+
+    Parameters
+    ----------
+    options : dict
+        Launcher options keyed by argparse dest
+
+    Returns
+    -------
+    dict
+        Human readable limits by option, empty without limits
+    """
+    limits = {}
+    if options.get('limit_as'):
+        limits['address_space'] = format_size(options['limit_as'])
+    if options.get('limit_nofile'):
+        limits['open_files'] = str(options['limit_nofile'])
+    if options.get('cgroup'):
+        limits['cgroup'] = pjoin(options['cgroup'], 'kernel-<pid>')
+    if options.get('memory_max'):
+        limits['memory_max'] = format_size(options['memory_max'])
+    if options.get('cpu_weight'):
+        limits['cpu_weight'] = str(options['cpu_weight'])
+    if options.get('priority'):
+        limits['priority'] = describe_priority(options['priority'])
+    return limits
+
+
+def check_limits(options):
+    """Validates the resource limits among launcher options.
+
+    Returns
+    -------
+    list
+        Problems that keep a limit from taking effect on this host
+
+    Raises
+    ------
+    ValueError
+        If the options contradict each other
+    """
+    cgroup = options.get('cgroup')
+    wanted = [key for key in CGROUP_CONTROLLERS if options.get(key)]
+    if wanted and not cgroup:
+        raise ValueError('--{} needs --cgroup'.format(wanted[0].replace('_', '-')))
+    problems = []
+    nofile_limit = options.get('limit_nofile')
+    if nofile_limit:
+        import resource
+        hard = resource.getrlimit(resource.RLIMIT_NOFILE)[1]
+        if hard != resource.RLIM_INFINITY and nofile_limit > hard:
+            problems.append('open file limit {} is above the hard limit {}; {} applies'
+                            .format(nofile_limit, hard, hard))
+    if cgroup:
+        problems.extend(check_cgroup(cgroup, [CGROUP_CONTROLLERS[key] for key in wanted]))
+    return problems
+
+
+def check_cgroup(path, controllers=()):
+    """Checks that kernels can be placed below a cgroup v2 directory.
+
+    Returns
+    -------
+    list
+        Problems found, empty when the cgroup is usable
+    """
+    if not os.path.exists(pjoin(path, 'cgroup.controllers')):
+        return ['{} is not a cgroup v2 directory'.format(path)]
+    problems = []
+    if not os.access(path, os.W_OK):
+        problems.append('{} is not writable; delegate it to the user'.format(path))
+    enabled = (_read(pjoin(path, 'cgroup.subtree_control')) or '').split()
+    for controller in controllers:
+        if controller not in enabled:
+            problems.append('the {} controller is not enabled in {}/cgroup.subtree_control'
+                            .format(controller, path))
+    return problems
+
+
+def apply_rlimits(address_space=None, open_files=None):
+    """Limits this process, and the kernel it execs, with setrlimit.
+
+    Limits above the hard limit are lowered to it. The address space
+    limit also becomes the hard limit, so the kernel cannot raise it.
+
+    Returns
+    -------
+    dict
+        The applied soft limits by name
+    """
+    import resource
+    applied = {}
+    for name, kind, value, fix_hard in (('address_space', 'RLIMIT_AS', address_space, True),
+                                        ('open_files', 'RLIMIT_NOFILE', open_files, False)):
+        if not value:
+            continue
+        limit = getattr(resource, kind)
+        soft, hard = resource.getrlimit(limit)
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(limit, (value, value if fix_hard else hard))
+        applied[name] = value
+    return applied
+
+
+def prune_cgroups(parent):
+    """Removes the empty ``kernel-*`` cgroups of exited kernels below parent."""
+    try:
+        names = os.listdir(parent)
+    except OSError:
+        return
+    for name in names:
+        if not name.startswith('kernel-'):
+            continue
+        path = pjoin(parent, name)
+        if not _read(pjoin(path, 'cgroup.procs')):
+            try:
+                os.rmdir(path)
+            except OSError as e:
+                # Busy again or removed by a concurrent launch
+                if e.errno not in (errno.EBUSY, errno.ENOENT):
+                    raise
+
+
+def create_cgroup(parent, memory_max=None, cpu_weight=None, pid=None):
+    """Creates the ``kernel-<pid>`` child cgroup of a process with limits.
+
+    Returns
+    -------
+    str
+        Path of the new cgroup
+    """
+    pid = os.getpid() if pid is None else pid
+    prune_cgroups(parent)
+    path = pjoin(parent, 'kernel-{}'.format(pid))
+    if not os.path.isdir(path):
+        os.mkdir(path)
+    for name, value in (('memory.max', memory_max), ('cpu.weight', cpu_weight)):
+        if value:
+            with open(pjoin(path, name), 'w') as f:
+                f.write(str(value))
+    return path
+
+
+def join_cgroup(path, pid=None):
+    """Moves a process into a cgroup."""
+    with open(pjoin(path, 'cgroup.procs'), 'w') as f:
+        f.write(str(os.getpid() if pid is None else pid))
+
+
+def enter_cgroup(parent, memory_max=None, cpu_weight=None, pid=None):
+    """Moves a process into a new child cgroup with limits.
+
+    Returns
+    -------
+    str
+        Path of the new cgroup
+    """
+    path = create_cgroup(parent, memory_max, cpu_weight, pid)
+    join_cgroup(path, pid)
+    return path
+
+
+# I/O scheduling classes of ioprio_set
+IOPRIO_CLASS_BE = 2
+IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+_IOPRIO_NAMES = {IOPRIO_CLASS_BE: 'best-effort', IOPRIO_CLASS_IDLE: 'idle'}
+# ioprio_set syscall numbers by machine
+_IOPRIO_SET = {'x86_64': 251, 'amd64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30,
+               'arm64': 30, 'armv7l': 314, 'ppc64le': 273, 'ppc64': 273, 's390x': 282}
+
+# nice value, (I/O class, I/O level) and scheduling policy per tier
+PRIORITY_TIERS = {
+    'interactive': {'nice': 0, 'io': (IOPRIO_CLASS_BE, 0), 'policy': None},
+    'normal': {'nice': 0, 'io': (IOPRIO_CLASS_BE, 4), 'policy': None},
+    'batch': {'nice': 10, 'io': (IOPRIO_CLASS_BE, 7), 'policy': 'SCHED_BATCH'},
+    'idle': {'nice': 19, 'io': (IOPRIO_CLASS_IDLE, 0), 'policy': 'SCHED_IDLE'},
+}
+
+
+def describe_priority(tier):
+    """Describes a priority tier, e.g. ``batch: nice 10, best-effort I/O 7, SCHED_BATCH``."""
+    settings = PRIORITY_TIERS[tier]
+    io_class, io_level = settings['io']
+    parts = ['nice {}'.format(settings['nice']),
+             '{} I/O{}'.format(_IOPRIO_NAMES[io_class],
+                               ' {}'.format(io_level) if io_class == IOPRIO_CLASS_BE else '')]
+    if settings['policy']:
+        parts.append(settings['policy'])
+    return '{}: {}'.format(tier, ', '.join(parts))
+
+
+def ioprio_set(io_class, level=0, pid=0):
+    """Sets the I/O priority of a process with the ioprio_set syscall.
+
+    Raises
+    ------
+    OSError
+        If the syscall is unknown on this machine or fails
+    """
+    number = _IOPRIO_SET.get(platform.machine().lower())
+    if number is None or not platform.system() == 'Linux':
+        raise OSError(errno.ENOSYS, 'ioprio_set is not available on this machine')
+    libc = ctypes.CDLL(None, use_errno=True)
+    value = (io_class << _IOPRIO_CLASS_SHIFT) | level
+    if libc.syscall(number, _IOPRIO_WHO_PROCESS, pid, value) != 0:
+        code = ctypes.get_errno()
+        raise OSError(code, 'ioprio_set: {}'.format(os.strerror(code)))
+
+
+def apply_priority(tier):
+    """Applies a priority tier to this process and the kernel it execs.
+
+    Each setting is applied on its own, so one that is not permitted or
+    not supported does not keep the others from taking effect.
+
+    Returns
+    -------
+    tuple
+        (applied, problems) with the applied settings by name and
+        messages about the ones that could not be applied
+    """
+    settings = PRIORITY_TIERS[tier]
+    applied, problems = {}, []
+    # os.nice rather than os.setpriority, which Python 2 lacks
+    current = os.nice(0)
+    if settings['nice'] > current:
+        os.nice(settings['nice'] - current)
+    applied['nice'] = max(current, settings['nice'])
+    try:
+        ioprio_set(*settings['io'])
+        applied['io'] = '{} {}'.format(_IOPRIO_NAMES[settings['io'][0]], settings['io'][1])
+    except OSError as e:
+        problems.append('could not set the I/O priority: {}'.format(e))
+    policy = settings['policy']
+    if policy:
+        try:
+            os.sched_setscheduler(0, getattr(os, policy), os.sched_param(0))
+            applied['policy'] = policy
+        except (AttributeError, OSError) as e:
+            problems.append('could not set {}: {}'.format(policy, e))
+    return applied, problems
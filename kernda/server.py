@@ -0,0 +1,204 @@
+"""Long-running kernda daemon serving spec builds over a Unix socket.
+
+``kernda serve`` keeps the in-process conda lookups, backend discovery and
+snapshot caches warm across requests, so a spec build costs milliseconds
+instead of an interpreter start plus resolver work.
+
+The protocol is newline-delimited JSON. Each request is an object with an
+``op`` key and op-specific arguments; each response has ``ok``,
+``elapsed_ms`` and either ``result`` or ``error`` (and maybe ``hint``):
+
+* ``{"op": "ping"}``
+* ``{"op": "build", "spec": {...}, "options": {...}}`` where options are
+  keyword arguments of `kernda.api.build_spec`
+* ``{"op": "refresh", "paths": [...], "env_dir": ..., "refresh": false}``
+  with arguments of `kernda.api.refresh_specs`
+* ``{"op": "status"}``
+"""
+import collections
+import json
+import os
+import socket
+import threading
+import time
+from os.path import join as pjoin
+try:
+    import socketserver
+except ImportError:
+    import SocketServer as socketserver
+
+from . import api, registry
+from .cache import state_dir
+from .util import percentile
+
+
+def default_socket_path():
+    """Gets the socket path from $KERNDA_SOCKET or the runtime directory."""
+    path = os.getenv('KERNDA_SOCKET')
+    if path:
+        return path
+    return pjoin(os.getenv('XDG_RUNTIME_DIR') or state_dir(), 'kernda.sock')
+
+
+class LatencyStats(object):
+    """Thread-safe per-operation latency statistics over recent requests."""
+
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self._window = window
+        self._samples = {}
+        self._counts = collections.Counter()
+        self._errors = collections.Counter()
+
+    def record(self, op, seconds, ok=True):
+        """Records the latency of one request."""
+        with self._lock:
+            samples = self._samples.setdefault(op, collections.deque(maxlen=self._window))
+            samples.append(seconds * 1000.0)
+            self._counts[op] += 1
+            if not ok:
+                self._errors[op] += 1
+
+    def summary(self):
+        """Summarizes latencies in milliseconds, per operation."""
+        with self._lock:
+            samples = dict((op, sorted(values)) for op, values in self._samples.items())
+            counts = dict(self._counts)
+            errors = dict(self._errors)
+        summary = {}
+        for op, values in samples.items():
+            summary[op] = {
+                'count': counts[op],
+                'errors': errors.get(op, 0),
+                'mean_ms': sum(values) / len(values),
+                'p50_ms': percentile(values, 50),
+                'p95_ms': percentile(values, 95),
+                'p99_ms': percentile(values, 99),
+                'max_ms': values[-1],
+            }
+        return summary
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    """Answers every request line on a connection."""
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.server.dispatch(line)
+            self.wfile.write((json.dumps(response) + '\n').encode('utf8'))
+            self.wfile.flush()
+
+
+class KerndaServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Unix socket server dispatching JSON requests to the kernda API."""
+    daemon_threads = True
+
+    def __init__(self, path=None):
+        self.path = path or default_socket_path()
+        self.started = time.time()
+        self.stats = LatencyStats()
+        if os.path.exists(self.path):
+            # Remove the socket of a daemon that did not shut down cleanly,
+            # but never steal the socket of a running one
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except socket.error:
+                os.remove(self.path)
+            else:
+                raise api.KerndaError('a kernda server is already listening on {}'.format(self.path))
+            finally:
+                probe.close()
+        elif not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path))
+        # Bind under a private umask: chmod after bind would leave a window in
+        # which other users can connect
+        umask = os.umask(0o077)
+        try:
+            socketserver.UnixStreamServer.__init__(self, self.path, _Handler)
+        finally:
+            os.umask(umask)
+
+    def server_close(self):
+        socketserver.UnixStreamServer.server_close(self)
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def dispatch(self, line):
+        """Handles one request line and returns the response object."""
+        start = time.time()
+        op = None
+        try:
+            request = json.loads(line.decode('utf8') if isinstance(line, bytes) else line)
+            op = request.get('op')
+            handler = getattr(self, 'op_' + str(op), None)
+            if handler is None:
+                raise api.KerndaError('unknown op {}'.format(op))
+            response = {'ok': True, 'result': handler(request)}
+        except api.KerndaError as e:
+            response = {'ok': False, 'error': str(e), 'hint': e.hint}
+        except Exception as e:
+            response = {'ok': False, 'error': '{}: {}'.format(type(e).__name__, e)}
+        elapsed = time.time() - start
+        self.stats.record(op or 'invalid', elapsed, response['ok'])
+        response['elapsed_ms'] = elapsed * 1000.0
+        return response
+
+    def op_ping(self, request):
+        return {'pid': os.getpid()}
+
+    def op_build(self, request):
+        result = api.build_spec(request['spec'], **request.get('options', {}))
+        return {'spec': result.spec, 'diagnostics': result.diagnostics}
+
+    def op_refresh(self, request):
+        return api.refresh_specs(paths=request.get('paths'),
+                                 env_dir=request.get('env_dir'),
+                                 refresh=request.get('refresh', False))
+
+    def op_status(self, request):
+        return {
+            'pid': os.getpid(),
+            'socket': self.path,
+            'uptime': time.time() - self.started,
+            'managed_specs': len(registry.load()),
+            'stats': self.stats.summary(),
+        }
+
+
+def request(op, socket_path=None, timeout=None, **payload):
+    """Sends one request to a kernda daemon.
+
+    Returns
+    -------
+    object
+        The ``result`` of the response
+
+    Raises
+    ------
+    kernda.api.KerndaError
+        If the daemon reports an error
+    socket.error
+        If the daemon cannot be reached
+    """
+    payload['op'] = op
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(socket_path or default_socket_path())
+        sock.sendall((json.dumps(payload) + '\n').encode('utf8'))
+        f = sock.makefile('rb')
+        line = f.readline()
+        f.close()
+    finally:
+        sock.close()
+    if not line:
+        raise api.KerndaError('the kernda server closed the connection')
+    response = json.loads(line.decode('utf8'))
+    if not response['ok']:
+        raise api.KerndaError(response['error'], hint=response.get('hint'))
+    return response['result']
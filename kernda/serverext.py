@@ -0,0 +1,97 @@
+"""jupyter_server extension exposing kernda status and refresh endpoints.
+
+Enable with ``jupyter server extension enable kernda``. Endpoints, relative
+to the server's base URL:
+
+* ``GET /kernda/status``: launch mode, snapshot freshness and recent
+  activation latencies per kernel spec
+* ``POST /kernda/refresh``: starts rebuilding the specs named in the JSON
+  body (``{"names": [...]}``) or, without names, every spec whose snapshot
+  is stale or missing; answers 202 with a job id
+* ``GET /kernda/refresh/<job>``: state and results of a refresh job, one
+  of the last `MAX_JOBS`
+"""
+import json
+import uuid
+from collections import OrderedDict
+
+from jupyter_server.base.handlers import APIHandler
+from jupyter_server.utils import url_path_join
+from tornado import web
+from tornado.ioloop import IOLoop
+
+from . import aio, api
+from .status import collect_status, stale_paths
+
+# Number of refresh jobs whose state is kept
+MAX_JOBS = 100
+
+# Refresh jobs by id, oldest first
+_jobs = OrderedDict()
+
+
+class StatusHandler(APIHandler):
+    """Reports the status of every kernel spec."""
+
+    @web.authenticated
+    async def get(self):
+        specs = self.kernel_spec_manager.find_kernel_specs()
+        status = await aio.run_in_executor(collect_status, specs)
+        self.finish(json.dumps({'kernelspecs': status}))
+
+
+class RefreshHandler(APIHandler):
+    """Starts asynchronous refreshes of kernel specs."""
+
+    @web.authenticated
+    async def post(self):
+        body = self.get_json_body() or {}
+        specs = self.kernel_spec_manager.find_kernel_specs()
+        status = await aio.run_in_executor(collect_status, specs)
+        names = body.get('names')
+        if names:
+            unknown = [n for n in names if n not in status or not status[n].get('managed')]
+            if unknown:
+                raise web.HTTPError(400, 'not kernda-managed: {}'.format(', '.join(unknown)))
+            paths = [status[n]['path'] for n in names]
+        else:
+            paths = stale_paths(status)
+        job = uuid.uuid4().hex
+        _jobs[job] = {'state': 'running', 'paths': paths, 'results': None}
+        while len(_jobs) > MAX_JOBS:
+            _jobs.popitem(last=False)
+        IOLoop.current().spawn_callback(_refresh, job, paths)
+        self.set_status(202)
+        self.finish(json.dumps({'job': job, 'paths': paths}))
+
+
+class RefreshJobHandler(APIHandler):
+    """Reports the state of a refresh job."""
+
+    @web.authenticated
+    def get(self, job):
+        if job not in _jobs:
+            raise web.HTTPError(404)
+        self.finish(json.dumps(_jobs[job]))
+
+
+async def _refresh(job, paths):
+    # The job may be evicted before it finishes
+    try:
+        results = await aio.run_in_executor(api.refresh_specs, paths)
+        _jobs.get(job, {}).update(state='done', results=results)
+    except Exception as e:
+        _jobs.get(job, {}).update(state='failed', error=str(e))
+
+
+def _jupyter_server_extension_points():
+    return [{'module': 'kernda.serverext'}]
+
+
+def _load_jupyter_server_extension(serverapp):
+    base_url = serverapp.web_app.settings['base_url']
+    serverapp.web_app.add_handlers('.*$', [
+        (url_path_join(base_url, 'kernda', 'status'), StatusHandler),
+        (url_path_join(base_url, 'kernda', 'refresh'), RefreshHandler),
+        (url_path_join(base_url, 'kernda', 'refresh', r'(?P<job>\w+)'), RefreshJobHandler),
+    ])
@@ -0,0 +1,103 @@
+"""Cached activation snapshots keyed on backend, environment and modules."""
+import time
+from os.path import abspath
+
+from . import cache
+from .modules import load_command, modulepath_fingerprint
+
+KIND = 'snapshots'
+
+
+def snapshot_key(backend, env_dir, modules=()):
+    """Computes the cache key of an environment's activation snapshot."""
+    if not modules:
+        return cache.cache_key(backend.name, abspath(env_dir))
+    return cache.cache_key(backend.name, abspath(env_dir), list(modules))
+
+
+def snapshot_fingerprint(backend, env_dir, modules=()):
+    """Fingerprints everything a snapshot depends on."""
+    fingerprint = backend.fingerprint(env_dir)
+    if modules:
+        fingerprint += '-' + modulepath_fingerprint(modules)
+    return fingerprint
+
+
+def load_snapshot(backend, env_dir, fingerprint=None, modules=()):
+    """Loads a snapshot if one exists and is still fresh.
+
+    Parameters
+    ----------
+    backend : kernda.backends.Backend
+        Backend that produced the snapshot
+    env_dir : str
+        Environment prefix
+    fingerprint : str, optional
+        Current fingerprint of the environment (default: computed)
+    modules : list, optional
+        Environment Modules loaded before activation
+
+    Returns
+    -------
+    dict or None
+        Snapshot entry or None when missing or stale
+    """
+    entry = cache.load(KIND, snapshot_key(backend, env_dir, modules))
+    if entry is None:
+        return None
+    if fingerprint is None:
+        fingerprint = snapshot_fingerprint(backend, env_dir, modules)
+    if entry.get('fingerprint') != fingerprint:
+        return None
+    return entry
+
+
+def take_snapshot(backend, env_dir, modules=(), diff=None, hooks=None):
+    """Captures the activation of an environment and caches it.
+
+    Parameters
+    ----------
+    backend : kernda.backends.Backend
+        Backend to capture with
+    env_dir : str
+        Environment prefix
+    modules : list, optional
+        Environment Modules to load before activation
+    diff : dict, optional
+        Activation diff captured by the caller (default: captured here)
+    hooks : list, optional
+        Receives the timings of the ``activate.d`` hooks the capture ran
+
+    Returns
+    -------
+    dict
+        New snapshot entry
+    """
+    entry = {
+        'backend': backend.name,
+        'env_dir': abspath(env_dir),
+        'modules': list(modules),
+        'fingerprint': snapshot_fingerprint(backend, env_dir, modules),
+        'diff': diff if diff is not None else backend.capture(
+            env_dir, prelude=load_command(modules), hooks=hooks),
+        'created': time.time(),
+    }
+    cache.store(KIND, snapshot_key(backend, env_dir, modules), entry)
+    return entry
+
+
+def get_snapshot(backend, env_dir, modules=(), hooks=None):
+    """Gets a fresh snapshot, capturing a new one when needed.
+
+    hooks, when given, receives the ``activate.d`` hook timings of the
+    capture; it stays empty on a cache hit.
+
+    Returns
+    -------
+    tuple
+        (entry, hit) where hit is True when the cached entry was fresh
+    """
+    entry = load_snapshot(backend, env_dir, modules=modules)
+    if entry is not None:
+        return entry, True
+    return take_snapshot(backend, env_dir, modules, hooks=hooks), False
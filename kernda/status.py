@@ -0,0 +1,104 @@
+"""Status of kernda-managed kernel specs: launch mode, cache freshness and
+recent launch latencies."""
+import json
+import time
+from os.path import join as pjoin
+
+from . import cache
+from .api import is_kernda_spec
+from .backends import get_backend
+from .launchlog import read_launches
+from .snapshot import KIND, snapshot_fingerprint, snapshot_key
+from .util import percentile
+
+
+def snapshot_state(spec):
+    """Checks the activation snapshot a spec launches with.
+
+    Returns
+    -------
+    dict
+        ``state`` is one of ``fresh``, ``stale``, ``missing`` or ``none``
+        (the spec does not use snapshots); ``age`` is in seconds
+    """
+    if spec.get('_kernda_mode') != 'snapshot':
+        return {'state': 'none', 'age': None}
+    env_dir = spec['_kernda_env_dir']
+    modules = spec.get('_kernda_options', {}).get('modules') or ()
+    try:
+        backend = get_backend(spec['_kernda_backend'])
+    except KeyError:
+        return {'state': 'missing', 'age': None}
+    entry = cache.load(KIND, snapshot_key(backend, env_dir, modules))
+    if entry is None:
+        return {'state': 'missing', 'age': None}
+    fresh = entry.get('fingerprint') == snapshot_fingerprint(backend, env_dir, modules)
+    return {'state': 'fresh' if fresh else 'stale',
+            'age': time.time() - entry.get('created', 0)}
+
+
+def latency_summary(records, key='activation_ms'):
+    """Summarizes a latency field of launch records in milliseconds."""
+    values = sorted(r[key] for r in records if r.get(key) is not None)
+    hits = [r['cache_hit'] for r in records if r.get('cache_hit') is not None]
+    return {
+        'count': len(values),
+        'p50_ms': percentile(values, 50),
+        'p95_ms': percentile(values, 95),
+        'max_ms': values[-1] if values else None,
+        'cache_hit_rate': float(sum(hits)) / len(hits) if hits else None,
+        'last': records[-1]['time'] if records else None,
+    }
+
+
+def spec_status(name, spec, limit=100):
+    """Collects the status of one kernel spec."""
+    if not is_kernda_spec(spec):
+        return {'name': name, 'managed': False}
+    launches = read_launches(spec=name, limit=limit)
+    return {
+        'name': name,
+        'managed': True,
+        'display_name': spec.get('display_name'),
+        'env_dir': spec.get('_kernda_env_dir'),
+        'backend': spec.get('_kernda_backend'),
+        'mode': spec.get('_kernda_mode', 'source'),
+        'snapshot': snapshot_state(spec),
+        'activation': latency_summary(launches),
+        'recent_launches': launches[-10:],
+    }
+
+
+def collect_status(kernel_specs, limit=100):
+    """Collects the status of kernel specs.
+
+    Parameters
+    ----------
+    kernel_specs : dict
+        Kernel spec resource directories keyed by name, as returned by
+        jupyter_client's `KernelSpecManager.find_kernel_specs`
+
+    Returns
+    -------
+    dict
+        Status per kernel spec name
+    """
+    status = {}
+    for name, resource_dir in sorted(kernel_specs.items()):
+        path = pjoin(resource_dir, 'kernel.json')
+        try:
+            with open(path) as f:
+                spec = json.load(f)
+        except (IOError, OSError, ValueError) as e:
+            status[name] = {'name': name, 'error': str(e)}
+            continue
+        status[name] = spec_status(name, spec, limit)
+        status[name]['path'] = path
+    return status
+
+
+def stale_paths(status):
+    """Lists the spec paths whose snapshots are stale or missing."""
+    return sorted(s['path'] for s in status.values()
+                  if s.get('managed') and
+                  s['snapshot']['state'] in ('stale', 'missing'))
@@ -0,0 +1,222 @@
+"""Trace spans of kernel launch phases in OpenTelemetry's OTLP JSON format.
+
+With ``--trace-dir`` (or $KERNDA_TRACE_DIR) the launcher writes one file
+per launch. Each file holds an OTLP ``ExportTraceServiceRequest``, which
+can be loaded into any tracing UI without running a collector. The spans
+are nested under a ``kernda.launch`` root:
+
+* ``kernda.resolve``: finding a fresh activation snapshot (snapshot mode)
+  or starting bash (source mode)
+* ``kernda.activate``: capturing or applying the activation, with one
+  ``kernda.hook`` child per ``activate.d`` script when it was timed
+* ``kernda.exec``: from the exec to the kernel's first ``kernel_info``
+  reply when ``--trace-kernel-info`` is given, else an instant
+
+Source mode launches without ``--timing`` have no ``kernda.resolve`` and
+``kernda.activate`` spans, because bash activates after the exec. Their
+``kernda.exec`` span has ``kernda.includes_activation`` set instead.
+
+Trace context follows the W3C ``traceparent`` format in $TRACEPARENT. The
+launcher continues a trace it inherits and passes its root span down to
+the kernel the same way.
+"""
+import binascii
+import json
+import os
+import re
+import shlex
+import socket
+import time
+from os.path import basename, join as pjoin
+
+from .cache import atomic_write
+
+TRACEPARENT = 'TRACEPARENT'
+_TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+# OTLP span kinds
+SPAN_KIND_INTERNAL = 1
+
+
+def trace_dir(path=None):
+    """Gets the trace directory from path or $KERNDA_TRACE_DIR, if any."""
+    return path or os.getenv('KERNDA_TRACE_DIR') or None
+
+
+def new_id(size):
+    """Generates a random hex trace (16 bytes) or span (8 bytes) id."""
+    return binascii.hexlify(os.urandom(size)).decode('ascii')
+
+
+def parse_traceparent(value):
+    """Parses a W3C traceparent header.
+
+    Returns
+    -------
+    tuple or None
+        (trace_id, parent_span_id), None if value is missing or invalid
+    """
+    match = _TRACEPARENT_RE.match((value or '').strip().lower())
+    if match is None or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+        return None
+    return match.group(1), match.group(2)
+
+
+def format_traceparent(trace_id, span_id):
+    """Formats a sampled W3C traceparent header."""
+    return '00-{}-{}-01'.format(trace_id, span_id)
+
+
+def _attribute(key, value):
+    if isinstance(value, bool):
+        typed = {'boolValue': value}
+    elif isinstance(value, int):
+        typed = {'intValue': str(value)}
+    elif isinstance(value, float):
+        typed = {'doubleValue': value}
+    else:
+        typed = {'stringValue': str(value)}
+    return {'key': key, 'value': typed}
+
+
+def make_span(name, start, end, trace_id, span_id=None, parent_id=None, attributes=None):
+    """Builds an OTLP JSON span.
+
+    Parameters
+    ----------
+    name : str
+        Span name
+    start, end : float
+        Wall clock timestamps in seconds
+    trace_id : str
+        Hex trace id
+    span_id : str, optional
+        Hex span id (default: random)
+    parent_id : str, optional
+        Hex id of the parent span
+    attributes : dict, optional
+        Span attributes; None values are left out
+    """
+    span = {
+        'traceId': trace_id,
+        'spanId': span_id or new_id(8),
+        'name': name,
+        'kind': SPAN_KIND_INTERNAL,
+        'startTimeUnixNano': str(int(start * 1e9)),
+        'endTimeUnixNano': str(int(max(start, end) * 1e9)),
+        'attributes': [_attribute(k, v) for k, v in sorted((attributes or {}).items())
+                       if v is not None],
+    }
+    if parent_id:
+        span['parentSpanId'] = parent_id
+    return span
+
+
+def launch_spans(record):
+    """Builds the spans of a launch from its launch log record.
+
+    The record needs ``trace_id`` and ``span_id`` (of the root span) and
+    may have ``parent_span_id``.
+
+    Returns
+    -------
+    list
+        OTLP JSON spans, root first
+    """
+    trace_id, root_id = record['trace_id'], record['span_id']
+    start = record['time']
+    activated = record.get('activated') or start
+    exec_time = record.get('exec') or activated
+    ready = record.get('kernel_ready') or exec_time
+    spans = [make_span('kernda.launch', start, ready, trace_id, root_id,
+                       record.get('parent_span_id'), {
+                           'kernda.spec': record.get('spec'),
+                           'kernda.env_dir': record.get('env_dir'),
+                           'kernda.backend': record.get('backend'),
+                           'kernda.mode': record.get('mode'),
+                           'kernda.cache_hit': record.get('cache_hit'),
+                           'process.pid': record.get('pid'),
+                       })]
+    # Without --timing, source mode activates after the launcher execs
+    # bash, where nothing times it
+    untimed = record.get('mode') == 'source' and not record.get('shell_start')
+    if not untimed:
+        # Source mode: bash starts at shell_start; snapshot mode: the
+        # snapshot lookup ends at resolved
+        resolved = record.get('shell_start') or record.get('resolved') or start
+        spans.append(make_span('kernda.resolve', start, resolved, trace_id, parent_id=root_id))
+        activate = make_span('kernda.activate', resolved, activated, trace_id,
+                             parent_id=root_id)
+        spans.append(activate)
+        for hook in record.get('hooks') or ():
+            spans.append(make_span('kernda.hook', hook['start'],
+                                   hook['start'] + hook['ms'] / 1000.0,
+                                   trace_id, parent_id=activate['spanId'],
+                                   attributes={'kernda.hook': basename(hook['path']),
+                                               'kernda.hook.path': hook['path']}))
+    spans.append(make_span('kernda.exec', exec_time, ready, trace_id, parent_id=root_id,
+                           attributes={'kernda.kernel_info': 'kernel_ready' in record,
+                                       'kernda.includes_activation': untimed or None}))
+    return spans
+
+
+def write_trace(spans, directory, host=None):
+    """Writes spans as an OTLP JSON file.
+
+    Returns
+    -------
+    str
+        Path of the written file, named after the trace and root span
+    """
+    request = {'resourceSpans': [{
+        'resource': {'attributes': [
+            _attribute('service.name', 'kernda'),
+            _attribute('host.name', host or socket.gethostname()),
+        ]},
+        'scopeSpans': [{'scope': {'name': 'kernda'}, 'spans': spans}],
+    }]}
+    path = pjoin(directory, '{}-{}.json'.format(spans[0]['traceId'], spans[0]['spanId']))
+    atomic_write(path, json.dumps(request), mode=0o644)
+    return path
+
+
+def connection_file(argv):
+    """Finds the connection file in a kernel start command, if any.
+
+    The script of a ``bash -c`` command, as used in source mode, is
+    searched too.
+    """
+    if argv[:2] == ['bash', '-c'] and len(argv) > 2:
+        try:
+            argv = shlex.split(argv[2])
+        except ValueError:
+            return None
+    for i, arg in enumerate(argv):
+        if arg in ('-f', '--f') and i + 1 < len(argv):
+            return argv[i + 1]
+        if arg.startswith('--f='):
+            return arg[len('--f='):]
+    return None
+
+
+def wait_kernel_info(path, timeout=60.0):
+    """Waits for the first kernel_info reply of a kernel.
+
+    Needs jupyter_client.
+
+    Returns
+    -------
+    float or None
+        Timestamp of the reply, None when there was none within timeout
+    """
+    from jupyter_client import BlockingKernelClient
+    client = BlockingKernelClient(connection_file=path)
+    client.load_connection_file()
+    client.start_channels()
+    try:
+        client.wait_for_ready(timeout=timeout)
+        return time.time()
+    except RuntimeError:
+        return None
+    finally:
+        client.stop_channels()
@@ -0,0 +1,10 @@
+"""Small helpers shared by kernda modules."""
+import math
+
+
+def percentile(values, pct):
+    """Computes a nearest-rank percentile of a sorted list of values."""
+    if not values:
+        return None
+    index = max(0, int(math.ceil(pct / 100.0 * len(values))) - 1)
+    return values[index]
@@ -0,0 +1,271 @@
+"""Watches managed environments and refreshes their specs when they change.
+
+``kernda watch`` follows the paths each backend reports through
+`kernda.backends.Backend.watch_paths` (for conda: ``conda-meta/`` and
+``etc/conda/activate.d/``) of every environment in the registry of managed
+specs. It uses inotify on Linux and falls back to polling fingerprints
+elsewhere. Bursts of changes, e.g. a ``conda install`` writing hundreds of
+files, are debounced. The affected specs and snapshots are then rebuilt in
+a background thread, so the next kernel start finds fresh data.
+"""
+from __future__ import print_function
+
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import sys
+import threading
+import time
+
+from . import api, registry
+from .backends import detect_backend, get_backend
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM |
+              IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF)
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+def env_backend(env_dir):
+    """Gets the backend of a managed environment."""
+    for entry in registry.load().values():
+        if entry.get('env_dir') == env_dir and entry.get('backend'):
+            try:
+                return get_backend(entry['backend'])
+            except KeyError:
+                break
+    return detect_backend(env_dir)
+
+
+class PollingWatcher(object):
+    """Detects changes by comparing backend fingerprints periodically."""
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self._fingerprints = {}
+
+    def watch(self, env_dir):
+        """Starts watching an environment."""
+        if env_dir not in self._fingerprints:
+            backend = env_backend(env_dir)
+            self._fingerprints[env_dir] = (backend, backend.fingerprint(env_dir))
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds and returns the changed environments."""
+        time.sleep(min(timeout, self.interval))
+        changed = set()
+        for env_dir, (backend, old) in list(self._fingerprints.items()):
+            new = backend.fingerprint(env_dir)
+            if new != old:
+                self._fingerprints[env_dir] = (backend, new)
+                changed.add(env_dir)
+        return changed
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """Detects changes with Linux inotify, through libc via ctypes."""
+
+    def __init__(self):
+        libc_name = ctypes.util.find_library('c')
+        if not sys.platform.startswith('linux') or not libc_name:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._libc = ctypes.CDLL(libc_name, use_errno=True)
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self._wds = {}
+        self._envs = {}
+
+    def watch(self, env_dir):
+        """Starts watching the existing watch paths of an environment.
+
+        Paths that appear later are picked up when the environment's
+        parent directories report a change and `watch` is called again.
+        """
+        for path in env_backend(env_dir).watch_paths(env_dir):
+            if path in self._envs or not os.path.exists(path):
+                continue
+            wd = self._libc.inotify_add_watch(self.fd, path.encode(sys.getfilesystemencoding()),
+                                              WATCH_MASK)
+            if wd < 0:
+                continue
+            self._wds[wd] = path
+            self._envs[path] = env_dir
+
+    def wait(self, timeout):
+        """Waits up to timeout seconds and returns the changed environments."""
+        changed = set()
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return changed
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size + length
+            path = self._wds.get(wd)
+            if path is None:
+                continue
+            changed.add(self._envs[path])
+            if mask & IN_IGNORED:
+                # The watched path is gone; allow watching it again later
+                del self._wds[wd]
+                del self._envs[path]
+        return changed
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(poll=False, interval=2.0):
+    """Creates an inotify watcher, or a polling one where that fails."""
+    if not poll:
+        try:
+            return InotifyWatcher()
+        except (OSError, AttributeError):
+            pass
+    return PollingWatcher(interval)
+
+
+class Debouncer(object):
+    """Releases keys once no new event arrived for them for delay seconds."""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self._pending = {}
+
+    def add(self, key, now=None):
+        self._pending[key] = time.time() if now is None else now
+
+    def ready(self, now=None):
+        """Pops and returns the keys whose events have settled."""
+        now = time.time() if now is None else now
+        keys = [k for k, t in self._pending.items() if now - t >= self.delay]
+        for key in keys:
+            del self._pending[key]
+        return keys
+
+    def next_timeout(self, default, now=None):
+        """Seconds until the next key settles, at most default."""
+        if not self._pending:
+            return default
+        now = time.time() if now is None else now
+        return max(0.0, min(default, min(self._pending.values()) + self.delay - now))
+
+
+def refresh_env(env_dir, log=None):
+    """Refreshes the managed specs of one environment."""
+    results = api.refresh_specs(env_dir=env_dir)
+    if log is not None:
+        for path, result in sorted(results.items()):
+            if result['ok']:
+                log('Refreshed {}'.format(path))
+            else:
+                log('Error: {}: {}'.format(path, result['error']))
+    return results
+
+
+class Refresher(threading.Thread):
+    """Background thread that refreshes environments one at a time."""
+
+    def __init__(self, refresh=refresh_env, log=None):
+        super(Refresher, self).__init__()
+        self.daemon = True
+        self._refresh = refresh
+        self._log = log
+        self._cond = threading.Condition()
+        self._queue = []
+        self._stopped = False
+
+    def submit(self, env_dir):
+        with self._cond:
+            if env_dir not in self._queue:
+                self._queue.append(env_dir)
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._stopped:
+                    self._cond.wait()
+                if self._stopped and not self._queue:
+                    return
+                env_dir = self._queue.pop(0)
+            try:
+                self._refresh(env_dir, log=self._log)
+            except Exception as e:
+                if self._log is not None:
+                    self._log('Error: refreshing {} failed: {}'.format(env_dir, e))
+
+
+def watch(delay=2.0, poll=False, interval=2.0, rescan=30.0, stop=None,
+          refresh=refresh_env, log=None):
+    """Watches managed environments until stop is set.
+
+    Parameters
+    ----------
+    delay : float, optional
+        Seconds without changes before an environment is refreshed
+    poll : bool, optional
+        Use polling even where inotify is available
+    interval : float, optional
+        Polling interval in seconds
+    rescan : float, optional
+        Seconds between checks of the registry for new environments
+    stop : threading.Event, optional
+        Ends the loop when set (default: run until interrupted)
+    refresh : callable, optional
+        Called as refresh(env_dir, log=log) in the background thread
+    log : callable, optional
+        Called with progress messages
+    """
+    stop = stop or threading.Event()
+    watcher = make_watcher(poll, interval)
+    debouncer = Debouncer(delay)
+    refresher = Refresher(refresh, log)
+    refresher.start()
+    last_scan = None
+    try:
+        while not stop.is_set():
+            now = time.time()
+            if last_scan is None or now - last_scan >= rescan:
+                for env_dir in registry.managed_envs():
+                    watcher.watch(env_dir)
+                last_scan = now
+            for env_dir in watcher.wait(debouncer.next_timeout(min(rescan, 1.0))):
+                debouncer.add(env_dir)
+                # Pick up watch paths created by the change, e.g. activate.d
+                watcher.watch(env_dir)
+            for env_dir in debouncer.ready():
+                refresher.submit(env_dir)
+    finally:
+        refresher.stop()
+        refresher.join()
+        watcher.close()
@@ -14,7 +14,8 @@ setup_args = dict(
     platforms=['Linux', 'Mac OSX'],
     packages=['kernda'],
     entry_points={
-        'console_scripts': ['kernda = kernda.cli:cli']
+        'console_scripts': ['kernda = kernda.cli:cli'],
+        'conda': ['kernda = kernda.conda_plugin'],
     }
 )
 
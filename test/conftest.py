@@ -0,0 +1,29 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """Keep snapshots and state out of the user's directories."""
+    monkeypatch.setenv('KERNDA_CACHE_DIR', str(tmpdir.join('cache')))
+    monkeypatch.setenv('KERNDA_STATE_DIR', str(tmpdir.join('state')))
+    return tmpdir.join('cache')
+
+
+@pytest.fixture
+def venv(tmpdir):
+    """Create a bare virtual environment with a kernel spec pointing at it."""
+    env_dir = str(tmpdir.join('venv'))
+    subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip', env_dir])
+    spec_path = tmpdir.join('kernel.json')
+    spec_path.write(json.dumps({
+        'argv': [os.path.join(env_dir, 'bin', 'python'), '-c',
+                 'import os; print(os.environ["VIRTUAL_ENV"])'],
+        'display_name': 'venv',
+        'language': 'python',
+    }))
+    return env_dir, str(spec_path)
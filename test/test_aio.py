@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from kernda import aio
+from kernda.api import KerndaError, build_spec, read_spec
+from kernda.backends import Backend
+
+
+class SlowBackend(Backend):
+    """Backend whose activation takes far too long."""
+    name = 'slow'
+
+    def detect(self, env_dir):
+        return False
+
+    def activate_command(self, env_dir, **options):
+        return 'sleep 30'
+
+
+def run(coro):
+    return asyncio.get_event_loop_policy().new_event_loop().run_until_complete(coro)
+
+
+def test_async_build_and_write(venv, tmpdir):
+    env_dir, spec_path = venv
+
+    async def go():
+        spec = await aio.read_spec(spec_path)
+        results = await asyncio.gather(*[
+            aio.build_spec(spec, start_args='--n={}'.format(i), timeout=30)
+            for i in range(8)])
+        out = str(tmpdir.join('out.json'))
+        await aio.write_spec(out, results[0].spec)
+        return results, out
+
+    results, out = run(go())
+    assert [r.spec['argv'][-1] for r in results] == ['--n={}'.format(i) for i in range(8)]
+    assert read_spec(out) == results[0].spec
+
+
+def test_async_capture_timeout(tmpdir):
+    start = time.time()
+    with pytest.raises(asyncio.TimeoutError):
+        run(aio.capture(SlowBackend(), str(tmpdir), timeout=0.5))
+    assert time.time() - start < 10
+
+
+def test_async_capture_cancel(tmpdir):
+    async def go():
+        task = asyncio.ensure_future(aio.capture(SlowBackend(), str(tmpdir)))
+        await asyncio.sleep(0.5)
+        task.cancel()
+        await task
+
+    start = time.time()
+    with pytest.raises(asyncio.CancelledError):
+        run(go())
+    assert time.time() - start < 10
+
+
+def test_async_build_failing_activation(venv):
+    env_dir, spec_path = venv
+    with open(os.path.join(env_dir, 'bin', 'activate'), 'w') as f:
+        f.write('exit 3\n')
+    spec = read_spec(spec_path)
+    # Modules make the venv backend capture its activation in a shell
+    with pytest.raises(KerndaError) as sync_error:
+        build_spec(spec, modules=['nope'])
+    with pytest.raises(KerndaError) as async_error:
+        run(aio.build_spec(spec, modules=['nope'], timeout=30))
+    assert str(async_error.value) == str(sync_error.value)
+    assert async_error.value.hint == sync_error.value.hint
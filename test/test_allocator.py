@@ -0,0 +1,87 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from kernda import allocator
+from kernda.api import KerndaError, build_spec, read_spec
+from kernda.cli import cli
+
+
+def test_check_allocator(tmpdir):
+    env_dir = str(tmpdir)
+    assert allocator.find_preload('jemalloc', env_dir) is None
+    assert allocator.find_preload('compact', env_dir) is None
+    assert allocator.check_allocator('default', env_dir) == 'default: no changes'
+    assert allocator.check_allocator('compact', env_dir) == (
+        'compact: MALLOC_ARENA_MAX=2, MALLOC_TRIM_THRESHOLD_=131072')
+    with pytest.raises(KerndaError) as e:
+        allocator.check_allocator('jemalloc', env_dir)
+    assert 'conda install' in e.value.hint
+    with pytest.raises(KerndaError):
+        allocator.check_allocator('mimalloc', env_dir)
+
+    tmpdir.mkdir('lib').join('libjemalloc.so.2').write('')
+    lib = os.path.join(env_dir, 'lib', 'libjemalloc.so.2')
+    assert allocator.find_preload('jemalloc', env_dir) == lib
+    assert allocator.check_allocator('jemalloc', env_dir).startswith(
+        'jemalloc: LD_PRELOAD={}'.format(lib))
+
+
+def test_allocator_env(tmpdir):
+    env = allocator.allocator_env({'MALLOC_ARENA_MAX': '4'}, 'compact', None)
+    # Variables the user set win
+    assert env == {'MALLOC_ARENA_MAX': '4', 'MALLOC_TRIM_THRESHOLD_': '131072'}
+
+    tmpdir.mkdir('lib').join('libtcmalloc.so.4').write('')
+    lib = os.path.join(str(tmpdir), 'lib', 'libtcmalloc.so.4')
+    env = allocator.allocator_env({'LD_PRELOAD': '/other.so'}, 'tcmalloc', str(tmpdir))
+    assert env['LD_PRELOAD'] == '{} /other.so'.format(lib)
+    with pytest.raises(KerndaError):
+        allocator.allocator_env({}, 'jemalloc', str(tmpdir))
+
+
+def test_measure(venv, tmpdir):
+    env_dir, _ = venv
+    workload = 'data = [bytearray(4096) for i in range(1000)]'
+    results = allocator.measure(env_dir, ['default', 'compact', 'jemalloc'], workload,
+                                repeat=1, settle=0)
+    assert [r['profile'] for r in results] == ['default', 'compact', 'jemalloc']
+    for result in results[:2]:
+        assert result['error'] is None
+        # What the workload keeps is still resident
+        assert result['rss'] > 4096 * 1000
+        assert result['peak'] >= result['rss']
+    assert 'not installed' in results[2]['error']
+    with pytest.raises(KerndaError):
+        allocator.measure(os.path.join(env_dir, 'nope'))
+
+    tmpdir.join('workload.py').write(workload)
+    assert cli(['allocators', env_dir, '--profile', 'default', '--workload',
+                str(tmpdir.join('workload.py')), '--repeat', '1', '--settle', '0']) == 0
+    assert cli(['allocators', env_dir, '--workload', str(tmpdir.join('nope.py'))]) == 1
+
+
+def test_launch_allocator(venv):
+    env_dir, spec_path = venv
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--allocator', 'compact', '--',
+         sys.executable, '-c', 'import os; print(os.environ["MALLOC_ARENA_MAX"])'])
+    assert out.strip() == b'2'
+
+    spec, _ = build_spec(read_spec(spec_path), mode='direct',
+                         launcher_options={'allocator': 'compact'})
+    assert spec['_kernda_limits']['allocator'].startswith('compact: ')
+    assert spec['argv'][spec['argv'].index('--allocator') + 1] == 'compact'
+    with pytest.raises(KerndaError):
+        build_spec(read_spec(spec_path), mode='direct',
+                   launcher_options={'allocator': 'jemalloc'})
+    # Only the kernel gets the allocator, not bash and the activation
+    with pytest.raises(KerndaError):
+        build_spec(read_spec(spec_path), mode='source',
+                   launcher_options={'allocator': 'compact'})
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--allocator', 'compact', '--mode', 'source',
+         '--', sys.executable, '-c', 'import os; print("MALLOC_ARENA_MAX" in os.environ)'])
+    assert out.strip() == b'False'
@@ -0,0 +1,32 @@
+import glob
+import os
+
+from kernda.analyze import analyze, format_analysis
+from kernda.cli import cli
+
+
+def test_analyze(venv, tmpdir):
+    env_dir, _ = venv
+    site_packages, = glob.glob(os.path.join(env_dir, 'lib', 'python*', 'site-packages'))
+    extra = tmpdir.mkdir('extra')
+    with open(os.path.join(site_packages, 'extra.pth'), 'w') as f:
+        f.write('{}\n{}\n'.format(extra, tmpdir.join('missing')))
+    with open(os.path.join(site_packages, 'hook.pth'), 'w') as f:
+        f.write('import os\n')
+
+    analysis = analyze(env_dir, repeat=1)
+    assert analysis['python'] == os.path.join(env_dir, 'bin', 'python')
+    assert analysis['pth_count'] == 2
+    pth = dict((os.path.basename(p['path']), p) for p in analysis['pth'])
+    # Directories that do not exist are not added
+    assert pth['extra.pth']['paths_added'] == 1
+    assert not pth['extra.pth']['executes']
+    assert pth['hook.pth']['executes']
+    assert str(extra) in [e['path'] for e in analysis['entries']]
+    frozen, = [s for s in analysis['savings'] if s['option'] == 'frozen sys.path']
+    assert not frozen['safe']
+    assert frozen['executes'] == [os.path.join(site_packages, 'hook.pth')]
+    assert any('extra.pth' in line for line in format_analysis(analysis))
+
+    assert cli(['analyze-env', env_dir, '--repeat', '1', '--json']) == 0
+    assert cli(['analyze-env', str(tmpdir.join('nope'))]) == 1
@@ -0,0 +1,68 @@
+import os
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from kernda.api import (KerndaError, build_spec, is_kernda_spec, read_spec,
+                        rebuild_spec, write_spec)
+
+
+def test_build_spec_in_memory(venv, capsys):
+    env_dir, spec_path = venv
+    spec = read_spec(spec_path)
+    result = build_spec(spec, mode='snapshot', display_name='Py',
+                        launcher_options={'normalize': True})
+    # No output and the input spec is untouched
+    assert capsys.readouterr() == ('', '')
+    assert not is_kernda_spec(spec)
+    assert is_kernda_spec(result.spec)
+    assert result.spec['display_name'] == 'Py'
+    assert '--normalize' in result.spec['argv']
+    levels = set(diag['level'] for diag in result.diagnostics)
+    assert levels == set(['info'])
+    assert any('report' in diag for diag in result.diagnostics)
+
+    # Rebuilding keeps the options and reuses the cached snapshot
+    again = rebuild_spec(result.spec)
+    assert again.spec['argv'] == result.spec['argv']
+    assert any(diag.get('cache_hit') for diag in again.diagnostics)
+
+
+def test_build_spec_threads(venv):
+    env_dir, spec_path = venv
+    spec = read_spec(spec_path)
+    pool = ThreadPool(8)
+    try:
+        results = pool.map(lambda i: build_spec(spec, start_args='--n={}'.format(i)),
+                           range(32))
+    finally:
+        pool.close()
+    assert [r.spec['argv'][-1] for r in results] == ['--n={}'.format(i) for i in range(32)]
+
+
+def test_build_spec_errors(venv, tmpdir):
+    env_dir, spec_path = venv
+    spec = read_spec(spec_path)
+    with pytest.raises(KerndaError):
+        build_spec(spec, env_dir=str(tmpdir.join('missing')))
+    with pytest.raises(KerndaError):
+        build_spec(spec, backend='nope')
+    with pytest.raises(KerndaError):
+        build_spec(spec, mode='direct', modules=['gcc'])
+
+
+def test_write_spec(venv, tmpdir):
+    env_dir, spec_path = venv
+    result = build_spec(read_spec(spec_path))
+    out = str(tmpdir.join('out', 'kernel.json'))
+    umask = os.umask(0o022)
+    try:
+        write_spec(out, result.spec)
+    finally:
+        os.umask(umask)
+    assert read_spec(out) == result.spec
+    # New specs are readable by other users, rewrites keep the permissions
+    assert os.stat(out).st_mode & 0o777 == 0o644
+    os.chmod(out, 0o640)
+    write_spec(out, result.spec)
+    assert os.stat(out).st_mode & 0o777 == 0o640
@@ -0,0 +1,60 @@
+import json
+import os
+import subprocess
+
+from kernda.backends import detect_backend, get_backend, load_backends
+from kernda.cli import cli
+from kernda.environ import apply_env_diff, diff_env
+
+
+def test_diff_roundtrip():
+    before = {'PATH': '/usr/bin:/bin', 'HOME': '/root', 'GONE': '1'}
+    after = {'PATH': '/env/bin:/usr/bin:/bin', 'HOME': '/root', 'NEW': 'x'}
+    diff = diff_env(before, after)
+    assert diff == {'set': {'NEW': 'x'}, 'unset': ['GONE'],
+                    'prepend': {'PATH': ['/env/bin']}}
+    # Prepends apply on top of a different base PATH
+    env = apply_env_diff(diff, {'PATH': '/opt/bin', 'GONE': '1'})
+    assert env == {'PATH': '/env/bin:/opt/bin', 'NEW': 'x'}
+
+
+def test_builtin_backends():
+    assert set(['conda', 'venv', 'pixi']) <= set(load_backends())
+
+
+def test_detect(venv, tmpdir):
+    env_dir, _ = venv
+    assert detect_backend(env_dir).name == 'venv'
+    pixi_env = tmpdir.mkdir('proj').mkdir('.pixi').mkdir('envs').mkdir('default')
+    pixi_env.mkdir('conda-meta')
+    assert detect_backend(str(pixi_env)).name == 'pixi'
+    conda_env = tmpdir.mkdir('conda-env')
+    conda_env.mkdir('conda-meta')
+    assert detect_backend(str(conda_env)).name == 'conda'
+
+
+def test_venv_snapshot_launch(venv, cache_dir):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path]) == 0
+    with open(spec_path) as f:
+        spec = json.load(f)
+    assert spec['_kernda_backend'] == 'venv'
+    assert spec['_kernda_mode'] == 'snapshot'
+    assert spec['argv'][1:3] == ['-m', 'kernda.launch']
+    assert cache_dir.join('snapshots').listdir()
+    out = subprocess.check_output(spec['argv']).decode('utf8')
+    assert out.strip() == os.path.abspath(env_dir)
+
+
+def test_unsupported_mode(venv):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path, '--backend', 'conda', '--mode', 'direct']) == 1
+    assert cli(['-o', spec_path, '--backend', 'nope']) == 1
+
+
+def test_source_mode_matches_template(venv):
+    env_dir, _ = venv
+    argv = get_backend('venv').launch_argv(env_dir, ['python'], mode='source',
+                                           start_args='--debug')
+    assert argv[:2] == ['bash', '-c']
+    assert argv[2].endswith('&& exec python --debug')
@@ -0,0 +1,69 @@
+import json
+import os
+import sys
+
+import pytest
+
+from kernda import check
+from kernda.cli import cli
+
+
+def test_select_specs():
+    specs = {'py3': '/a', 'py3-gpu': '/b', 'ir': '/c'}
+    assert check.select_specs(specs) == ['ir', 'py3', 'py3-gpu']
+    assert check.select_specs(specs, ['py3*']) == ['py3', 'py3-gpu']
+    assert check.select_specs(specs, ['nope']) == []
+
+
+def test_evaluate(tmpdir):
+    prefix = str(tmpdir)
+    ok = check.evaluate({'ready_s': 1.0, 'prefix': prefix, 'expected_prefix': prefix,
+                         'error': None}, budget=2.0)
+    assert ok['ok']
+    slow = check.evaluate({'ready_s': 3.0, 'prefix': prefix, 'expected_prefix': prefix,
+                           'error': None}, budget=2.0)
+    assert not slow['ok'] and 'budget' in slow['reason']
+    wrong = check.evaluate({'ready_s': 1.0, 'prefix': '/usr', 'expected_prefix': prefix,
+                            'error': None})
+    assert not wrong['ok'] and 'instead of' in wrong['reason']
+    failed = check.evaluate({'ready_s': None, 'prefix': None, 'expected_prefix': prefix,
+                             'error': 'RuntimeError: dead'})
+    assert failed['reason'] == 'RuntimeError: dead'
+    assert check.summarize([ok, slow, wrong, failed]) == {
+        'checked': 4, 'failed': 3, 'slowest_s': 3.0}
+
+
+def test_expected_prefix(venv):
+    env_dir, spec_path = venv
+    with open(spec_path) as f:
+        spec = json.load(f)
+    assert check.expected_prefix(spec) == env_dir
+    assert check.expected_prefix(dict(spec, _kernda_env_dir='/opt/env')) == '/opt/env'
+
+
+def test_check_kernels(tmpdir):
+    pytest.importorskip('jupyter_client')
+    pytest.importorskip('ipykernel')
+    kernel_dir = tmpdir.mkdir('kernels').mkdir('kernda-test')
+    kernel_dir.join('kernel.json').write(json.dumps({
+        'argv': [sys.executable, '-m', 'ipykernel_launcher', '-f', '{connection_file}'],
+        'display_name': 'test', 'language': 'python'}))
+    result, = check.check(specs={'kernda-test': str(kernel_dir)}, budget=60)
+    assert result['ok'], result
+    assert os.path.realpath(result['prefix']) == os.path.realpath(sys.prefix)
+
+
+def test_check_kernel_failed_start(tmpdir, monkeypatch):
+    pytest.importorskip('jupyter_client')
+    from jupyter_client.manager import KernelManager
+
+    def fail(self, *args, **kwargs):
+        raise RuntimeError('no kernel')
+    monkeypatch.setattr(KernelManager, 'start_kernel', fail)
+    monkeypatch.setattr(KernelManager, 'shutdown_kernel', fail)
+    kernel_dir = tmpdir.mkdir('kernels').mkdir('broken')
+    kernel_dir.join('kernel.json').write(json.dumps({
+        'argv': ['false'], 'display_name': 'broken', 'language': 'python'}))
+    result, = check.check(specs={'broken': str(kernel_dir)})
+    assert not result['ok']
+    assert result['reason'] == 'RuntimeError: no kernel'
@@ -0,0 +1,29 @@
+import subprocess
+
+from kernda import api, registry
+from kernda.api import read_spec
+from kernda.cli import cli
+from kernda.conda_plugin import refresh_prefix
+
+
+def test_unmanaged_prefix_is_cheap(tmpdir, monkeypatch):
+    def fail(*args, **kwargs):
+        raise AssertionError('unexpected call')
+
+    # Nothing runs and the registry is only read
+    for name in ('Popen', 'check_output', 'check_call', 'call', 'run'):
+        monkeypatch.setattr(subprocess, name, fail)
+    monkeypatch.setattr(registry, '_save', fail)
+    monkeypatch.setattr(api, 'refresh_specs', fail)
+    assert refresh_prefix(str(tmpdir)) == {}
+
+
+def test_refreshes_managed_specs(venv, capsys):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path, '--normalize']) == 0
+    capsys.readouterr()
+    results = refresh_prefix(env_dir)
+    assert list(results) == [spec_path]
+    assert results[spec_path]['ok']
+    assert '--normalize' in read_spec(spec_path)['argv']
+    assert 'kernda: refreshed' in capsys.readouterr().err
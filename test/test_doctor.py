@@ -0,0 +1,46 @@
+import json
+import os
+
+from kernda.api import read_spec
+from kernda.cli import cli
+from kernda.doctor import diagnose, format_phases, kernel_module
+
+
+def test_kernel_module():
+    assert kernel_module(['python', '-m', 'ipykernel_launcher', '-f', 'c']) == \
+        'ipykernel_launcher'
+    assert kernel_module(['python', '-c', 'pass']) is None
+
+
+def test_doctor_source_mode(venv, capsys):
+    env_dir, spec_path = venv
+    hook_dir = os.path.join(env_dir, 'etc', 'conda', 'activate.d')
+    os.makedirs(hook_dir)
+    with open(os.path.join(hook_dir, 'slow.sh'), 'w') as f:
+        f.write('sleep 0.2\n')
+    with open(os.path.join(env_dir, 'bin', 'activate'), 'a') as f:
+        f.write('. "$VIRTUAL_ENV/etc/conda/activate.d/slow.sh"\n')
+    assert cli(['-o', spec_path, '--mode', 'source']) == 0
+
+    phases = diagnose(read_spec(spec_path), repeat=1)
+    by_name = dict((p['phase'], p) for p in phases)
+    # The slow hook ranks first and is paid on every source mode start
+    assert phases[0]['phase'] == 'hook slow.sh'
+    assert phases[0]['ms'] >= 200
+    assert phases[0]['per_launch']
+    assert 'snapshot' in phases[0]['advice']
+    assert by_name['bash startup']['per_launch']
+    assert by_name['interpreter startup']['per_launch']
+    assert not by_name['kernda launcher']['per_launch']
+    assert format_phases(phases)[1].split()[1:3] == ['hook', 'slow.sh']
+
+    # In snapshot mode activation is only paid on captures
+    capsys.readouterr()
+    assert cli(['-o', spec_path, '--mode', 'snapshot']) == 0
+    capsys.readouterr()
+    assert cli(['doctor', spec_path, '--repeat', '1', '--json']) == 0
+    by_name = dict((p['phase'], p) for p in json.loads(capsys.readouterr().out))
+    assert not by_name['hook slow.sh']['per_launch']
+    assert by_name['kernda launcher']['per_launch']
+
+    assert cli(['doctor', spec_path + '.missing']) == 1
@@ -0,0 +1,64 @@
+import json
+import os
+import subprocess
+
+from kernda.cli import cli
+from kernda.environ import env_size, format_report, normalize_env
+
+
+def test_normalize_dedupes_and_prunes(tmpdir):
+    a = str(tmpdir.mkdir('a'))
+    b = str(tmpdir.mkdir('b'))
+    missing = str(tmpdir.join('missing'))
+    env = {
+        'PATH': os.pathsep.join([a, b, a, missing, 'relative', b]),
+        'LD_LIBRARY_PATH': os.pathsep.join([missing, b]),
+        'HOME': '/root',
+    }
+    normalized, report = normalize_env(env)
+    assert normalized['PATH'] == os.pathsep.join([a, b, 'relative'])
+    assert normalized['LD_LIBRARY_PATH'] == b
+    assert [item['step'] for item in report] == ['dedupe', 'missing']
+    assert report[0]['removed'] == 2
+    assert report[1]['removed'] == 2
+    assert sum(item['bytes'] for item in report) == env_size(env) - env_size(normalized)
+    # The input is left alone
+    assert env['PATH'].count(a) == 2
+    assert format_report(report, env_size(env))[-1].strip().startswith('total')
+
+
+def test_normalize_optional_steps():
+    env = {
+        'PATH': os.pathsep.join(['/nfs/tools/bin', '/usr/bin']),
+        'LD_LIBRARY_PATH': os.pathsep.join(['/lib'] * 30),
+        'GITHUB_TOKEN': 'x',
+        'BIG': 'y' * 100,
+        'KEPT_SECRET': 'z',
+    }
+    normalized, report = normalize_env(env, prune_missing=False,
+                                       prune_prefixes=['/nfs/'],
+                                       max_value_size=50, drop_secrets=True,
+                                       keep=['KEPT_SECRET'])
+    # PATH-like variables are deduped rather than dropped for their size
+    assert normalized == {'PATH': '/usr/bin', 'LD_LIBRARY_PATH': '/lib', 'KEPT_SECRET': 'z'}
+    assert [item['step'] for item in report] == ['dedupe', 'prefix', 'oversized', 'secrets']
+    normalized, _ = normalize_env(env, prune_missing=False, max_value_size=5)
+    assert normalized['PATH'] == env['PATH']
+
+
+def test_launcher_normalizes(venv, tmpdir, monkeypatch):
+    env_dir, spec_path = venv
+    monkeypatch.setenv('PATH', os.pathsep.join(
+        [os.environ['PATH'], str(tmpdir.join('missing')), os.environ['PATH']]))
+    monkeypatch.setenv('SOME_API_KEY', 'hunter2')
+    assert cli(['-o', spec_path, '--mode', 'direct', '--normalize', '--drop-secrets']) == 0
+    with open(spec_path) as f:
+        spec = json.load(f)
+    assert spec['argv'][1:3] == ['-m', 'kernda.launch']
+    assert '--backend' not in spec['argv']
+    spec['argv'][-1] = 'import json, os; print(json.dumps(dict(os.environ)))'
+    env = json.loads(subprocess.check_output(spec['argv']).decode('utf8'))
+    entries = env['PATH'].split(os.pathsep)
+    assert len(entries) == len(set(entries))
+    assert str(tmpdir.join('missing')) not in entries
+    assert 'SOME_API_KEY' not in env
@@ -0,0 +1,64 @@
+import json
+import subprocess
+import time
+
+import pytest
+
+from kernda import history
+from kernda.api import read_spec
+from kernda.cli import cli
+
+
+def test_launch_stats(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    for i in range(1, 101):
+        history.record({'time': 1000.0 + i, 'exec': 1000.0 + i + i / 1000.0,
+                        'spec': 'a' if i % 2 else 'b', 'host': 'h', 'mode': 'snapshot',
+                        'activation_ms': float(i), 'cache_hit': i > 10}, path)
+
+    a, b = history.launch_stats(group_by=['spec'], path=path)
+    assert (a['spec'], a['count'], b['spec'], b['count']) == ('a', 50, 'b', 50)
+    total, = history.launch_stats(group_by=['host', 'mode'], path=path)
+    assert total['count'] == 100
+    assert total['activation']['p50_ms'] == 50.0
+    assert total['activation']['p95_ms'] == 95.0
+    assert total['activation']['p99_ms'] == 99.0
+    assert abs(total['launch']['p99_ms'] - 99.0) < 1e-3
+    assert total['cache_hit_rate'] == 0.9
+    # Time window
+    recent, = history.launch_stats(since=1091.0, group_by=[], path=path)
+    assert recent['count'] == 10
+    with pytest.raises(ValueError):
+        history.launch_stats(group_by=['nope'], path=path)
+
+
+def test_parse_window():
+    assert history.parse_window('90') == 90
+    assert history.parse_window('30m') == 1800
+    assert history.parse_window('1.5h') == 5400
+    assert history.parse_window('7d') == 7 * 86400
+    with pytest.raises(ValueError):
+        history.parse_window('soon')
+
+
+def test_launcher_records_history(venv, capsys):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path, '--mode', 'snapshot']) == 0
+    subprocess.check_output(read_spec(spec_path)['argv'])
+    capsys.readouterr()
+
+    # The row is written by a process detached from the kernel start
+    for _ in range(50):
+        assert cli(['stats', '--json', '--group-by', 'env,mode']) == 0
+        stats = json.loads(capsys.readouterr().out)
+        if stats['groups']:
+            break
+        time.sleep(0.1)
+    group, = stats['groups']
+    assert (group['env'], group['mode'], group['count']) == (env_dir, 'snapshot', 1)
+    assert group['activation']['p50_ms'] <= group['launch']['p50_ms']
+
+    assert cli(['stats', '--group-by', 'env']) == 0
+    out = capsys.readouterr().out
+    assert env_dir in out
+    assert cli(['stats', '--since', 'soon']) == 1
@@ -0,0 +1,108 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from kernda import pycache
+from kernda.api import read_spec
+from kernda.cli import cli
+from kernda.launch import add_launcher_arguments
+from kernda.launchlog import read_launches, record_launch, trace_timings
+from kernda.placement import POLICIES
+from kernda.profile import PROFILE_MODES
+from kernda.resources import PRIORITY_TIERS
+
+TRACE = """+100.000 source /env/bin/activate
+++100.010 __conda_activate activate /env
++++100.020 . /env/etc/conda/activate.d/slow.sh
+++++100.030 sleep 1
+++++101.030 export SLOW=1
++++101.040 . '/env/etc/conda/activate.d/with space.sh'
+++101.060 export PATH=/env/bin:/usr/bin
++101.070 exec python -m ipykernel_launcher -f conn.json
+"""
+
+
+def test_trace_timings():
+    timings = trace_timings(TRACE.splitlines())
+    assert timings['shell_start'] == 100.0
+    assert timings['exec'] == 101.07
+    hooks = timings['hooks']
+    assert [h['path'] for h in hooks] == ['/env/etc/conda/activate.d/slow.sh',
+                                          '/env/etc/conda/activate.d/with space.sh']
+    assert abs(hooks[0]['ms'] - 1020.0) < 1e-6
+    assert abs(hooks[1]['ms'] - 20.0) < 1e-6
+    # Without a timestamp in PS4 nothing can be timed
+    assert trace_timings(['+ exec python']) == {'shell_start': None, 'exec': None,
+                                                'hooks': []}
+
+
+def test_rotation(tmpdir):
+    path = str(tmpdir.join('launches.jsonl'))
+    for i in range(12):
+        record_launch({'i': i, 'padding': 'x' * 100}, path, limit=500)
+    assert os.path.exists(path + '.1')
+    assert os.path.exists(path + '.2')
+    assert not os.path.exists(path + '.3')
+    assert os.path.getsize(path) < 500
+    # Nothing is lost between the current and the first rotated log
+    seen = [r['i'] for r in read_launches(path + '.1') + read_launches(path)]
+    assert seen == list(range(seen[0], 12))
+
+
+def test_source_mode_timing(venv, tmpdir):
+    env_dir, spec_path = venv
+    hook_dir = os.path.join(env_dir, 'etc', 'conda', 'activate.d')
+    os.makedirs(hook_dir)
+    with open(os.path.join(hook_dir, 'hook.sh'), 'w') as f:
+        f.write('sleep 0.1\n')
+    with open(os.path.join(env_dir, 'bin', 'activate'), 'a') as f:
+        f.write('. "$VIRTUAL_ENV/etc/conda/activate.d/hook.sh"\n')
+    log = str(tmpdir.join('timing.jsonl'))
+
+    assert cli(['-o', spec_path, '--mode', 'source', '--timing',
+                '--launch-log', log]) == 0
+    proc = subprocess.Popen(read_spec(spec_path)['argv'], stdout=subprocess.PIPE)
+    assert proc.communicate()[0].decode('utf8').strip() == env_dir
+
+    # The record is written by a detached reader of the activation trace
+    for _ in range(50):
+        records = read_launches(log)
+        if records:
+            break
+        time.sleep(0.1)
+    record, = records
+    assert record['pid'] == proc.pid
+    assert record['mode'] == 'source'
+    assert record['env_dir'] == env_dir
+    assert record['time'] <= record['shell_start'] <= record['activated'] == record['exec']
+    hook, = record['hooks']
+    assert hook['path'] == os.path.join(hook_dir, 'hook.sh')
+    assert hook['ms'] >= 100
+
+
+def test_launcher_imports(tmpdir):
+    # Modules of launcher options are only imported when an option is set
+    code = ('import os, sys; from kernda import launch; '
+            'launch.detach = lambda *args, **kwargs: None; '
+            'os.execvpe = lambda *args: print(sorted(m for m in sys.modules if m in '
+            '("kernda.placement", "kernda.profile", "kernda.pycache", '
+            '"kernda.resources", "kernda.tracing"))); '
+            'launch.main(sys.argv[1:])')
+    out = subprocess.check_output([sys.executable, '-c', code, '--launch-log',
+                                   str(tmpdir.join('launches.jsonl')), '--', 'true'])
+    assert out.strip() == b'[]'
+
+
+def test_launcher_option_values():
+    # The launcher spells these out so it need not import their modules
+    parser = argparse.ArgumentParser()
+    actions = dict((a.dest, a) for a in add_launcher_arguments(parser))
+    assert actions['profile'].choices == PROFILE_MODES
+    assert actions['placement'].choices == POLICIES
+    assert list(actions['priority'].choices) == sorted(PRIORITY_TIERS)
+    assert actions['pycache_max_age'].default == pycache.MAX_AGE_DAYS
+    assert actions['pycache_max_size'].default == pycache.MAX_SIZE
+    args = parser.parse_args(['--thread-cap', 'auto', '--memory-max', '1G'])
+    assert (args.thread_cap, args.memory_max) == ('auto', 1024 ** 3)
@@ -0,0 +1,82 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from kernda import history, loadtest
+from kernda.api import read_spec
+
+
+def test_arrival_offsets():
+    assert loadtest.arrival_offsets(3) == [0.0, 0.0, 0.0]
+    assert loadtest.arrival_offsets(3, rate=2) == [0.0, 0.5, 1.0]
+    offsets = loadtest.arrival_offsets(50, rate=10, poisson=True, seed=1)
+    assert offsets == sorted(offsets) and offsets[0] == 0.0
+    assert offsets == loadtest.arrival_offsets(50, rate=10, poisson=True, seed=1)
+
+
+def test_replay_offsets(tmpdir):
+    path = str(tmpdir.join('history.sqlite'))
+    for t, spec in [(100.0, 'a'), (101.0, 'b'), (103.0, 'a'), (107.0, 'a')]:
+        history.record({'time': t, 'spec': spec}, path)
+    assert loadtest.replay_offsets('a', path=path) == [0.0, 3.0, 7.0]
+    assert loadtest.replay_offsets(path=path, limit=2, speedup=2.0) == [0.0, 0.5]
+    assert loadtest.replay_offsets(since=102.0, path=path) == [0.0, 4.0]
+
+
+def test_build_mode_specs(venv, tmpdir):
+    env_dir, spec_path = venv
+    directory = str(tmpdir.mkdir('kernels'))
+    spec = read_spec(spec_path)
+    spec['_kernda_options'] = {'launcher_options': {'prom_file': '/metrics/kernda.prom',
+                                                    'profile': 'importtime'}}
+    names = loadtest.build_mode_specs(spec, ['source', 'direct'], directory)
+    assert names == {'source': 'loadtest-source', 'direct': 'loadtest-direct'}
+    with open(tmpdir.join('kernels', 'loadtest-direct', 'kernel.json').strpath) as f:
+        spec = json.load(f)
+    assert spec['_kernda_mode'] == 'direct'
+    assert spec['argv'][1:3] == ['-m', 'kernda.launch']
+    assert spec['_kernda_options']['launcher_options']['launch_log'] == \
+        tmpdir.join('kernels', 'launches.jsonl').strpath
+    assert '--prom-file' not in spec['argv'] and '--profile' not in spec['argv']
+    assert spec['env']['KERNDA_HISTORY'] == tmpdir.join('kernels', 'history.sqlite').strpath
+    assert spec['env']['KERNDA_PROM_FILE'] == ''
+    assert '--timing' not in spec['argv']
+    with open(tmpdir.join('kernels', 'loadtest-source', 'kernel.json').strpath) as f:
+        assert '--timing' in json.load(f)['argv']
+
+
+def test_summarize():
+    results = [
+        {'in_flight': 1, 'ready_ms': 100.0, 'pid': 1, 'error': None},
+        {'in_flight': 2, 'ready_ms': 300.0, 'pid': 2, 'error': None},
+        {'in_flight': 2, 'ready_ms': None, 'pid': 3, 'error': 'RuntimeError: timeout'},
+    ]
+    loadtest.add_activation(results, [{'pid': 1, 'time': 10.0, 'exec': 10.05,
+                                       'activation_ms': 40.0},
+                                      {'pid': 2, 'time': 10.0, 'activation_ms': 90.0}])
+    assert [r['activation_ms'] for r in results] == [40.0, 90.0, None]
+    assert abs(results[0]['launch_ms'] - 50.0) < 1e-6
+    summary = loadtest.summarize(results)
+    assert (summary['count'], summary['failed']) == (3, 1)
+    assert summary['ready']['max_ms'] == 300.0
+    one, two = summary['by_concurrency']
+    assert (one['in_flight'], one['count'], one['activation']['p50_ms']) == (1, 1, 40.0)
+    assert (two['in_flight'], two['count'], two['failed']) == (2, 2, 1)
+
+
+def test_run(tmpdir):
+    pytest.importorskip('jupyter_client')
+    pytest.importorskip('ipykernel')
+    # A virtualenv activates without conda and sees this ipykernel
+    env_dir = str(tmpdir.join('venv'))
+    subprocess.check_call([sys.executable, '-m', 'venv', '--without-pip',
+                           '--system-site-packages', env_dir])
+    spec = {'argv': [os.path.join(env_dir, 'bin', 'python'), '-m', 'ipykernel_launcher',
+                     '-f', '{connection_file}'],
+            'display_name': 'test', 'language': 'python'}
+    report = loadtest.run(spec, ['direct'], loadtest.arrival_offsets(2))
+    assert report['direct']['count'] == 2
+    assert report['direct']['failed'] == 0
@@ -0,0 +1,43 @@
+import os
+import subprocess
+import time
+
+from kernda import metrics
+from kernda.api import read_spec
+from kernda.cli import cli
+
+
+def test_render_histograms_and_counters(tmpdir):
+    path = str(tmpdir.join('textfile', 'kernda.prom'))
+    for ms, hit in [(3.0, True), (40.0, True), (2000.0, False)]:
+        metrics.record({'time': 10.0, 'exec': 10.0 + ms / 1000.0 + 0.001, 'spec': 'py"3',
+                        'mode': 'snapshot', 'activation_ms': ms, 'cache_hit': hit}, path)
+    text = open(path).read()
+    assert oct(os.stat(path).st_mode & 0o777) == oct(0o644)
+    labels = 'spec="py\\"3",mode="snapshot"'
+    assert 'kernda_activation_seconds_bucket{%s,le="0.005"} 1' % labels in text
+    assert 'kernda_activation_seconds_bucket{%s,le="0.05"} 2' % labels in text
+    assert 'kernda_activation_seconds_bucket{%s,le="+Inf"} 3' % labels in text
+    assert 'kernda_activation_seconds_count{%s} 3' % labels in text
+    assert 'kernda_launch_seconds_count{%s} 3' % labels in text
+    assert 'kernda_snapshot_cache_total{%s,result="hit"} 2' % labels in text
+    assert 'kernda_snapshot_cache_total{%s,result="miss"} 1' % labels in text
+    assert '# TYPE kernda_activation_seconds histogram' in text
+    # Only the .prom file is picked up by node_exporter
+    assert sorted(f for f in os.listdir(os.path.dirname(path)) if f.endswith('.prom')) == \
+        ['kernda.prom']
+
+
+def test_launcher_updates_prom_file(venv, tmpdir):
+    env_dir, spec_path = venv
+    path = str(tmpdir.join('kernda.prom'))
+    assert cli(['-o', spec_path, '--mode', 'snapshot', '--prom-file', path]) == 0
+    argv = read_spec(spec_path)['argv']
+    subprocess.check_output(argv)
+    subprocess.check_output(argv)
+    for _ in range(50):
+        if os.path.exists(path) and 'result="hit"} 2' in open(path).read():
+            break
+        time.sleep(0.1)
+    assert 'kernda_activation_seconds_count' in open(path).read()
+    assert 'result="hit"} 2' in open(path).read()
@@ -0,0 +1,73 @@
+import json
+import subprocess
+
+import pytest
+
+from kernda.cli import cli
+from kernda.modules import load_command, modulepath_fingerprint, parse_modules
+
+# Stand-in for Lmod's module function that records every call
+FAKE_MODULE_INIT = '''
+module() {
+    echo "$@" >> "$MODULE_CALLS"
+    if [ "$1" = load ]; then
+        shift
+        for m in "$@"; do
+            export LOADEDMODULES="${LOADEDMODULES:+$LOADEDMODULES:}$m"
+            export PATH="/opt/$m/bin:$PATH"
+        done
+    fi
+}
+'''
+
+
+@pytest.fixture
+def lmod(tmpdir, monkeypatch):
+    """Point MODULESHOME and MODULEPATH at a fake module installation."""
+    home = tmpdir.mkdir('lmod')
+    home.mkdir('init').join('bash').write(FAKE_MODULE_INIT)
+    modulepath = tmpdir.mkdir('modulefiles')
+    modulepath.mkdir('gcc')
+    calls = tmpdir.join('calls')
+    calls.write('')
+    monkeypatch.setenv('MODULESHOME', str(home))
+    monkeypatch.setenv('MODULEPATH', str(modulepath))
+    monkeypatch.setenv('MODULE_CALLS', str(calls))
+    monkeypatch.delenv('LOADEDMODULES', raising=False)
+    return modulepath, calls
+
+
+def test_parse_modules():
+    assert parse_modules(['gcc/9,cuda', ' openmpi ']) == ['gcc/9', 'cuda', 'openmpi']
+    assert parse_modules(None) == []
+    assert load_command([]) == ''
+
+
+def test_modulepath_fingerprint(lmod):
+    modulepath, _ = lmod
+    before = modulepath_fingerprint(['gcc/9'])
+    modulepath.join('gcc').join('10.lua').write('')
+    assert modulepath_fingerprint(['gcc/9']) != before
+
+
+def test_modules_loaded_once(venv, lmod):
+    env_dir, spec_path = venv
+    modulepath, calls = lmod
+    assert cli(['-o', spec_path, '--module', 'gcc/9']) == 0
+    with open(spec_path) as f:
+        spec = json.load(f)
+    assert spec['_kernda_mode'] == 'snapshot'
+    assert spec['_kernda_options']['modules'] == ['gcc/9']
+    assert calls.read().strip() == 'load gcc/9'
+
+    # Kernel starts use the cached result and do not call module again
+    spec['argv'][-1] = 'import os; print(os.environ["LOADEDMODULES"])'
+    for _ in range(2):
+        out = subprocess.check_output(spec['argv']).decode('utf8')
+        assert out.strip() == 'gcc/9'
+    assert calls.read().strip() == 'load gcc/9'
+
+    # Changes on MODULEPATH invalidate the cache
+    modulepath.join('gcc').join('10.lua').write('')
+    subprocess.check_output(spec['argv'])
+    assert calls.read().strip().splitlines() == ['load gcc/9', 'load gcc/9']
@@ -0,0 +1,69 @@
+import json
+import os
+import subprocess
+import sys
+
+from kernda import launch, placement, resources
+
+
+def test_numa_nodes(tmpdir):
+    assert placement.parse_cpulist('0-3,8,10-11\n') == [0, 1, 2, 3, 8, 10, 11]
+    tmpdir.mkdir('node0').join('cpulist').write('0-3\n')
+    tmpdir.mkdir('node1').join('cpulist').write('4-7\n')
+    tmpdir.mkdir('power')
+    assert placement.numa_nodes(str(tmpdir), allowed=range(8)) == {
+        0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+    # Nodes without allowed CPUs are skipped
+    assert placement.numa_nodes(str(tmpdir), allowed=[1, 2]) == {0: [1, 2]}
+    assert placement.numa_nodes(str(tmpdir.join('none')), allowed=[0, 1]) == {0: [0, 1]}
+
+
+def test_choose_node():
+    assert placement.choose_node([0, 1], {}, 'round-robin') == 0
+    assert placement.choose_node([0, 1], {}, 'round-robin', last=0) == 1
+    assert placement.choose_node([0, 1], {}, 'round-robin', last=1) == 0
+    assert placement.choose_node([0, 1, 2], {10: 0, 11: 0, 12: 2}, 'least-loaded') == 1
+
+
+def test_allocate(tmpdir):
+    path = str(tmpdir.join('placement.json'))
+    nodes = {0: [0], 1: [1]}
+    dead = subprocess.Popen([sys.executable, '-c', 'pass'])
+    dead.wait()
+    assert placement.allocate('least-loaded', os.getpid(), path, nodes) == (0, [0])
+    assert placement.allocate('least-loaded', dead.pid, path, nodes) == (1, [1])
+    # The exited kernel no longer counts
+    assert placement.allocate('least-loaded', os.getppid(), path, nodes) == (1, [1])
+    with open(path) as f:
+        state = json.load(f)
+    assert state['kernels'] == {str(os.getpid()): 0, str(os.getppid()): 1}
+    assert placement.allocate('round-robin', 1, path, nodes)[0] == 0
+
+
+def test_launch_placement(tmpdir):
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--placement', 'round-robin',
+         '--placement-file', str(tmpdir.join('placement.json')), '--',
+         sys.executable, '-c', 'import os; print(sorted(os.sched_getaffinity(0)))'])
+    cpus = json.loads(out.decode())
+    assert cpus == placement.numa_nodes()[0]
+
+
+def test_launch_placement_and_thread_cap(tmpdir, monkeypatch):
+    allowed = [8]
+
+    def place(policy, argv, path=None):
+        allowed[0] = 4
+        return argv, 1
+    execs = []
+    monkeypatch.setattr(placement, 'place', place)
+    monkeypatch.setattr(resources, 'available_cpus', lambda: allowed[0])
+    monkeypatch.setattr(resources, 'running_kernels', lambda: 0)
+    monkeypatch.setattr(launch, 'detach', lambda *args, **kwargs: None)
+    monkeypatch.setattr(os, 'execvpe', lambda path, argv, env: execs.append(env))
+    for name in resources.THREAD_VARS:
+        monkeypatch.delenv(name, raising=False)
+    launch.main(['--thread-cap', 'auto', '--placement', 'round-robin',
+                 '--launch-log', str(tmpdir.join('launches.jsonl')), '--', 'true'])
+    # The cap counts the CPUs of the node the kernel is pinned to
+    assert execs[0]['OMP_NUM_THREADS'] == '4'
@@ -0,0 +1,99 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from kernda import profile
+from kernda.api import KerndaError, build_spec, read_spec
+from kernda.cli import cli
+
+REPORT = """import time: self [us] | cumulative | imported package
+import time:       265 |        265 |       _json
+import time:       623 |        887 |     json.scanner
+import time:       525 |       9866 |   json.decoder
+import time:       309 |      10837 | json
+"""
+
+KERNELAPP = """import sys
+
+
+class IPKernelApp(object):
+    def start(self):
+        sys.stderr.write('kernel started\\n')
+        sys.stderr.flush()
+"""
+
+
+def test_read_importtime(tmpdir):
+    path = tmpdir.join('t-20240101-000000-1.importtime')
+    path.write('a warning\n' + REPORT)
+    imports = profile.read_importtime(str(path))
+    assert imports[0] == ('_json', 265, 265, 3)
+    assert imports[-1] == ('json', 309, 10837, 0)
+    tmpdir.join('u-20240101-000000-2.importtime').write(
+        REPORT.replace('309 |      10837', '509 |      11037'))
+    assert len(profile.profile_files('importtime', str(tmpdir), 't')) == 1
+    paths = profile.profile_files('importtime', str(tmpdir))
+    top = profile.summarize_imports(paths, top=2)
+    assert [r['module'] for r in top] == ['json.scanner', 'json.decoder']
+    json_row, = [r for r in profile.summarize_imports(paths, sort='cumulative')
+                 if r['module'] == 'json']
+    assert (json_row['launches'], json_row['self_ms']) == (2, 0.409)
+    assert cli(['profile', '--profile-dir', str(tmpdir), '--top', '3']) == 0
+    assert cli(['profile', '--profile-dir', str(tmpdir.join('none'))]) == 1
+
+
+def _launch(tmpdir, mode):
+    fake = tmpdir.mkdir('fake')
+    fake.mkdir('ipykernel').join('__init__.py').write('')
+    fake.join('ipykernel', 'kernelapp.py').write(KERNELAPP)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+        [os.path.dirname(os.path.dirname(profile.__file__)), str(fake)]))
+    code = ('import os; from ipykernel.kernelapp import IPKernelApp; '
+            'IPKernelApp().start(); '
+            'print(sorted(k for k in os.environ if k.startswith("KERNDA_PROFILE")))')
+    proc = subprocess.Popen([sys.executable, '-m', 'kernda.launch', '--profile', mode,
+                             '--profile-dir', str(tmpdir.join('profiles')), '--spec-name',
+                             'fake', '--', sys.executable, '-c', code],
+                            env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    assert proc.returncode == 0, err
+    path, = profile.profile_files(mode, str(tmpdir.join('profiles')), 'fake')
+    return path, out.decode(), err.decode()
+
+
+def test_profile_importtime(tmpdir):
+    path, out, err = _launch(tmpdir, 'importtime')
+    # Only startup is profiled and the kernel gets its stderr back when ready
+    assert out.strip() == '[]'
+    assert 'kernel started' in err and 'import time:' not in err
+    modules = [i[0] for i in profile.read_importtime(path)]
+    assert 'ipykernel.kernelapp' in modules
+    with open(path) as f:
+        assert 'kernel started' not in f.read()
+
+
+def test_profile_cprofile(tmpdir):
+    path, out, err = _launch(tmpdir, 'cprofile')
+    assert 'kernel started' in err
+    rows = profile.summarize_cprofile([path], top=1000)
+    assert rows
+    functions = [r['function'] for r in rows]
+    assert any('kernelapp.py' in f for f in functions)
+    # Profiling stops before the kernel's event loop starts
+    assert not any('kernelapp.py' in f and f.endswith('(start)') for f in functions)
+
+
+def test_profile_source_mode(venv, tmpdir):
+    _, spec_path = venv
+    # The activation script's own Python would be profiled too
+    with pytest.raises(KerndaError):
+        build_spec(read_spec(spec_path), mode='source',
+                   launcher_options={'profile': 'importtime'})
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--profile', 'importtime', '--mode', 'source',
+         '--profile-dir', str(tmpdir.join('profiles')), '--', sys.executable, '-c',
+         'import os; print("PYTHONPROFILEIMPORTTIME" in os.environ)'])
+    assert out.strip() == b'False'
+    assert not tmpdir.join('profiles').check()
@@ -0,0 +1,122 @@
+import glob
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from kernda import pycache
+from kernda.api import KerndaError
+from kernda.cli import cli
+
+
+def test_prefix_dir(tmpdir, monkeypatch):
+    monkeypatch.setenv('KERNDA_PYCACHE_DIR', str(tmpdir.join('root')))
+    assert pycache.pycache_root() == str(tmpdir.join('root'))
+    assert pycache.pycache_root('/fast') == '/fast'
+    env = tmpdir.mkdir('env')
+    assert pycache.interpreter_name(str(env)) == 'python'
+    env.mkdir('lib').mkdir('python3.9')
+    assert pycache.interpreter_name(str(env)) == 'python3.9'
+    prefix = pycache.prefix_dir(str(env))
+    assert prefix.startswith(str(tmpdir.join('root', 'env-')))
+    assert prefix.endswith(os.sep + 'python3.9')
+    assert pycache.prefix_dir(str(tmpdir.mkdir('other').mkdir('env'))) != prefix
+
+
+def _pyc(root, name, age, nbytes=100):
+    path = root.join(name)
+    path.ensure().write('x' * nbytes)
+    used = time.time() - age * 86400
+    os.utime(str(path), (used, used))
+    return path
+
+
+def test_evict(tmpdir):
+    root = tmpdir.mkdir('root')
+    old = _pyc(root, 'env/py/old.pyc', 40)
+    recent = _pyc(root, 'env/py/recent.pyc', 2)
+    newest = _pyc(root, 'env/py/newest.pyc', 1)
+    gone = _pyc(root, 'other/py/gone.pyc', 50)
+    root.join('env', 'py', 'source.py').write('x' * 1000)
+    assert pycache.evict(str(root), max_age=30, max_size=None) == {
+        'removed': 2, 'freed': 200, 'size': 200}
+    assert not old.check() and not gone.check() and recent.check()
+    # Emptied directories go too
+    assert not root.join('other').check()
+    # Least recently used first
+    assert pycache.evict(str(root), max_age=None, max_size=150)['removed'] == 1
+    assert newest.check() and not recent.check()
+
+    assert pycache.claim_eviction(str(root))
+    assert not pycache.claim_eviction(str(root))
+    assert pycache.claim_eviction(str(root), interval=0)
+
+
+def test_apply_pycache(tmpdir):
+    root = str(tmpdir.join('root'))
+    env, prefix = pycache.apply_pycache({'PATH': '/bin'}, str(tmpdir), root)
+    assert env == {'PATH': '/bin', 'PYTHONPYCACHEPREFIX': prefix}
+    assert prefix == pycache.prefix_dir(str(tmpdir), root)
+    assert os.path.isdir(prefix)
+    assert os.stat(root).st_mode & 0o777 == 0o700
+    # A prefix the user set wins
+    env, prefix = pycache.apply_pycache({'PYTHONPYCACHEPREFIX': '/mine'}, str(tmpdir), root)
+    assert prefix == '/mine'
+
+
+def test_warm(venv, tmpdir):
+    env_dir, _ = venv
+    root = str(tmpdir.join('root'))
+    site_packages, = glob.glob(os.path.join(env_dir, 'lib', 'python*', 'site-packages'))
+    os.makedirs(os.path.join(site_packages, 'ipykernel'))
+    for name, source in (('__init__.py', ''), ('kernelapp.py', 'import json\n'),
+                         ('unused.py', 'x = 1\n')):
+        with open(os.path.join(site_packages, 'ipykernel', name), 'w') as f:
+            f.write(source)
+    prefix = pycache.prefix_dir(env_dir, root)
+
+    result = pycache.warm(env_dir, root=root)
+    assert result['prefix'] == prefix
+    assert result['source'] == 'trace'
+    packages = dict((p['module'], p) for p in result['packages'])
+    assert packages['ipykernel'] == {'module': 'ipykernel', 'files': 3, 'compiled': 3,
+                                     'error': None}
+    assert 'json' in packages
+    assert glob.glob(os.path.join(prefix, '**', 'unused.*.pyc'), recursive=True)
+    # Current bytecode is not compiled again
+    result = pycache.warm(env_dir, ['ipykernel.kernelapp', 'nope'], root=root)
+    assert result['source'] == 'modules'
+    assert [(p['module'], p['compiled']) for p in result['packages']] == [
+        ('ipykernel', 0), ('nope', 0)]
+    assert result['packages'][1]['error'] == 'no Python source'
+
+    profiles = tmpdir.mkdir('profiles')
+    for i, modules in enumerate([['email', 'ipykernel'], ['ipykernel']]):
+        profiles.join('fake-20260101-00000{}-1.importtime'.format(i)).write(''.join(
+            'import time: {0} | {0} | {1}\n'.format(10 * len(m), m) for m in modules))
+    result = pycache.warm(env_dir, spec_name='fake', profile_dir=str(profiles), root=root)
+    assert result['source'] == 'profiles'
+    assert [p['module'] for p in result['packages']] == ['ipykernel', 'email']
+
+    with pytest.raises(KerndaError):
+        pycache.warm(os.path.join(env_dir, 'nope'), root=root)
+    assert cli(['warm', env_dir, '--pycache-dir', root, '--module', 'json']) == 0
+
+
+def test_launch_pycache(venv, tmpdir):
+    env_dir, _ = venv
+    root = tmpdir.mkdir('root')
+    old = _pyc(root, 'env/py/old.pyc', 40)
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--env-dir', env_dir, '--pycache',
+         '--pycache-dir', str(root), '--', sys.executable, '-c',
+         'import os; print(os.environ["PYTHONPYCACHEPREFIX"])'])
+    assert out.decode().strip() == pycache.prefix_dir(env_dir, str(root))
+    # Old bytecode is evicted in the background
+    for _ in range(100):
+        if not old.check():
+            break
+        time.sleep(0.05)
+    assert not old.check()
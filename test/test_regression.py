@@ -0,0 +1,74 @@
+import json
+
+from kernda import history, regression
+from kernda.cli import cli
+
+
+def test_mann_whitney():
+    fast = [100.0 + i for i in range(10)]
+    slow = [800.0 + i for i in range(6)]
+    assert regression.mann_whitney_p(fast, slow) < 0.001
+    assert regression.mann_whitney_p(slow, fast) > 0.99
+    assert 0.3 < regression.mann_whitney_p(fast, list(fast)) < 0.7
+    assert regression.mann_whitney_p([], slow) == 1.0
+
+
+def test_package_versions(tmpdir):
+    env_dir = str(tmpdir)
+    meta = tmpdir.mkdir('conda-meta')
+    for fn in ('numpy-1.26.4-py311h_0.json', 'python-3.11.7-h1_0.json', 'history'):
+        meta.join(fn).write('{}')
+    before = regression.package_versions(env_dir)
+    assert before == {'numpy': '1.26.4-py311h_0', 'python': '3.11.7-h1_0'}
+    after = dict(before, numpy='2.0.0-py311h_0', slowhook='1.0-0')
+    del after['python']
+    assert regression.package_diff(before, after) == {
+        'added': {'slowhook': '1.0-0'},
+        'removed': {'python': '3.11.7-h1_0'},
+        'changed': {'numpy': ['1.26.4-py311h_0', '2.0.0-py311h_0']},
+    }
+
+
+def _launch(path, env_dir, fingerprint, ms, t):
+    history.record({'time': t, 'exec': t + ms / 1000.0, 'env_dir': env_dir,
+                    'activation_ms': ms, 'fingerprint': fingerprint}, path)
+    return regression.check(env_dir, fingerprint, path, now=t)
+
+
+def test_regression_after_env_change(tmpdir, capsys, monkeypatch):
+    path = str(tmpdir.join('history.sqlite'))
+    env_dir = str(tmpdir.mkdir('env'))
+    meta = tmpdir.join('env').mkdir('conda-meta')
+    meta.join('numpy-1.26.4-0.json').write('{}')
+
+    t = 1000.0
+    for i in range(10):
+        t += 1
+        assert _launch(path, env_dir, 'fp1', 1000.0 + i * 10, t) == []
+    # A package with a slow activation hook gets installed
+    meta.join('slowhook-1.0-0.json').write('{}')
+    for i in range(4):
+        t += 1
+        assert _launch(path, env_dir, 'fp2', 8000.0 + i * 10, t) == []
+    t += 1
+    events = _launch(path, env_dir, 'fp2', 8100.0, t)
+    assert sorted(e['metric'] for e in events) == ['activation_ms', 'launch_ms']
+    event = events[0]
+    assert event['baseline_ms'] == 1045.0
+    assert event['current_ms'] == 8020.0
+    assert event['packages']['added'] == {'slowhook': '1.0-0'}
+    # The new state became the baseline, so the event is not repeated
+    t += 1
+    assert _launch(path, env_dir, 'fp2', 8000.0, t) == []
+    assert len(regression.regressions(env_dir, path=path)) == 2
+
+    # A harmless change does not raise an event
+    for i in range(6):
+        t += 1
+        assert _launch(path, env_dir, 'fp3', 8000.0 + i, t) == []
+
+    monkeypatch.setenv('KERNDA_HISTORY', path)
+    assert cli(['regressions', '--since', '1000000d']) == 0
+    assert '+ slowhook 1.0-0' in capsys.readouterr().out
+    assert cli(['regressions', '--json', '--since', '1000000d', '--env-dir', env_dir]) == 0
+    assert len(json.loads(capsys.readouterr().out)) == 2
@@ -0,0 +1,157 @@
+import argparse
+import os
+import subprocess
+import sys
+
+import pytest
+
+from kernda import resources
+
+
+def test_cgroup_cpu_quota(tmpdir):
+    root = str(tmpdir)
+    paths = resources.cgroup_paths('0::/user.slice/jupyter\n')
+    assert paths == {'': '/user.slice/jupyter'}
+    tmpdir.mkdir('user.slice').mkdir('jupyter').join('cpu.max').write('max 100000\n')
+    assert resources.cgroup_cpu_quota(root, paths) is None
+    tmpdir.join('user.slice', 'cpu.max').write('250000 100000\n')
+    assert resources.cgroup_cpu_quota(root, paths) == 2.5
+    assert resources.available_cpus(root, paths) <= 3
+
+    # cgroup v1
+    paths = resources.cgroup_paths('4:cpu,cpuacct:/kernels\n1:name=systemd:/\n')
+    assert paths['cpu'] == '/kernels'
+    v1 = tmpdir.mkdir('cpu,cpuacct').mkdir('kernels')
+    v1.join('cpu.cfs_quota_us').write('-1\n')
+    v1.join('cpu.cfs_period_us').write('100000\n')
+    assert resources.cgroup_cpu_quota(root, paths) is None
+    v1.join('cpu.cfs_quota_us').write('50000\n')
+    assert resources.cgroup_cpu_quota(root, paths) == 0.5
+    assert resources.available_cpus(root, paths) == 1
+
+
+def test_thread_caps():
+    assert resources.thread_cap('auto') == 'auto'
+    assert resources.thread_cap('4') == 4
+    with pytest.raises(argparse.ArgumentTypeError):
+        resources.thread_cap('0')
+    assert resources.resolve_thread_cap(4) == 4
+    assert resources.resolve_thread_cap('auto', cpus=64, kernels=29) == 2
+    assert resources.resolve_thread_cap('auto', cpus=4, kernels=10) == 1
+    assert resources.is_kernel_argv(['python', '-m', 'ipykernel_launcher', '-f',
+                                     '/run/jupyter/kernel-1234.json'])
+    assert not resources.is_kernel_argv(['python', '-f', 'other.json'])
+
+    env = resources.apply_thread_caps({'OMP_NUM_THREADS': '8', 'PATH': '/bin'}, 2)
+    # Settings made by the user win
+    assert env['OMP_NUM_THREADS'] == '8'
+    assert env['MKL_NUM_THREADS'] == env['OPENBLAS_NUM_THREADS'] == '2'
+
+
+def test_launch_thread_cap():
+    env = dict(os.environ, MKL_NUM_THREADS='7')
+    env.pop('OMP_NUM_THREADS', None)
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--thread-cap', '3', '--',
+         sys.executable, '-c',
+         'import os; print(os.environ["OMP_NUM_THREADS"], os.environ["MKL_NUM_THREADS"])'],
+        env=env)
+    assert out.split() == [b'3', b'7']
+
+
+def test_sizes():
+    assert resources.size('512M') == 512 * 1024 ** 2
+    assert resources.size('8GiB') == resources.size('8g') == 8 * 1024 ** 3
+    assert resources.size('1.5G') == int(1.5 * 1024 ** 3)
+    assert resources.size('4096') == 4096
+    with pytest.raises(argparse.ArgumentTypeError):
+        resources.size('lots')
+    assert resources.format_size(8 * 1024 ** 3) == '8.0 GiB'
+    assert resources.format_size(100) == '100 B'
+    with pytest.raises(argparse.ArgumentTypeError):
+        resources.cpu_weight('0')
+
+
+def test_check_limits(tmpdir):
+    with pytest.raises(ValueError):
+        resources.check_limits({'memory_max': 1024})
+    assert resources.check_limits({'limit_as': 1024}) == []
+    problems = resources.check_limits({'cgroup': str(tmpdir), 'memory_max': 1024})
+    assert problems == ['{} is not a cgroup v2 directory'.format(tmpdir)]
+    tmpdir.join('cgroup.controllers').write('cpu memory\n')
+    tmpdir.join('cgroup.subtree_control').write('cpu\n')
+    problems = resources.check_limits({'cgroup': str(tmpdir), 'memory_max': 1024,
+                                       'cpu_weight': 50})
+    assert problems == ['the memory controller is not enabled in {}/cgroup.subtree_control'
+                        .format(tmpdir)]
+    assert resources.describe_limits({'limit_as': 2 * 1024 ** 3, 'cgroup': '/cg',
+                                      'memory_max': 1024 ** 3}) == {
+        'address_space': '2.0 GiB', 'cgroup': '/cg/kernel-<pid>', 'memory_max': '1.0 GiB'}
+
+
+def test_enter_cgroup(tmpdir):
+    # A plain directory stands in for the cgroup file system, where empty
+    # cgroups have an empty cgroup.procs
+    tmpdir.mkdir('kernel-1')
+    tmpdir.mkdir('kernel-2').join('cgroup.procs').write('2\n')
+    path = resources.enter_cgroup(str(tmpdir), memory_max=1024, cpu_weight=50, pid=3)
+    assert path == str(tmpdir.join('kernel-3'))
+    assert tmpdir.join('kernel-3', 'memory.max').read() == '1024'
+    assert tmpdir.join('kernel-3', 'cpu.weight').read() == '50'
+    assert tmpdir.join('kernel-3', 'cgroup.procs').read() == '3'
+    assert tmpdir.join('kernel-2').check()
+    assert not tmpdir.join('kernel-1').check()
+
+
+def test_launch_cgroup_after_recording(tmpdir, monkeypatch):
+    from kernda import launch
+    procs = tmpdir.join('kernel-{}'.format(os.getpid()), 'cgroup.procs')
+    events = []
+    monkeypatch.setattr(launch, 'detach', lambda *args, **kwargs: events.append(
+        ('detach', procs.check())))
+    monkeypatch.setattr(os, 'execvpe', lambda path, argv, env: events.append(
+        ('exec', procs.read())))
+    launch.main(['--cgroup', str(tmpdir), '--memory-max', '1G', '--launch-log',
+                 str(tmpdir.join('launches.jsonl')), '--', 'true'])
+    # The detached recorder stays out of the kernel's cgroup
+    assert events == [('detach', False), ('exec', str(os.getpid()))]
+
+
+def test_launch_limits(venv):
+    out = subprocess.check_output(
+        [sys.executable, '-m', 'kernda.launch', '--limit-as', '4G', '--limit-nofile', '100',
+         '--', sys.executable, '-c',
+         'import resource; print(resource.getrlimit(resource.RLIMIT_AS)[0], '
+         'resource.getrlimit(resource.RLIMIT_NOFILE)[0])'])
+    assert out.split() == [str(4 * 1024 ** 3).encode(), b'100']
+
+    from kernda.api import build_spec, read_spec
+    env_dir, spec_path = venv
+    spec, _ = build_spec(read_spec(spec_path), mode='direct',
+                         launcher_options={'limit_as': 4 * 1024 ** 3})
+    assert spec['_kernda_limits'] == {'address_space': '4.0 GiB'}
+    assert spec['argv'][spec['argv'].index('--limit-as') + 1] == str(4 * 1024 ** 3)
+
+
+def test_priority_tiers():
+    assert resources.describe_priority('batch') == \
+        'batch: nice 10, best-effort I/O 7, SCHED_BATCH'
+    assert resources.describe_priority('idle') == 'idle: nice 19, idle I/O, SCHED_IDLE'
+    assert resources.describe_limits({'priority': 'normal'}) == {
+        'priority': 'normal: nice 0, best-effort I/O 4'}
+
+
+def test_launch_priority():
+    code = ('import os; print(os.getpriority(os.PRIO_PROCESS, 0), '
+            'os.sched_getscheduler(0) == os.SCHED_IDLE)')
+    out = subprocess.check_output([sys.executable, '-m', 'kernda.launch', '--priority', 'idle',
+                                   '--', sys.executable, '-c', code])
+    assert out.split() == [b'19', b'True']
+
+    # Python 2 has neither os.setpriority nor os.sched_setscheduler
+    code = ('import os; del os.getpriority, os.setpriority, os.sched_setscheduler; '
+            'from kernda import resources; '
+            'applied, problems = resources.apply_priority("batch"); '
+            'print(applied["nice"], os.nice(0), len(problems))')
+    out = subprocess.check_output([sys.executable, '-c', code])
+    assert out.split() == [b'10', b'10', b'1']
@@ -0,0 +1,110 @@
+import json
+import os
+import threading
+
+import pytest
+
+from kernda import registry
+from kernda.api import KerndaError, read_spec
+from kernda.cli import cli
+from kernda.server import KerndaServer, LatencyStats, request
+
+
+@pytest.fixture
+def server(tmpdir):
+    """Run a kernda server on a temporary socket."""
+    srv = KerndaServer(str(tmpdir.join('kernda.sock')))
+    thread = threading.Thread(target=srv.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_latency_stats():
+    stats = LatencyStats()
+    stats.record('build', 0.002)
+    stats.record('build', 0.004, ok=False)
+    summary = stats.summary()['build']
+    assert summary['count'] == 2
+    assert summary['errors'] == 1
+    assert summary['max_ms'] == pytest.approx(4.0)
+
+
+def test_build_and_status(server, venv):
+    env_dir, spec_path = venv
+    result = request('build', server.path, spec=read_spec(spec_path),
+                     options={'mode': 'snapshot'})
+    assert result['spec']['_kernda_mode'] == 'snapshot'
+    with pytest.raises(KerndaError):
+        request('build', server.path, spec=read_spec(spec_path),
+                options={'backend': 'nope'})
+    with pytest.raises(KerndaError):
+        request('bogus', server.path)
+    status = request('status', server.path)
+    assert status['stats']['build']['count'] == 2
+    assert status['stats']['build']['errors'] == 1
+
+
+def test_cli_client_and_refresh(server, venv):
+    env_dir, spec_path = venv
+    assert cli([spec_path, '-o', '--server', server.path, '--normalize']) == 0
+    assert registry.managed_specs(env_dir) == [spec_path]
+    spec = read_spec(spec_path)
+    assert '--normalize' in spec['argv']
+
+    # Refresh keeps the options the spec was built with
+    spec['argv'] = ['stale']
+    with open(spec_path, 'w') as f:
+        json.dump(spec, f)
+    assert cli(['refresh', '--server', server.path, '--env-dir', env_dir]) == 0
+    assert '--normalize' in read_spec(spec_path)['argv']
+    assert cli(['status', '--socket', server.path]) == 0
+
+
+def test_cli_default_socket(server, venv, monkeypatch):
+    env_dir, spec_path = venv
+    monkeypatch.setenv('KERNDA_SOCKET', server.path)
+    # A bare --server uses the default socket
+    assert cli([spec_path, '-o', '--server']) == 0
+    assert request('status', server.path)['stats']['build']['count'] == 1
+
+
+def test_cli_sends_absolute_env_dir(server, venv, monkeypatch):
+    env_dir, spec_path = venv
+    sent = []
+
+    def recording(op, socket_path=None, timeout=None, **payload):
+        sent.append(payload)
+        return request(op, socket_path, timeout, **payload)
+
+    monkeypatch.setattr('kernda.cli.server.request', recording)
+    monkeypatch.chdir(os.path.dirname(env_dir))
+    name = os.path.basename(env_dir)
+    assert cli([spec_path, '-o', '--server', server.path, '--env-dir', name]) == 0
+    # The server's working directory is not the client's, and warm snapshots are used
+    assert sent[0]['options']['env_dir'] == env_dir
+    assert not sent[0]['options']['refresh']
+    assert cli([spec_path, '-o', '--server', server.path, '--refresh']) == 0
+    assert sent[1]['options']['refresh']
+    assert cli(['refresh', '--server', server.path, '--env-dir', name]) == 0
+    assert sent[2]['env_dir'] == env_dir
+
+
+def test_refuses_running_socket(server):
+    with pytest.raises(KerndaError):
+        KerndaServer(server.path)
+
+
+def test_private_socket(tmpdir):
+    umask = os.umask(0)
+    try:
+        srv = KerndaServer(str(tmpdir.join('kernda.sock')))
+    finally:
+        os.umask(umask)
+    try:
+        # Only the user can connect
+        assert os.stat(srv.path).st_mode & 0o077 == 0
+    finally:
+        srv.server_close()
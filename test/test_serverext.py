@@ -0,0 +1,101 @@
+import asyncio
+import json
+import shutil
+
+import pytest
+
+pytest.importorskip('jupyter_server')
+pytest.importorskip('pytest_jupyter')
+
+from tornado.httpclient import HTTPClientError  # noqa: E402
+
+from kernda import serverext  # noqa: E402
+from kernda.api import build_spec, read_spec, write_spec  # noqa: E402
+
+pytest_plugins = ['pytest_jupyter.jupyter_server']
+
+
+@pytest.fixture
+def jp_server_config():
+    return {'ServerApp': {'jpserver_extensions': {'kernda': True}}}
+
+
+@pytest.fixture
+def kernel(venv, jp_data_dir):
+    """Install a kernda spec of the venv as kernda-venv."""
+    _, spec_path = venv
+    spec, _ = build_spec(read_spec(spec_path), mode='snapshot')
+    path = jp_data_dir.joinpath('kernels', 'kernda-venv', 'kernel.json')
+    path.parent.mkdir(parents=True)
+    write_spec(str(path), spec)
+    return str(path)
+
+
+async def _get(jp_fetch, *parts):
+    response = await jp_fetch('kernda', *parts)
+    return json.loads(response.body.decode())
+
+
+async def test_status(jp_fetch, kernel):
+    status = (await _get(jp_fetch, 'status'))['kernelspecs']
+    assert status['kernda-venv']['managed']
+    assert status['kernda-venv']['mode'] == 'snapshot'
+    assert status['kernda-venv']['snapshot']['state'] == 'fresh'
+    assert status['kernda-venv']['path'] == kernel
+
+
+async def _wait(jp_fetch, job):
+    for _ in range(100):
+        state = await _get(jp_fetch, 'refresh', job)
+        if state['state'] != 'running':
+            return state
+        await asyncio.sleep(0.05)
+    raise AssertionError('refresh job did not finish')
+
+
+async def test_refresh(jp_fetch, kernel, cache_dir):
+    response = await jp_fetch('kernda', 'refresh', method='POST',
+                              body=json.dumps({'names': ['kernda-venv']}))
+    assert response.code == 202
+    job = json.loads(response.body.decode())
+    assert job['paths'] == [kernel]
+    state = await _wait(jp_fetch, job['job'])
+    assert state['state'] == 'done'
+    assert state['results'][kernel]['ok']
+
+    # Without names, only specs with stale or missing snapshots
+    shutil.rmtree(str(cache_dir))
+    response = await jp_fetch('kernda', 'refresh', method='POST', body='{}')
+    job = json.loads(response.body.decode())
+    assert job['paths'] == [kernel]
+    assert (await _wait(jp_fetch, job['job']))['state'] == 'done'
+    status = (await _get(jp_fetch, 'status'))['kernelspecs']
+    assert status['kernda-venv']['snapshot']['state'] == 'fresh'
+
+
+async def test_refresh_jobs_are_capped(jp_fetch, kernel, monkeypatch):
+    monkeypatch.setattr(serverext, 'MAX_JOBS', 2)
+    jobs = []
+    for _ in range(3):
+        response = await jp_fetch('kernda', 'refresh', method='POST',
+                                  body=json.dumps({'names': ['kernda-venv']}))
+        jobs.append(json.loads(response.body.decode())['job'])
+    # Only the last jobs are kept
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch('kernda', 'refresh', jobs[0])
+    assert e.value.code == 404
+    for job in jobs[1:]:
+        assert (await _wait(jp_fetch, job))['state'] == 'done'
+
+
+async def test_refresh_errors(jp_fetch, kernel):
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch('kernda', 'refresh', method='POST',
+                       body=json.dumps({'names': ['nope']}))
+    assert e.value.code == 400
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch('kernda', 'refresh', 'nope')
+    assert e.value.code == 404
+    with pytest.raises(HTTPClientError) as e:
+        await jp_fetch('kernda', 'refresh')
+    assert e.value.code == 405
@@ -0,0 +1,51 @@
+import os
+import subprocess
+
+from kernda.api import read_spec
+from kernda.cli import cli
+from kernda.launchlog import read_launches, record_launch
+from kernda.status import collect_status, latency_summary, stale_paths
+
+
+def test_launch_log_roundtrip(tmpdir):
+    path = str(tmpdir.join('sub', 'launches.jsonl'))
+    for i in range(5):
+        record_launch({'spec': 'a' if i % 2 else 'b', 'activation_ms': i}, path)
+    assert [r['activation_ms'] for r in read_launches(path, spec='a')] == [1, 3]
+    assert len(read_launches(path, limit=2)) == 2
+    assert read_launches(str(tmpdir.join('missing'))) == []
+
+
+def test_latency_summary():
+    records = [{'time': i, 'activation_ms': float(i), 'cache_hit': i > 0}
+               for i in range(1, 11)]
+    summary = latency_summary(records)
+    assert summary['count'] == 10
+    assert summary['p50_ms'] == 5.0
+    assert summary['max_ms'] == 10.0
+    assert summary['cache_hit_rate'] == 1.0
+
+
+def test_collect_status(venv, tmpdir):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path, '--mode', 'snapshot']) == 0
+    spec = read_spec(spec_path)
+    subprocess.check_output(spec['argv'])
+
+    kernel_dir = os.path.dirname(spec_path)
+    status = collect_status({'venv': kernel_dir})['venv']
+    assert status['mode'] == 'snapshot'
+    assert status['snapshot']['state'] == 'fresh'
+    # The spec name defaults to the kernel directory name
+    name = os.path.basename(kernel_dir)
+    status = collect_status({name: kernel_dir})[name]
+    assert status['activation']['count'] == 1
+    assert status['activation']['cache_hit_rate'] == 1.0
+    assert stale_paths({name: status}) == []
+
+    # Changing the environment makes the snapshot stale
+    with open(os.path.join(env_dir, 'pyvenv.cfg'), 'a') as f:
+        f.write('# changed\n')
+    status = collect_status({name: kernel_dir})[name]
+    assert status['snapshot']['state'] == 'stale'
+    assert stale_paths({name: status}) == [spec_path]
@@ -0,0 +1,87 @@
+import glob
+import json
+import os
+import subprocess
+import time
+
+from kernda import tracing
+from kernda.api import read_spec
+from kernda.cli import cli
+
+
+def test_traceparent():
+    trace_id, span_id = 'ab' * 16, 'cd' * 8
+    value = tracing.format_traceparent(trace_id, span_id)
+    assert tracing.parse_traceparent(value) == (trace_id, span_id)
+    assert tracing.parse_traceparent(None) is None
+    assert tracing.parse_traceparent('00-{}-{}-01'.format('0' * 32, span_id)) is None
+    assert tracing.parse_traceparent('garbage') is None
+
+
+def test_launch_spans():
+    record = {'time': 1.0, 'resolved': 1.25, 'activated': 2.0, 'exec': 2.5,
+              'trace_id': 'ab' * 16, 'span_id': 'cd' * 8, 'parent_span_id': 'ef' * 8,
+              'spec': 'py3', 'cache_hit': False, 'pid': 42,
+              'hooks': [{'path': '/env/etc/conda/activate.d/x.sh', 'start': 1.5, 'ms': 250.0}]}
+    spans = tracing.launch_spans(record)
+    by_name = dict((s['name'], s) for s in spans)
+    root = spans[0]
+    assert root['name'] == 'kernda.launch'
+    assert root['parentSpanId'] == 'ef' * 8
+    assert (root['startTimeUnixNano'], root['endTimeUnixNano']) == ('1000000000', '2500000000')
+    assert {'key': 'process.pid', 'value': {'intValue': '42'}} in root['attributes']
+    assert {'key': 'kernda.cache_hit', 'value': {'boolValue': False}} in root['attributes']
+    assert by_name['kernda.resolve']['endTimeUnixNano'] == '1250000000'
+    assert by_name['kernda.hook']['parentSpanId'] == by_name['kernda.activate']['spanId']
+    assert by_name['kernda.hook']['endTimeUnixNano'] == '1750000000'
+    assert all(s['traceId'] == 'ab' * 16 for s in spans)
+
+    # Source mode activates after the exec unless it was timed
+    source = dict(record, mode='source', kernel_ready=4.0)
+    del source['hooks']
+    spans = tracing.launch_spans(source)
+    assert [s['name'] for s in spans] == ['kernda.launch', 'kernda.exec']
+    assert {'key': 'kernda.includes_activation', 'value': {'boolValue': True}} in \
+        spans[1]['attributes']
+    spans = tracing.launch_spans(dict(source, shell_start=1.1))
+    assert [s['name'] for s in spans] == ['kernda.launch', 'kernda.resolve', 'kernda.activate',
+                                          'kernda.exec']
+
+
+def test_connection_file():
+    assert tracing.connection_file(['python', '-m', 'ipykernel', '-f', 'c.json']) == 'c.json'
+    assert tracing.connection_file(['bash', '-c', 'source a && exec python -f "x y.json"']) == \
+        'x y.json'
+    assert tracing.connection_file(['python']) is None
+
+
+def test_launcher_writes_trace(venv, tmpdir, monkeypatch):
+    env_dir, spec_path = venv
+    trace_dir = str(tmpdir.join('traces'))
+    with open(spec_path) as f:
+        spec = json.load(f)
+    spec['argv'][-1] = 'import os; print(os.environ["TRACEPARENT"])'
+    with open(spec_path, 'w') as f:
+        json.dump(spec, f)
+    assert cli(['-o', spec_path, '--mode', 'snapshot', '--trace-dir', trace_dir]) == 0
+
+    parent = tracing.format_traceparent('12' * 16, '34' * 8)
+    monkeypatch.setenv('TRACEPARENT', parent)
+    out = subprocess.check_output(read_spec(spec_path)['argv']).decode('utf8').strip()
+    # The kernel sees the launcher's root span as its parent
+    trace_id, span_id = tracing.parse_traceparent(out)
+    assert trace_id == '12' * 16
+
+    path = os.path.join(trace_dir, '{}-{}.json'.format(trace_id, span_id))
+    for _ in range(50):
+        if os.path.exists(path):
+            break
+        time.sleep(0.1)
+    with open(path) as f:
+        request = json.load(f)
+    spans = request['resourceSpans'][0]['scopeSpans'][0]['spans']
+    assert spans[0]['parentSpanId'] == '34' * 8
+    assert [s['name'] for s in spans] == ['kernda.launch', 'kernda.resolve',
+                                          'kernda.activate', 'kernda.exec']
+    assert glob.glob(os.path.join(trace_dir, '*.json')) == [path]
+
@@ -0,0 +1,9 @@
+from kernda.util import percentile
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([1.5], 95) == 1.5
+    assert percentile([], 50) is None
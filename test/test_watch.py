@@ -0,0 +1,58 @@
+import threading
+import time
+
+import pytest
+
+from kernda.cli import cli
+from kernda.watch import Debouncer, InotifyWatcher, PollingWatcher, watch
+
+
+def test_debouncer():
+    debouncer = Debouncer(2.0)
+    debouncer.add('a', now=0)
+    debouncer.add('a', now=1.5)
+    assert debouncer.ready(now=3) == []
+    assert debouncer.next_timeout(10, now=3) == pytest.approx(0.5)
+    assert debouncer.ready(now=3.5) == ['a']
+    assert debouncer.next_timeout(10) == 10
+
+
+@pytest.mark.parametrize('factory', [lambda: PollingWatcher(0.05), InotifyWatcher])
+def test_watchers_detect_changes(factory, venv):
+    env_dir, _ = venv
+    watcher = factory()
+    try:
+        watcher.watch(env_dir)
+        assert watcher.wait(0.1) == set()
+        time.sleep(0.01)
+        with open(env_dir + '/bin/new-tool', 'w') as f:
+            f.write('')
+        assert watcher.wait(2) == set([env_dir])
+    finally:
+        watcher.close()
+
+
+def test_watch_refreshes_managed_env(venv):
+    env_dir, spec_path = venv
+    assert cli(['-o', spec_path]) == 0
+    refreshed = []
+    stop = threading.Event()
+
+    def refresh(env, log=None):
+        refreshed.append(env)
+        stop.set()
+
+    thread = threading.Thread(target=watch, kwargs=dict(
+        delay=0.2, stop=stop, refresh=refresh))
+    thread.start()
+    try:
+        time.sleep(0.3)
+        for i in range(5):
+            with open(env_dir + '/bin/tool-{}'.format(i), 'w') as f:
+                f.write('')
+        stop.wait(10)
+    finally:
+        stop.set()
+        thread.join(10)
+    # The burst of changes results in a single refresh
+    assert refreshed == [env_dir]